@@ -0,0 +1,184 @@
+"""Load test of every API route at set concurrency levels, reports throughput and latency percentiles as JSON.
+
+Run from the project root:
+python -m benchmarks.bench_api [--size menus submenus dishes] [--concurrency 1 10 50] [--requests 200]
+    [--url http://localhost:8000] [--fake-redis] [--output report.json]
+The catalog is generated in the database of SQLALCHEMY_DATABASE_URL and deleted afterwards. Requests go to the
+application in this process unless --url is given. With SQLALCHEMY_DATABASE_URL=sqlite+aiosqlite:///bench.db
+and --fake-redis it runs offline, routes that change the catalog are run on PostgreSQL only.
+"""
+import argparse
+import asyncio
+import itertools
+from collections.abc import Awaitable, Callable
+from contextlib import AsyncExitStack
+
+import httpx
+from asgi_lifespan import LifespanManager
+from fastapi.routing import APIRoute
+
+from menuapp import config
+from menuapp.database import SessionLocal, engine
+from menuapp.main import app
+
+from .catalog import Catalog, drop, load
+from .driver import drive, use_fake_redis, write_report
+
+MENUS = "/api/v1/menus"
+SKIPPED = {
+    "POST /api/v1/fill/": "drops all tables",
+    "POST /api/v1/xl/create/": "needs Celery worker",
+    "GET /api/v1/xl/get/": "needs Celery worker",
+    "GET /debug/profiles": "profiler is disabled",
+}
+
+
+class Routes:
+    """Requests to every route over the generated catalog.
+
+    Rows created by POST routes are deleted by DELETE routes, so they must run in that order.
+    """
+
+    def __init__(self, client: httpx.AsyncClient, catalog: Catalog):
+        self.client = client
+        self.catalog = catalog
+        self.serial = itertools.count()
+        self.created: dict[str, list[str]] = {"menus": [], "submenus": [], "dishes": []}
+
+    def title(self) -> str:
+        """Returns new title, titles keep the prefix of the catalog, so the rows are deleted along with it"""
+        return f"{self.catalog.prefix} new {next(self.serial)}"
+
+    def menu(self, i: int) -> str:
+        return f"{MENUS}/{self.catalog.menus[i % len(self.catalog.menus)]}"
+
+    def submenu(self, i: int) -> str:
+        menu_id, submenu_id = self.catalog.submenus[i % len(self.catalog.submenus)]
+        return f"{MENUS}/{menu_id}/submenus/{submenu_id}"
+
+    def dish(self, i: int) -> str:
+        menu_id, submenu_id, dish_id = self.catalog.dishes[i % len(self.catalog.dishes)]
+        return f"{MENUS}/{menu_id}/submenus/{submenu_id}/dishes/{dish_id}"
+
+    async def get(self, url: str) -> bool:
+        return (await self.client.get(url)).is_success
+
+    async def create(self, kind: str, url: str, data: dict) -> bool:
+        response = await self.client.post(url, json=data)
+        if response.is_success:
+            self.created[kind].append(f"{url.rstrip('/')}/{response.json()['id']}")
+        return response.is_success
+
+    async def update(self, url: str, data: dict) -> bool:
+        return (await self.client.patch(url, json=data)).is_success
+
+    async def delete(self, kind: str) -> bool:
+        """Deletes a row created by the POST route of the kind"""
+        if not self.created[kind]:
+            return False
+        return (await self.client.delete(self.created[kind].pop())).is_success
+
+    async def batch(self, url: str) -> bool:
+        item = {"title": self.title(), "description": "batch", "price": "1.99"}
+        return (await self.client.post(url, json={"create": [item]})).is_success
+
+    def scenarios(self) -> dict[str, Callable[[int], Awaitable[bool]]]:
+        """Returns calls by route"""
+        return {
+            "GET /api/v1/menus/": lambda i: self.get(f"{MENUS}/"),
+            "GET /api/v1/menus/tree": lambda i: self.get(f"{MENUS}/tree"),
+            "GET /api/v1/catalog": lambda i: self.get("/api/v1/catalog"),
+            "GET /api/v1/menus/{menu_id}": lambda i: self.get(self.menu(i)),
+            "GET /api/v1/menus/{menu_id}/tree": lambda i: self.get(f"{self.menu(i)}/tree"),
+            "GET /api/v1/menus/{menu_id}/submenus": lambda i: self.get(f"{self.menu(i)}/submenus"),
+            "GET /api/v1/menus/{menu_id}/submenus/{submenu_id}": lambda i: self.get(self.submenu(i)),
+            "GET /api/v1/menus/{menu_id}/submenus/{submenu_id}/dishes": lambda i: self.get(f"{self.submenu(i)}/dishes"),
+            "GET /api/v1/menus/{menu_id}/submenus/{submenu_id}/dishes/{dish_id}": lambda i: self.get(self.dish(i)),
+            "GET /metrics": lambda i: self.get("/metrics"),
+            "POST /api/v1/menus/": lambda i: self.create("menus", f"{MENUS}/", {"title": self.title()}),
+            "PATCH /api/v1/menus/{menu_id}": lambda i: self.update(self.menu(i), {"title": self.title()}),
+            "DELETE /api/v1/menus/{menu_id}": lambda i: self.delete("menus"),
+            "POST /api/v1/menus/{menu_id}/submenus": lambda i: self.create(
+                "submenus", f"{self.menu(i)}/submenus", {"title": self.title()}
+            ),
+            "PATCH /api/v1/menus/{menu_id}/submenus/{submenu_id}": lambda i: self.update(
+                self.submenu(i), {"title": self.title()}
+            ),
+            "DELETE /api/v1/menus/{menu_id}/submenus/{submenu_id}": lambda i: self.delete("submenus"),
+            "POST /api/v1/menus/{menu_id}/submenus:batch": lambda i: self.batch(f"{self.menu(i)}/submenus:batch"),
+            "POST /api/v1/menus/{menu_id}/submenus/{submenu_id}/dishes": lambda i: self.create(
+                "dishes", f"{self.submenu(i)}/dishes", {"title": self.title(), "price": "1.99"}
+            ),
+            "PATCH /api/v1/menus/{menu_id}/submenus/{submenu_id}/dishes/{dish_id}": lambda i: self.update(
+                self.dish(i), {"title": self.title(), "price": "2.99"}
+            ),
+            "DELETE /api/v1/menus/{menu_id}/submenus/{submenu_id}/dishes/{dish_id}": lambda i: self.delete("dishes"),
+            "POST /api/v1/menus/{menu_id}/submenus/{submenu_id}/dishes:batch": lambda i: self.batch(
+                f"{self.submenu(i)}/dishes:batch"
+            ),
+        }
+
+
+def skipped(scenarios: dict, writes: bool) -> dict[str, str]:
+    """Returns reasons routes of the application are not benchmarked, new routes without a scenario show up here"""
+    reasons = {}
+    for route in app.routes:
+        if not isinstance(route, APIRoute):
+            continue
+        for method in route.methods:
+            name = f"{method} {route.path}"
+            if name not in scenarios:
+                reasons[name] = SKIPPED.get(name, "no scenario")
+            elif method != "GET" and not writes:
+                reasons[name] = "needs PostgreSQL"
+    return reasons
+
+
+async def run(size: tuple[int, int, int], levels: list[int], requests: int, url: str | None) -> tuple[dict, dict]:
+    writes = engine.dialect.name == "postgresql"
+    async with AsyncExitStack() as stack:
+        if url is None:
+            await stack.enter_async_context(LifespanManager(app))
+        async with SessionLocal() as db:
+            catalog = await load(size, db)
+        try:
+            transport = {"base_url": url} if url else {"app": app, "base_url": "http://bench"}
+            async with httpx.AsyncClient(timeout=None, **transport) as client:
+                scenarios = Routes(client, catalog).scenarios()
+                skips = skipped(scenarios, writes)
+                results = {}
+                for name, call in scenarios.items():
+                    if name not in skips:
+                        results[name] = {str(level): await drive(call, requests, level) for level in levels}
+        finally:
+            async with SessionLocal() as db:
+                await drop(catalog.prefix, db)
+    return results, skips
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size", type=int, nargs=3, default=[10, 10, 10], metavar=("MENUS", "SUBMENUS", "DISHES"))
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 10, 50])
+    parser.add_argument("--requests", type=int, default=200, help="requests per route and concurrency level")
+    parser.add_argument("--url", help="benchmark running application instead of the one in this process")
+    parser.add_argument("--fake-redis", action="store_true", help="use in-process fakeredis instead of Redis")
+    parser.add_argument("--output", help="write JSON report to the file instead of stdout")
+    args = parser.parse_args()
+    if args.fake_redis:
+        use_fake_redis()
+    results, skips = asyncio.run(run(tuple(args.size), args.concurrency, args.requests, args.url))
+    meta = {
+        "benchmark": "api",
+        "target": args.url or "in-process",
+        "database": engine.dialect.name,
+        "redis": "fakeredis" if args.fake_redis else f"{config.REDIS_HOST}:{config.REDIS_PORT}",
+        "catalog": dict(zip(("menus", "submenus", "dishes"), args.size)),
+        "requests": args.requests,
+        "skipped": skips,
+    }
+    write_report(results, meta, args.output)
+
+
+if __name__ == "__main__":
+    main()
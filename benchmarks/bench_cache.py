@@ -0,0 +1,107 @@
+"""Benchmarks the cache layer at set concurrency levels, reports throughput and latency percentiles as JSON.
+
+Run from the project root:
+python -m benchmarks.bench_cache [--concurrency 1 10 50] [--requests 1000] [--fake-redis] [--output report.json]
+Values are cached under /bench-cache/ and deleted afterwards. Deleting values changes the catalog version,
+so run it against a Redis that no running application uses, or with --fake-redis.
+"""
+import argparse
+import asyncio
+import itertools
+from collections.abc import Awaitable, Callable
+
+from menuapp import cache, config
+
+from .bench_codecs import payloads
+from .driver import drive, use_fake_redis, write_report
+
+PREFIX = "/bench-cache"
+# Values are spread over a few keys, so that concurrent calls do not all touch the same one
+KEYS = 10
+
+
+def key(name: str, i) -> str:
+    """Returns url of the value, urls do not end with an id, so they are not counted as menu hierarchy nodes"""
+    return f"{PREFIX}/{name.replace(' ', '-')}-{i}"
+
+
+def scenarios(name: str, value) -> dict[str, Callable[[int], Awaitable[bool]]]:
+    """Returns calls by cache operation, values set by the first ones are read and deleted by the later ones"""
+    misses = itertools.count()
+
+    async def load(db):
+        return value
+
+    async def set_value(i: int) -> bool:
+        await cache.set_cache(key(name, i % KEYS), value)
+        return True
+
+    async def get_value(i: int) -> bool:
+        return await cache.get_cache(key(name, i % KEYS)) is not None
+
+    async def read_local(i: int) -> bool:
+        return await cache.read_json(key(name, i % KEYS), load, None) is not None
+
+    async def read_redis(i: int) -> bool:
+        url = key(name, i % KEYS)
+        cache.local_cache.discard(url)
+        return await cache.read_json(url, load, None) is not None
+
+    async def read_miss(i: int) -> bool:
+        return await cache.read_json(key(name, f"miss-{next(misses)}"), load, None) is not None
+
+    async def delete_value(i: int) -> bool:
+        await cache.delete_cache(key(name, i % KEYS))
+        return True
+
+    return {
+        "set_cache": set_value,
+        "get_cache": get_value,
+        "read_json local": read_local,
+        "read_json redis": read_redis,
+        "read_json miss": read_miss,
+        "delete_cache": delete_value,
+    }
+
+
+async def clean():
+    keys = [key async for key in cache.client().scan_iter(match=f"*{PREFIX}/*")]
+    if keys:
+        await cache.client().delete(*keys)
+    cache.local_cache.clear()
+
+
+async def run(levels: list[int], requests: int) -> dict:
+    results = {}
+    try:
+        for name, value in payloads().items():
+            for operation, call in scenarios(name, value).items():
+                results[f"{operation} {name}"] = {str(level): await drive(call, requests, level) for level in levels}
+    finally:
+        await clean()
+        await cache.stop()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 10, 50])
+    parser.add_argument("--requests", type=int, default=1_000, help="calls per operation and concurrency level")
+    parser.add_argument("--fake-redis", action="store_true", help="use in-process fakeredis instead of Redis")
+    parser.add_argument("--output", help="write JSON report to the file instead of stdout")
+    args = parser.parse_args()
+    if args.fake_redis:
+        use_fake_redis()
+    results = asyncio.run(run(args.concurrency, args.requests))
+    meta = {
+        "benchmark": "cache",
+        "redis": "fakeredis" if args.fake_redis else f"{config.REDIS_HOST}:{config.REDIS_PORT}",
+        "codec": cache.codec.name,
+        "local_cache_size": config.LOCAL_CACHE_SIZE,
+        "requests": args.requests,
+    }
+    write_report(results, meta, args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,40 @@
+"""Compares cache codecs by encoding and decoding time and by payload size.
+
+Run from the project root: python -m benchmarks.bench_codecs [rounds]
+"""
+import sys
+import time
+
+from menuapp.codecs import CODECS
+
+
+def payloads():
+    """Returns cached values as they are rendered by response schemes"""
+    menu = {"id": "1", "title": "Меню 1", "description": "Описание меню 1", "submenus_count": 10, "dishes_count": 500}
+    submenu = {"id": "1", "title": "Подменю 1", "description": "Описание подменю 1", "dishes_count": 50}
+    dishes = [
+        {"id": str(i), "title": f"Блюдо {i}", "description": f"Описание блюда {i}", "price": f"{i % 1000}.99"}
+        for i in range(500)
+    ]
+    return {"menu": menu, "submenu": submenu, "dish": dishes[0], "500 dishes": dishes}
+
+
+def measure(func, arg, rounds: int) -> float:
+    start = time.perf_counter()
+    for _ in range(rounds):
+        func(arg)
+    return (time.perf_counter() - start) / rounds
+
+
+def main(rounds: int):
+    print(f"{'payload':>12} {'codec':>8} {'bytes':>8} {'dumps us':>10} {'loads us':>10}")
+    for name, value in payloads().items():
+        for codec in CODECS.values():
+            data = codec.dumps(value)
+            dumps = measure(codec.dumps, value, rounds)
+            loads = measure(codec.loads, data, rounds)
+            print(f"{name:>12} {codec.name:>8} {len(data):>8} {dumps * 1e6:>10.2f} {loads * 1e6:>10.2f}")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 1_000)
@@ -0,0 +1,72 @@
+"""Measures how excel export time and memory grow with dish count, reports them as JSON.
+
+Run from the project root: python -m benchmarks.bench_export [dishes ...] [--rounds 3] [--output report.json]
+"""
+import argparse
+import os
+import resource
+import tempfile
+import time
+
+from transport.save_as_excel import convert_to_excel
+
+from .driver import summarize, write_report
+
+SUBMENUS_PER_MENU = 10
+DISHES_PER_SUBMENU = 50
+
+
+def generate_rows(dishes: int):
+    """Yields joined menu rows ordered by menu and submenu"""
+    per_menu = SUBMENUS_PER_MENU * DISHES_PER_SUBMENU
+    for i in range(dishes):
+        menu, submenu = i // per_menu, i // DISHES_PER_SUBMENU
+        yield (
+            menu,
+            f"menu {menu}",
+            f"menu {menu} description",
+            per_menu,
+            submenu,
+            f"submenu {submenu}",
+            f"submenu {submenu} description",
+            DISHES_PER_SUBMENU,
+            f"dish {i}",
+            f"dish {i} description",
+            f"{i % 1000}.99",
+        )
+
+
+def run(dishes: int, rounds: int, path: str) -> dict:
+    latencies = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        convert_to_excel(generate_rows(dishes), path)
+        latencies.append(time.perf_counter() - start)
+    result = summarize(latencies, sum(latencies))
+    result["rows_per_second"] = round(dishes * rounds / sum(latencies), 2)
+    # ru_maxrss is the peak resident size of the process so far, in KiB on Linux
+    result["max_rss_mib"] = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 2**10, 2)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("dishes", type=int, nargs="*", default=[1_000, 10_000, 50_000, 200_000])
+    parser.add_argument("--rounds", type=int, default=3, help="exports per dish count")
+    parser.add_argument("--output", help="write JSON report to the file instead of stdout")
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "bench_menu.xlsx")
+        # convert_menu only passes rows on to convert_to_excel, so it is not measured separately
+        results = {"convert_to_excel": {str(dishes): run(dishes, args.rounds, path) for dishes in args.dishes}}
+    meta = {
+        "benchmark": "export",
+        "submenus_per_menu": SUBMENUS_PER_MENU,
+        "dishes_per_submenu": DISHES_PER_SUBMENU,
+        "rounds": args.rounds,
+    }
+    write_report(results, meta, args.output)
+
+
+if __name__ == "__main__":
+    main()
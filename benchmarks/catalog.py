@@ -0,0 +1,105 @@
+"""Generates catalogs of menus × submenus × dishes for benchmarks.
+
+Run from the project root: python -m benchmarks.catalog menus submenus dishes [path]
+writes CSV catalog that python -m menuapp.importer loads.
+"""
+import csv
+import os
+import sys
+import tempfile
+import uuid
+from collections.abc import Iterator
+from typing import NamedTuple
+
+from sqlalchemy import delete, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from menuapp import models
+from menuapp.importer import import_catalog
+
+FIELDS = (
+    "menu_title",
+    "menu_description",
+    "submenu_title",
+    "submenu_description",
+    "dish_title",
+    "dish_description",
+    "dish_price",
+)
+
+
+class Catalog(NamedTuple):
+    """Ids of a generated catalog, submenus and dishes come with the ids of their parents"""
+
+    prefix: str
+    menus: list[int]
+    submenus: list[tuple[int, int]]
+    dishes: list[tuple[int, int, int]]
+
+
+def generate(menus: int, submenus: int, dishes: int, prefix: str = "bench") -> Iterator[dict]:
+    """Yields CSV rows of menus with submenus submenus each and dishes dishes in every submenu"""
+    for m in range(menus):
+        menu = {"menu_title": f"{prefix} menu {m}", "menu_description": f"{prefix} menu {m} description"}
+        for s in range(submenus):
+            submenu = {
+                **menu,
+                "submenu_title": f"{prefix} submenu {m}.{s}",
+                "submenu_description": f"{prefix} submenu {m}.{s} description",
+            }
+            if not dishes:
+                yield submenu
+            for d in range(dishes):
+                yield {
+                    **submenu,
+                    "dish_title": f"{prefix} dish {m}.{s}.{d}",
+                    "dish_description": f"{prefix} dish {m}.{s}.{d} description",
+                    "dish_price": f"{(m + s + d) % 1000}.99",
+                }
+
+
+def write_csv(path: str, menus: int, submenus: int, dishes: int, prefix: str = "bench"):
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        writer = csv.DictWriter(f, FIELDS)
+        writer.writeheader()
+        writer.writerows(generate(menus, submenus, dishes, prefix))
+
+
+async def load(size: tuple[int, int, int], db: AsyncSession) -> Catalog:
+    """Imports catalog of the size with titles of a unique prefix, so that it does not collide with existing rows"""
+    prefix = f"bench {uuid.uuid4().hex[:8]}"
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "catalog.csv")
+        write_csv(path, *size, prefix=prefix)
+        await import_catalog(path, db)
+    menus = select(models.Menu.id).where(models.Menu.title.startswith(prefix))
+    menu_ids = menus.scalar_subquery()
+    submenus = select(models.Submenu.menu_id, models.Submenu.id).where(models.Submenu.menu_id.in_(menu_ids))
+    dishes = select(models.Dish.menu_id, models.Dish.submenu_id, models.Dish.id).where(
+        models.Dish.menu_id.in_(menu_ids)
+    )
+    return Catalog(
+        prefix,
+        (await db.execute(menus.order_by(models.Menu.id))).scalars().all(),
+        [(menu_id, submenu_id) for menu_id, submenu_id in await db.execute(submenus.order_by(models.Submenu.id))],
+        [
+            (menu_id, submenu_id, dish_id)
+            for menu_id, submenu_id, dish_id in await db.execute(dishes.order_by(models.Dish.id))
+        ],
+    )
+
+
+async def drop(prefix: str, db: AsyncSession):
+    """Deletes menus with titles of the prefix along with everything under them"""
+    menu_ids = select(models.Menu.id).where(models.Menu.title.startswith(prefix)).scalar_subquery()
+    for model, parent in ((models.Dish, models.Dish.menu_id), (models.Submenu, models.Submenu.menu_id)):
+        await db.execute(delete(model).where(parent.in_(menu_ids)).execution_options(synchronize_session=False))
+    await db.execute(
+        delete(models.Menu).where(models.Menu.title.startswith(prefix)).execution_options(synchronize_session=False)
+    )
+    await db.commit()
+
+
+if __name__ == "__main__":
+    menus, submenus, dishes = map(int, sys.argv[1:4])
+    write_csv(sys.argv[4] if len(sys.argv) > 4 else "catalog.csv", menus, submenus, dishes)
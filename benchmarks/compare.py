@@ -0,0 +1,39 @@
+"""Compares two JSON reports of the same benchmark, exits with status 1 if latency regressed.
+
+Run from the project root: python -m benchmarks.compare old.json new.json [--metric p95_ms] [--threshold 0.2]
+"""
+import argparse
+import json
+import sys
+
+
+def regressions(old: dict, new: dict, metric: str, threshold: float) -> list[tuple[str, str, float, float]]:
+    """Returns benchmarks and parameters both reports have, whose metric grew by more than threshold"""
+    found = []
+    for name, params in new["results"].items():
+        for param, result in params.items():
+            before = old["results"].get(name, {}).get(param)
+            if before and before[metric] and result[metric] > before[metric] * (1 + threshold):
+                found.append((name, param, before[metric], result[metric]))
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("old")
+    parser.add_argument("new")
+    parser.add_argument("--metric", default="p95_ms")
+    parser.add_argument("--threshold", type=float, default=0.2, help="allowed relative growth of the metric")
+    args = parser.parse_args()
+    with open(args.old, encoding="utf-8") as f:
+        old = json.load(f)
+    with open(args.new, encoding="utf-8") as f:
+        new = json.load(f)
+    found = regressions(old, new, args.metric, args.threshold)
+    for name, param, before, after in found:
+        print(f"{name} [{param}]: {args.metric} {before} -> {after} (+{(after / before - 1) * 100:.0f}%)")
+    sys.exit(1 if found else 0)
+
+
+if __name__ == "__main__":
+    main()
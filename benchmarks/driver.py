@@ -0,0 +1,76 @@
+"""Runs calls at a concurrency level and summarizes them into JSON reports comparable between releases"""
+import asyncio
+import itertools
+import json
+import math
+import platform
+import sys
+import time
+from collections.abc import Awaitable, Callable
+
+
+def percentile(values: list[float], percent: float) -> float:
+    """Returns nearest-rank percentile of sorted values"""
+    if not values:
+        return 0.0
+    rank = math.ceil(percent / 100 * len(values))
+    return values[max(rank, 1) - 1]
+
+
+def summarize(latencies: list[float], elapsed: float, errors: int = 0) -> dict:
+    """Returns calls per second and latency percentiles in milliseconds"""
+    values = sorted(latencies)
+    total = len(values)
+    return {
+        "calls": total,
+        "errors": errors,
+        "throughput": round(total / elapsed, 2) if elapsed else 0.0,
+        "mean_ms": round(sum(values) / total * 1000, 3) if total else 0.0,
+        "p50_ms": round(percentile(values, 50) * 1000, 3),
+        "p95_ms": round(percentile(values, 95) * 1000, 3),
+        "p99_ms": round(percentile(values, 99) * 1000, 3),
+        "max_ms": round(values[-1] * 1000, 3) if total else 0.0,
+    }
+
+
+async def drive(call: Callable[[int], Awaitable[bool]], total: int, concurrency: int) -> dict:
+    """Makes total calls, concurrency of them at a time, a call returns whether it succeeded"""
+    counter = itertools.count()
+    latencies: list[float] = []
+    errors = 0
+
+    async def worker():
+        nonlocal errors
+        while (i := next(counter)) < total:
+            start = time.perf_counter()
+            ok = await call(i)
+            latencies.append(time.perf_counter() - start)
+            errors += not ok
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return summarize(latencies, time.perf_counter() - start, errors)
+
+
+def use_fake_redis():
+    """Replaces Redis with an in-process fake, Redis locks need fakeredis with Lua support: fakeredis[lua]"""
+    import fakeredis
+
+    from menuapp import cache
+
+    cache.redis_client = fakeredis.FakeAsyncRedis()
+
+
+def write_report(results: dict[str, dict], meta: dict, output: str | None = None):
+    """Writes results by benchmark and parameter with details of the run, to stdout unless output is given"""
+    report = {
+        "meta": {"python": platform.python_version(), "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"), **meta},
+        "results": results,
+    }
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if output is None:
+        print(text)
+        return
+    with open(output, "w", encoding="utf-8") as f:
+        f.write(text)
+    print(f"Report written to {output}", file=sys.stderr)
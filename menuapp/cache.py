@@ -1,30 +1,628 @@
+import asyncio
 import json
+import logging
+import math
+import random
+import struct
+import time
+import uuid
+from collections import Counter
+from collections.abc import Awaitable, Callable, Coroutine
+from typing import NamedTuple
 
 import redis.asyncio as redis
+from fastapi.encoders import jsonable_encoder
+from pydantic import BaseModel
+from redis.asyncio.retry import Retry
+from redis.asyncio.sentinel import Sentinel, SentinelConnectionPool
+from redis.backoff import ExponentialBackoff
+from redis.exceptions import LockError
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from . import config
+from transport.storage import CATALOG_VERSION_KEY
 
-redis_client: redis.Redis = redis.Redis(host=config.REDIS_HOST, port=config.REDIS_PORT, decode_responses=True)
+from . import config, metrics
+from .codecs import get_codec
+from .database import SessionLocal
+from .local_cache import MISSING, LocalCache
+from .profiler import ProfiledRedis
+
+# Sorted set of hierarchy nodes ranked by reads of everything cached under them
+HITS_KEY = "hits"
+INVALIDATION_CHANNEL = "cache_invalidation"
+# Distinguishes own invalidation messages from those of other workers
+INSTANCE_ID = uuid.uuid4().hex
+# Codec tag, logical expiry time (0 for none) and seconds it took to load, followed by the encoded value
+ENTRY_HEADER = struct.Struct("!Bdd")
+# How long the listener waits for a message before checking the connection again
+LISTEN_TIMEOUT = 1.0
+
+logger = logging.getLogger(__name__)
+
+# Created on startup or first use instead of on import, so that the pool belongs to the running event loop
+redis_client: redis.Redis | None = None
+codec = get_codec(config.CACHE_CODEC)
+# Encodes payloads sent to clients when cached entries are not JSON
+json_codec = codec if codec.is_json else get_codec()
+# Keeps encoded values, so they can be sent to clients without encoding them again
+local_cache = LocalCache(config.LOCAL_CACHE_SIZE, config.LOCAL_CACHE_TTL)
+listener: asyncio.Task | None = None
+# Loads in progress by url, concurrent misses wait for them instead of querying the database
+inflight: dict[str, asyncio.Future] = {}
+refreshes: set[asyncio.Task] = set()
+# Reads by outermost hierarchy node counted by this worker since they were last saved
+hits: Counter[str] = Counter()
+hits_saved = time.monotonic()
+
+
+def connection_options() -> dict:
+    """Returns options of pooled Redis connections, failed commands are retried with exponential backoff"""
+    return {
+        "max_connections": config.REDIS_MAX_CONNECTIONS,
+        "socket_timeout": config.REDIS_SOCKET_TIMEOUT,
+        "socket_connect_timeout": config.REDIS_CONNECT_TIMEOUT,
+        "socket_keepalive": True,
+        "health_check_interval": config.REDIS_HEALTH_CHECK_INTERVAL,
+        "retry_on_timeout": True,
+        "retry": Retry(ExponentialBackoff(), config.REDIS_RETRIES),
+    }
+
+
+def create_client() -> redis.Redis:
+    """Connects to the master found through Sentinel when REDIS_SENTINELS is set, to REDIS_HOST otherwise"""
+    if config.REDIS_SENTINELS:
+        sentinels = [address.strip().rsplit(":", 1) for address in config.REDIS_SENTINELS.split(",")]
+        timeouts = {
+            "socket_timeout": config.REDIS_SOCKET_TIMEOUT,
+            "socket_connect_timeout": config.REDIS_CONNECT_TIMEOUT,
+        }
+        sentinel = Sentinel([(host, int(port)) for host, port in sentinels], sentinel_kwargs=timeouts)
+        return sentinel.master_for(config.REDIS_SENTINEL_MASTER, redis_class=ProfiledRedis, **connection_options())
+    pool = redis.BlockingConnectionPool(
+        host=config.REDIS_HOST, port=config.REDIS_PORT, timeout=config.REDIS_POOL_TIMEOUT, **connection_options()
+    )
+    return ProfiledRedis(connection_pool=pool)
+
+
+def client() -> redis.Redis:
+    """Returns Redis client, creating its pool on first use, connections are opened when they are needed"""
+    global redis_client
+    if redis_client is None:
+        redis_client = create_client()
+    return redis_client
+
+
+async def start():
+    """Opens the first connection on startup, so that a misconfigured Redis fails the start and not a request"""
+    await client().ping()
 
 
 async def stop():
-    await redis_client.flushall()
+    """Waits for background refreshes and closes Redis connections, cached values are kept"""
+    global redis_client
+    if redis_client is None:
+        return
+    await asyncio.gather(*refreshes, return_exceptions=True)
+    await _save_hits()
+    pool = redis_client.connection_pool
     await redis_client.close()
+    await pool.disconnect()
+    if isinstance(pool, SentinelConnectionPool):
+        for sentinel in pool.sentinel_manager.sentinels:
+            await sentinel.close()
+    redis_client = None
+
+
+async def start_listener():
+    """Starts dropping local cache entries changed by other workers"""
+    global listener
+    if listener is None:
+        listener = asyncio.create_task(_listen())
+
+
+async def stop_listener():
+    global listener
+    if listener is not None:
+        listener.cancel()
+        try:
+            await listener
+        except asyncio.CancelledError:
+            pass
+        listener = None
+
+
+async def _listen():
+    while True:
+        try:
+            async with client().pubsub(ignore_subscribe_messages=True) as pubsub:
+                await pubsub.subscribe(INVALIDATION_CHANNEL)
+                # Messages published while not subscribed are lost
+                local_cache.clear()
+                while True:
+                    # Waiting with a timeout instead of the socket timeout keeps the idle connection open
+                    message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=LISTEN_TIMEOUT)
+                    if message is not None:
+                        _invalidate_local(message["data"])
+        except redis.RedisError:
+            logger.exception("Cache invalidation listener failed, reconnecting")
+            local_cache.clear()
+            await asyncio.sleep(1)
+
+
+def _invalidate_local(data: bytes):
+    """Applies invalidation message published by another worker"""
+    message = json.loads(data)
+    if message["source"] == INSTANCE_ID:
+        return
+    for key in message["keys"]:
+        local_cache.discard(key)
+    for node in message["nodes"]:
+        _discard_local(node)
+    for url in message.get("trees", []):
+        local_cache.discard_tree(url)
+
+
+def _discard_local(url: str):
+    if _is_node(url):
+        local_cache.discard_tree(url)
+    else:
+        local_cache.discard_pages(url)
+
+
+def _publish(pipe: redis.client.Pipeline, keys=(), nodes=(), trees=()):
+    """Queues invalidation message for local caches of other workers"""
+    message = {"source": INSTANCE_ID, "keys": list(keys), "nodes": list(nodes), "trees": list(trees)}
+    pipe.publish(INVALIDATION_CHANNEL, json.dumps(message))
+
+
+class Entry(NamedTuple):
+    """Cached value with its logical expiry time and the seconds it took to load"""
+
+    expires: float
+    delta: float
+    payload: bytes
+
+    @property
+    def value(self):
+        return codec.loads(self.payload)
 
 
 async def get_cache(url):
-    """Returns cached value or None for given url"""
-    value = await redis_client.get(url)
-    return json.loads(value) if value else value
+    """Returns cached value or None for given url, checks local cache first"""
+    with metrics.cache_duration.labels("get").time():
+        payload = await _get_payload(url)
+    metrics.cache_requests.labels("get", "miss" if payload is None else "hit").inc()
+    return None if payload is None else codec.loads(payload)
+
+
+async def _get_payload(url: str) -> bytes | None:
+    payload = local_cache.get(url)
+    if payload is MISSING:
+        entry = _load_entry(await client().get(url))
+        if entry is None or _is_expired(entry):
+            return None
+        payload = entry.payload
+        local_cache.set(url, payload)
+    return payload
+
+
+def _dump_entry(payload: bytes, ttl: int | None, delta: float) -> bytes:
+    return ENTRY_HEADER.pack(codec.tag, time.time() + ttl if ttl else 0.0, delta) + payload
+
+
+def _load_entry(data: bytes | None) -> Entry | None:
+    """Parses cache entry, entries written with another codec are treated as missing"""
+    if not data or data[0] != codec.tag:
+        return None
+    _, expires, delta = ENTRY_HEADER.unpack_from(data)
+    offset = ENTRY_HEADER.size
+    return Entry(expires, delta, data[offset:])
+
+
+def _is_expired(entry: Entry) -> bool:
+    return 0 < entry.expires <= time.time()
+
+
+def _should_refresh_early(entry: Entry) -> bool:
+    """Probabilistic early expiration: the closer to expiry and the slower the load, the likelier a refresh"""
+    if not entry.expires:
+        return False
+    return time.time() - entry.delta * config.CACHE_EARLY_BETA * math.log(1 - random.random()) >= entry.expires
+
+
+def _render(value, scheme: type[BaseModel] | None):
+    """Converts loaded ORM objects to what the endpoint responds with"""
+    if value is None or scheme is None:
+        return jsonable_encoder(value)
+    if isinstance(value, list):
+        return [scheme.from_orm(item).dict() for item in value]
+    return scheme.from_orm(value).dict()
+
+
+def _stale(url: str) -> str:
+    """Returns key the last value of invalidated url is kept under"""
+    return f"stale:{url}"
+
+
+def _lock(url: str) -> str:
+    return f"lock:{url}"
+
+
+def _is_node(url: str) -> bool:
+    """Checks whether url is a menu hierarchy node other urls may be cached under"""
+    return url.rstrip("/").rsplit("/", 1)[-1].isdigit()
+
+
+def _parents(url: str) -> list[str]:
+    """Returns urls of menu hierarchy nodes the url belongs to, the outermost first"""
+    parts = url.rstrip("/").split("/")
+    return ["/".join(parts[: i + 1]) for i, part in enumerate(parts[:-1]) if part.isdigit()]
+
+
+def _base(url: str) -> str:
+    """Returns url without its query string"""
+    return url.split("?", 1)[0]
+
+
+def _tag(url: str) -> str:
+    """Returns key of the set with all cached keys under given hierarchy node"""
+    return f"tag:{url.rstrip('/')}"
+
+
+def _root(url: str) -> str:
+    """Returns url of the collection the url belongs to, the list of menus for everything under a menu"""
+    parts = _base(url).split("/")
+    end = next((i for i, part in enumerate(parts) if part.isdigit()), len(parts) - 1)
+    return "/".join(parts[:end])
 
 
-async def set_cache(url, value):
-    """Sets cache value for given url"""
-    await redis_client.set(url, json.dumps(value))
+def _tree(url: str) -> str:
+    """Returns key of the set with all cached keys and tags under given collection"""
+    return f"tree:{url.rstrip('/')}"
 
 
-async def delete_cache(url):
-    """Deletes cache for given url"""
-    keys = await redis_client.keys(f"{url}*")
+def _set(pipe: redis.client.Pipeline, url: str, payload: bytes, ttl: int | None, delta: float = 0.0):
+    """Queues setting of the encoded value and registration of the url under its hierarchy nodes"""
+    # Expired entries are kept for a while longer to be served while they are refreshed
+    pipe.set(url, _dump_entry(payload, ttl, delta), ex=ttl + config.CACHE_STALE_TTL if ttl else None)
+    pipe.delete(_stale(url))
+    members = [url]
+    if "?" in url:
+        # Pages of a list are registered under the list, so they are dropped along with it
+        pipe.sadd(_tag(_base(url)), url)
+        members.append(_tag(_base(url)))
+    for node in reversed(_parents(url)):
+        pipe.sadd(_tag(node), *members)
+        # Tags of nested nodes are registered too, so they are dropped along with the outer node
+        members.append(_tag(node))
+    pipe.sadd(_tree(_root(url)), *members)
+
+
+async def set_cache(url, value, ttl: int | None = config.CACHE_TTL):
+    """Sets cache value for given url and registers it under its hierarchy nodes"""
+    payload = codec.dumps(value)
+    with metrics.cache_duration.labels("set").time():
+        async with client().pipeline(transaction=False) as pipe:
+            _set(pipe, url, payload, ttl)
+            _publish(pipe, keys=[url])
+            await pipe.execute()
+    local_cache.set(url, payload)
+
+
+async def set_many(
+    values: dict, ttl: int | None = config.CACHE_TTL, delta: float = 0.0, version: str | None = None
+) -> bool:
+    """Sets cache values for all given urls in a single round trip.
+
+    When catalog version is given, nothing is set unless it is still current, values loaded
+    before a change are not cached over its invalidation. Returns whether the values are set.
+    """
+    payloads = {url: codec.dumps(value) for url, value in values.items()}
+    if version is None:
+        return await _set_payloads(payloads, ttl, delta)
+    # Bulk values are not put into the local cache, so that they do not push out the hottest ones
+    return await _set_payloads(payloads, ttl, delta, version.encode(), local=False)
+
+
+async def _set_payloads(
+    payloads: dict[str, bytes], ttl: int | None, delta: float, version: bytes | None = None, local: bool = True
+) -> bool:
+    """Sets encoded values, when catalog version is given only if it is still current"""
+    async with client().pipeline(transaction=version is not None) as pipe:
+        if version is not None:
+            await pipe.watch(CATALOG_VERSION_KEY)
+            if await pipe.get(CATALOG_VERSION_KEY) != version:
+                return False
+            pipe.multi()
+        for url, payload in payloads.items():
+            _set(pipe, url, payload, ttl, delta)
+        _publish(pipe, keys=payloads)
+        try:
+            await pipe.execute()
+        except redis.WatchError:
+            return False
+    if local:
+        for url, payload in payloads.items():
+            local_cache.set(url, payload)
+    return True
+
+
+class Load(NamedTuple):
+    """Everything needed to load the value of url from database, in a request or in the background"""
+
+    url: str
+    loader: Callable[[AsyncSession], Awaitable]
+    ttl: int | None
+    related: Callable[[list], dict] | None
+    scheme: type[BaseModel] | None
+
+
+async def read_through(
+    url: str,
+    loader: Callable[[AsyncSession], Awaitable],
+    db: AsyncSession,
+    ttl: int | None = config.CACHE_TTL,
+    related: Callable[[list], dict] | None = None,
+    scheme: type[BaseModel] | None = None,
+):
+    """Returns cached value for given url, on a miss loads it from database and caches it.
+
+    Only one load per url runs at a time across workers, guarded by a short Redis lock.
+    The stale value of an expired url or of one marked stale is served while a background
+    task reloads it, readers wait for the load only if there is none. Values close to their
+    expiry are refreshed early in the background. The loaded value is rendered with the
+    response scheme and cached unless it is None or the catalog changed while it was
+    loaded, together with the values returned by related for a list.
+    """
+    payload = await _read(Load(url, loader, ttl, related, scheme), db)
+    return None if payload is None else codec.loads(payload)
+
+
+async def read_json(
+    url: str,
+    loader: Callable[[AsyncSession], Awaitable],
+    db: AsyncSession,
+    ttl: int | None = config.CACHE_TTL,
+    related: Callable[[list], dict] | None = None,
+    scheme: type[BaseModel] | None = None,
+) -> bytes | None:
+    """Same as read_through, but returns the value as JSON bytes ready to be sent to clients"""
+    payload = await _read(Load(url, loader, ttl, related, scheme), db)
+    if payload is None or codec.is_json:
+        return payload
+    return json_codec.dumps(codec.loads(payload))
+
+
+async def _read(load: Load, db: AsyncSession) -> bytes | None:
+    payload = await _lookup(load, db)
+    # Reads of rows that do not exist are not counted, so that made up ids do not fill the counter
+    if payload is not None:
+        _count_hit(load.url)
+    return payload
+
+
+async def _lookup(load: Load, db: AsyncSession) -> bytes | None:
+    url = load.url
+    payload = local_cache.get(url)
+    if payload is not MISSING:
+        metrics.cache_requests.labels("read", "local").inc()
+        return payload
+    with metrics.cache_duration.labels("read").time():
+        fresh, stale = await client().mget(url, _stale(url))
+    entry = _load_entry(fresh)
+    if entry is not None and not _is_expired(entry):
+        metrics.cache_requests.labels("read", "hit").inc()
+        if _should_refresh_early(entry):
+            _refresh_in_background(load)
+        local_cache.set(url, entry.payload)
+        return entry.payload
+    # An expired entry is served the same way as an invalidated one while it is reloaded
+    entry = entry or _load_entry(stale)
+    if entry is not None:
+        metrics.cache_requests.labels("read", "stale").inc()
+        _refresh_in_background(load)
+        return entry.payload
+    if url in inflight:
+        metrics.cache_requests.labels("read", "shared").inc()
+        return await _load(load, db)
+    lock = client().lock(_lock(url), timeout=config.CACHE_LOCK_TIMEOUT)
+    if await lock.acquire(blocking=False):
+        metrics.cache_requests.labels("read", "miss").inc()
+        try:
+            return await _load(load, db)
+        finally:
+            await _release(lock)
+    # Another worker is loading the value, querying the database at the same time is pointless
+    metrics.cache_requests.labels("read", "wait").inc()
+    deadline = time.monotonic() + config.CACHE_LOCK_TIMEOUT
+    while await client().exists(_lock(url)) and time.monotonic() < deadline:
+        await asyncio.sleep(0.05)
+    payload = await _get_payload(url)
+    if payload is not None:
+        return payload
+    return await _load(load, db)
+
+
+def _count_hit(url: str):
+    global hits_saved
+    parents = _parents(url)
+    node = parents[0] if parents else url if _is_node(url) else None
+    if node is None:
+        return
+    hits[node] += 1
+    if len(hits) > 2 * config.HITS_MAX_NODES:
+        # Nodes read the least are dropped, they would not make it to the hottest anyway
+        hottest_nodes = dict(hits.most_common(config.HITS_MAX_NODES))
+        hits.clear()
+        hits.update(hottest_nodes)
+    if time.monotonic() - hits_saved >= config.HITS_SAVE_INTERVAL:
+        hits_saved = time.monotonic()
+        _in_background(_save_hits())
+
+
+async def _save_hits():
+    try:
+        await save_hits()
+    except redis.RedisError:
+        logger.exception("Saving cache hits failed")
+
+
+async def save_hits():
+    """Adds reads counted by this worker to the ranking shared by all workers"""
+    counts = dict(hits)
+    hits.clear()
+    if counts:
+        async with client().pipeline(transaction=False) as pipe:
+            for node, count in counts.items():
+                pipe.zincrby(HITS_KEY, count, node)
+            await pipe.execute()
+
+
+async def hottest(count: int) -> list[str]:
+    """Returns urls of hierarchy nodes read the most, the hottest first"""
+    return [node.decode() for node in await client().zrevrange(HITS_KEY, 0, count - 1)]
+
+
+async def forget_hits(*nodes: str):
+    """Drops deleted hierarchy nodes from the ranking"""
+    await client().zrem(HITS_KEY, *nodes)
+
+
+def _encode(value) -> bytes | None:
+    return None if value is None else codec.dumps(value)
+
+
+async def _load(load: Load, db: AsyncSession) -> bytes | None:
+    """Loads value from database and caches it, concurrent loads of the url in this worker are shared"""
+    url = load.url
+    if url in inflight:
+        payload = await asyncio.shield(inflight[url])
+        if payload is not MISSING:
+            return payload
+        # The shared load failed, so the error is reported by this request's own attempt
+        return _encode(_render(await load.loader(db), load.scheme))
+    future = inflight[url] = asyncio.get_running_loop().create_future()
+    payload = MISSING
+    try:
+        # Values loaded before a change are not cached over its invalidation
+        version = await catalog_version()
+        start = time.perf_counter()
+        loaded = await load.loader(db)
+        with metrics.render_duration.time():
+            value = _render(loaded, load.scheme)
+        delta = time.perf_counter() - start
+        payload = _encode(value)
+        if value is not None:
+            related = load.related(value) if load.related else {}
+            payloads = {url: payload} | {key: codec.dumps(item) for key, item in related.items()}
+            await _set_payloads(payloads, load.ttl, delta, version.encode())
+        else:
+            await client().delete(url, _stale(url))
+            local_cache.discard(url)
+        return payload
+    finally:
+        future.set_result(payload)
+        del inflight[url]
+
+
+def _refresh_in_background(load: Load):
+    if load.url not in inflight:
+        _in_background(_refresh(load))
+
+
+def _in_background(coroutine: Coroutine):
+    task = asyncio.create_task(coroutine)
+    # The event loop keeps only weak references to tasks, stop waits for them
+    refreshes.add(task)
+    task.add_done_callback(refreshes.discard)
+
+
+async def _refresh(load: Load):
+    lock = client().lock(_lock(load.url), timeout=config.CACHE_LOCK_TIMEOUT)
+    if not await lock.acquire(blocking=False):
+        return
+    try:
+        async with SessionLocal() as db:
+            await _load(load, db)
+    except Exception:
+        logger.exception("Background refresh of %s failed", load.url)
+    finally:
+        await _release(lock)
+
+
+async def _release(lock):
+    try:
+        await lock.release()
+    except LockError:
+        # The lock has expired and may be held by another worker already
+        pass
+
+
+async def delete_cache(*urls, stale=()):
+    """Deletes cache for given urls and everything cached under them, changes catalog version.
+
+    Of the nodes in stale only their own values are deleted. Values cached under them that are not under
+    the urls are untouched by the change, they are marked stale and kept for CACHE_STALE_TTL seconds
+    to be served while they are reloaded.
+    """
+    with metrics.cache_duration.labels("delete").time():
+        await _delete(urls, tuple(stale))
+
+
+async def _delete(urls: tuple[str, ...], stale: tuple[str, ...]):
+    nodes = urls + stale
+    async with client().pipeline(transaction=True) as pipe:
+        for url in nodes:
+            pipe.smembers(_tag(url))
+        pipe.delete(*map(_tag, nodes))
+        pipe.set(CATALOG_VERSION_KEY, uuid.uuid4().hex)
+        _publish(pipe, nodes=nodes)
+        members = [{key.decode() for key in keys} for keys in (await pipe.execute())[: len(nodes)]]
+    for url in nodes:
+        _discard_local(url)
+    deleted = set(nodes).union(*members[: len(urls)])
+    kept = set().union(*members) - deleted
+    async with client().pipeline(transaction=False) as pipe:
+        for key in deleted:
+            pipe.delete(key, _stale(key))
+        for key in kept:
+            if key.startswith("tag:"):
+                pipe.delete(key)
+            else:
+                pipe.rename(key, _stale(key))
+                pipe.expire(_stale(key), config.CACHE_STALE_TTL)
+        # Renaming a key that is not cached fails, which is fine
+        await pipe.execute(raise_on_error=False)
+
+
+async def delete_tree(url: str):
+    """Deletes every url cached under given collection, changes catalog version.
+
+    Unlike delete_cache nothing is kept stale, for rows that are gone for good, such as after the catalog is refilled.
+    """
+    url = url.rstrip("/")
+    async with client().pipeline(transaction=True) as pipe:
+        pipe.smembers(_tree(url))
+        pipe.delete(_tree(url))
+        pipe.set(CATALOG_VERSION_KEY, uuid.uuid4().hex)
+        _publish(pipe, trees=[url])
+        members, *_ = await pipe.execute()
+    local_cache.discard_tree(url)
+    keys = [key.decode() for key in members]
+    stale = [_stale(key) for key in keys if not key.startswith("tag:")]
     if keys:
-        await redis_client.delete(*keys)
+        await client().delete(*keys, *stale)
+
+
+async def catalog_version():
+    """Returns token that changes whenever menus, submenus or dishes change"""
+    version = await client().get(CATALOG_VERSION_KEY)
+    if version is None:
+        await client().set(CATALOG_VERSION_KEY, uuid.uuid4().hex, nx=True)
+        version = await client().get(CATALOG_VERSION_KEY)
+    return version.decode()
+
+
+async def bump_catalog_version():
+    """Sets new catalog version, a random token never repeats even after the cache is flushed"""
+    await client().set(CATALOG_VERSION_KEY, uuid.uuid4().hex)
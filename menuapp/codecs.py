@@ -0,0 +1,82 @@
+import json
+from abc import ABC, abstractmethod
+from typing import Any
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+class Codec(ABC):
+    """Serializes cached values to bytes"""
+
+    name = ""
+    # Tag stored with every cache entry, entries written with another codec are treated as missing
+    tag = 0
+    # Whether encoded values are JSON documents that can be sent to clients as they are
+    is_json = False
+
+    @abstractmethod
+    def dumps(self, value: Any) -> bytes:
+        """Encodes value"""
+
+    @abstractmethod
+    def loads(self, data: bytes) -> Any:
+        """Decodes value encoded by dumps"""
+
+
+class JsonCodec(Codec):
+    name = "json"
+    tag = 1
+    is_json = True
+
+    def dumps(self, value: Any) -> bytes:
+        return json.dumps(value, ensure_ascii=False, separators=(",", ":")).encode()
+
+    def loads(self, data: bytes) -> Any:
+        return json.loads(data)
+
+
+class OrjsonCodec(Codec):
+    name = "orjson"
+    tag = 2
+    is_json = True
+
+    def dumps(self, value: Any) -> bytes:
+        return orjson.dumps(value)
+
+    def loads(self, data: bytes) -> Any:
+        return orjson.loads(data)
+
+
+class MsgpackCodec(Codec):
+    name = "msgpack"
+    tag = 3
+
+    def dumps(self, value: Any) -> bytes:
+        return msgpack.packb(value, use_bin_type=True)
+
+    def loads(self, data: bytes) -> Any:
+        return msgpack.unpackb(data, raw=False)
+
+
+CODECS: dict[str, Codec] = {"json": JsonCodec()}
+if orjson is not None:
+    CODECS["orjson"] = OrjsonCodec()
+if msgpack is not None:
+    CODECS["msgpack"] = MsgpackCodec()
+
+
+def get_codec(name: str | None = None) -> Codec:
+    """Returns codec by name, by default the fastest available JSON one"""
+    if name is None:
+        return CODECS.get("orjson", CODECS["json"])
+    if name not in CODECS:
+        raise ValueError(f"Cache codec {name!r} is not available, choose one of {', '.join(CODECS)}")
+    return CODECS[name]
@@ -11,3 +11,45 @@ REDIS_PORT = cast(int, os.getenv("REDIS_PORT"))
 SPECIAL_PASSWORD = os.getenv("SPECIAL_PASSWORD")
 RABBIT_BROKER = os.getenv("RABBIT_BROKER")
 RABBIT_BACKEND = os.getenv("RABBIT_BACKEND")
+CACHE_TTL = int(os.getenv("CACHE_TTL", 0)) or None
+LOCAL_CACHE_SIZE = int(os.getenv("LOCAL_CACHE_SIZE", 1024))
+LOCAL_CACHE_TTL = float(os.getenv("LOCAL_CACHE_TTL", 30))
+CACHE_STALE_TTL = int(os.getenv("CACHE_STALE_TTL", 60))
+CACHE_LOCK_TIMEOUT = float(os.getenv("CACHE_LOCK_TIMEOUT", 5))
+CACHE_EARLY_BETA = float(os.getenv("CACHE_EARLY_BETA", 1))
+CACHE_CODEC = os.getenv("CACHE_CODEC")
+BATCH_CHUNK_SIZE = int(os.getenv("BATCH_CHUNK_SIZE", 1000))
+IMPORT_CHUNK_SIZE = int(os.getenv("IMPORT_CHUNK_SIZE", 50_000))
+PAGE_MAX_SIZE = int(os.getenv("PAGE_MAX_SIZE", 1000))
+STREAM_CHUNK_SIZE = int(os.getenv("STREAM_CHUNK_SIZE", 1000))
+# Seconds an excel export counts as requested, so that a lost task is queued again after that at the latest
+EXPORT_MARKER_TTL = int(os.getenv("EXPORT_MARKER_TTL", 60 * 60))
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", 5))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", 10))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", 30))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", 1800))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() in ("1", "true", "yes")
+DB_STATEMENT_CACHE_SIZE = int(os.getenv("DB_STATEMENT_CACHE_SIZE", 100))
+DB_PREPARED_STATEMENT_CACHE_SIZE = int(os.getenv("DB_PREPARED_STATEMENT_CACHE_SIZE", 100))
+REDIS_MAX_CONNECTIONS = int(os.getenv("REDIS_MAX_CONNECTIONS", 50))
+REDIS_POOL_TIMEOUT = int(os.getenv("REDIS_POOL_TIMEOUT", 5))
+REDIS_SOCKET_TIMEOUT = float(os.getenv("REDIS_SOCKET_TIMEOUT", 2))
+REDIS_CONNECT_TIMEOUT = float(os.getenv("REDIS_CONNECT_TIMEOUT", 2))
+REDIS_RETRIES = int(os.getenv("REDIS_RETRIES", 3))
+REDIS_HEALTH_CHECK_INTERVAL = int(os.getenv("REDIS_HEALTH_CHECK_INTERVAL", 30))
+# Comma separated host:port pairs, the master is looked up through Sentinel when set
+REDIS_SENTINELS = os.getenv("REDIS_SENTINELS")
+REDIS_SENTINEL_MASTER = os.getenv("REDIS_SENTINEL_MASTER", "mymaster")
+WARMUP_ON_STARTUP = os.getenv("WARMUP_ON_STARTUP", "true").lower() in ("1", "true", "yes")
+WARMUP_ON_INVALIDATION = os.getenv("WARMUP_ON_INVALIDATION", "true").lower() in ("1", "true", "yes")
+WARMUP_DELAY = float(os.getenv("WARMUP_DELAY", 0.5))
+WARMUP_MAX_ROWS = int(os.getenv("WARMUP_MAX_ROWS", 10_000))
+WARMUP_MENUS = int(os.getenv("WARMUP_MENUS", 20))
+WARMUP_CONCURRENCY = int(os.getenv("WARMUP_CONCURRENCY", 2))
+WARMUP_BATCH_SIZE = int(os.getenv("WARMUP_BATCH_SIZE", 500))
+# Hierarchy nodes whose reads a worker keeps counting, and how often it adds them to the shared ranking
+HITS_MAX_NODES = int(os.getenv("HITS_MAX_NODES", 1000))
+HITS_SAVE_INTERVAL = float(os.getenv("HITS_SAVE_INTERVAL", 60))
+PROFILE_REQUESTS = os.getenv("PROFILE_REQUESTS", "false").lower() in ("1", "true", "yes")
+PROFILE_N_PLUS_ONE = int(os.getenv("PROFILE_N_PLUS_ONE", 3))
+PROFILE_HISTORY = int(os.getenv("PROFILE_HISTORY", 100))
@@ -1,14 +1,22 @@
-import json
+import os
+from collections.abc import AsyncIterator, Awaitable, Callable, Iterable, Iterator
+from itertools import islice
 
-import aiofiles
 from fastapi.responses import FileResponse
-from sqlalchemy import select
+from sqlalchemy import Table, bindparam, delete, func, insert, select, update
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.engine import Row
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import selectinload
 
+from transport.storage import export_marker, export_path, touch_export
 from transport.tasks import get_status, to_excel
 
-from . import models, schemes
+from . import cache, config, models, schemes
 from .database import SessionLocal
+from .importer import import_catalog
+from .pagination import Page
 
 
 async def get_db():
@@ -17,6 +25,112 @@ async def get_db():
         yield db
 
 
+def change_counts(menu_id: int, submenu_id: int | None = None, submenus: int = 0, dishes: int = 0):
+    """Builds a single statement atomically changing counters of the menu and, if given, of its submenu"""
+    menu = (
+        update(models.Menu)
+        .where(models.Menu.id == menu_id)
+        .values(submenus_count=models.Menu.submenus_count + submenus, dishes_count=models.Menu.dishes_count + dishes)
+    )
+    if submenu_id is None:
+        return menu.execution_options(synchronize_session=False)
+    return (
+        update(models.Submenu)
+        .where(models.Submenu.id == submenu_id)
+        .values(dishes_count=models.Submenu.dishes_count + dishes)
+        .add_cte(menu.cte("menu_counts"))
+        .execution_options(synchronize_session=False)
+    )
+
+
+def chunks(items: Iterable, size: int = config.BATCH_CHUNK_SIZE) -> Iterator[list]:
+    """Splits items, so that a statement stays within the bind parameters limit"""
+    items = iter(items)
+    while chunk := list(islice(items, size)):
+        yield chunk
+
+
+async def count_rows(table: Table, ids: set[int], parent, db: AsyncSession):
+    """Counts rows with given ids that belong to the parent"""
+    found = 0
+    for chunk in chunks(ids):
+        found += (await db.execute(select(func.count()).where(table.c.id.in_(chunk), parent))).scalar()
+    return found
+
+
+async def update_rows(table: Table, items: list, db: AsyncSession):
+    """Updates rows by id with a single executemany and returns them"""
+    if not items:
+        return []
+    await db.execute(
+        update(table).where(table.c.id == bindparam("row_id")),
+        [{"row_id": item.id, **item.dict(exclude={"id"})} for item in items],
+    )
+    rows = []
+    for chunk in chunks(item.id for item in items):
+        rows += (await db.execute(select(table).where(table.c.id.in_(chunk)).order_by(table.c.id))).all()
+    return rows
+
+
+async def insert_unique(table: Table, values: dict, unique: list[str], db: AsyncSession):
+    """Inserts a row and returns it, or None if a row with the same unique columns exists, in a single statement"""
+    statement = postgresql.insert(table).values(values).on_conflict_do_nothing(index_elements=unique)
+    return (await db.execute(statement.returning(table))).first()
+
+
+async def update_row(statement, db: AsyncSession, on_commit: Callable[[Row], Awaitable] | None = None):
+    """Executes UPDATE ... RETURNING, commits it and returns the updated row.
+
+    Returns None if no row matched and False if the change breaks a unique constraint, rolling it back.
+    on_commit is awaited with the row only once the change is committed, so that caches never see
+    a change that may still be rolled back.
+    """
+    try:
+        row = (await db.execute(statement)).first()
+    except IntegrityError:
+        await db.rollback()
+        return False
+    if row is None:
+        await db.rollback()
+        return None
+    await db.commit()
+    if on_commit is not None:
+        await on_commit(row)
+    return row
+
+
+async def insert_rows(table: Table, values: list[dict], db: AsyncSession):
+    """Inserts rows with multi-row INSERT statements and returns them"""
+    rows = []
+    for chunk in chunks(values):
+        rows += (await db.execute(insert(table).values(chunk).returning(table))).all()
+    return rows
+
+
+def paginate(query, id_column, page: Page):
+    """Orders query by id and limits it to rows of the page"""
+    query = query.order_by(id_column)
+    if page.after is not None:
+        query = query.where(id_column > page.after)
+    if page.limit is not None:
+        query = query.limit(page.limit)
+    return query
+
+
+async def get_page(model, page: Page, db: AsyncSession, *criteria):
+    """Selects a page of rows ordered by id, only the requested columns if the page has a projection"""
+    columns = [getattr(model, name) for name in page.fields] if page.fields else [model]
+    result = await db.execute(paginate(select(*columns).where(*criteria), model.id, page))
+    return result.all() if page.fields else result.scalars().all()
+
+
+async def stream_rows(query, db: AsyncSession) -> AsyncIterator[list]:
+    """Yields rows of the query from a server-side cursor, STREAM_CHUNK_SIZE at a time"""
+    result = await db.stream(query.execution_options(yield_per=config.STREAM_CHUNK_SIZE))
+    async for rows in result.partitions():
+        yield rows
+
+
 class MenuCRUD:
     @staticmethod
     async def get_menu_by_id(menu_id: int, db: AsyncSession):
@@ -24,22 +138,33 @@ class MenuCRUD:
         return (await db.execute(select(models.Menu).where(models.Menu.id == menu_id))).scalar()
 
     @staticmethod
-    async def get_menu_by_title(menu_title: str, db: AsyncSession):
-        "Get menu by title"
-        return (await db.execute(select(models.Menu).where(models.Menu.title == menu_title))).scalar()
+    async def get_menus(db: AsyncSession, page: Page = Page()):
+        """Get menus list"""
+        return await get_page(models.Menu, page, db)
 
     @staticmethod
-    async def get_menus(db: AsyncSession):
-        """Get menus list"""
-        return (await db.execute(select(models.Menu))).scalars().all()
+    async def get_menus_tree(db: AsyncSession, menu_id: int | None = None):
+        """Get menus with their submenus and dishes, each level loaded by a single query"""
+        query = select(models.Menu).options(selectinload(models.Menu.submenus).selectinload(models.Submenu.dishes))
+        if menu_id is not None:
+            query = query.where(models.Menu.id == menu_id)
+        return (await db.execute(query.order_by(models.Menu.id))).scalars().all()
+
+    @staticmethod
+    async def stream_catalog(db: AsyncSession) -> AsyncIterator[tuple[str, list]]:
+        """Streams columns of menus, then of submenus, then of dishes, as (table, rows) chunks"""
+        for table in (models.Menu.__table__, models.Submenu.__table__, models.Dish.__table__):
+            async for rows in stream_rows(select(table).order_by(table.c.id), db):
+                yield table.name, rows
 
     @staticmethod
     async def create_menu(menu: schemes.MenuBase, db: AsyncSession):
-        """Create menu item"""
-        db_menu = models.Menu(**menu.dict())
-        db_menu.dishes_count = 0
-        db_menu.submenus_count = 0
-        db.add(db_menu)
+        """Create menu item, None if the title is taken"""
+        values = {**menu.dict(), "submenus_count": 0, "dishes_count": 0}
+        db_menu = await insert_unique(models.Menu.__table__, values, ["title"], db)
+        if db_menu is None:
+            await db.rollback()
+            return None
         await db.commit()
         return db_menu
 
@@ -55,10 +180,13 @@ class MenuCRUD:
             return True
 
     @staticmethod
-    async def update_menu(menu_id: int, db: AsyncSession):
-        """Update menu item"""
-        await db.commit()
-        return await MenuCRUD.get_menu_by_id(db=db, menu_id=menu_id)
+    async def update_menu(
+        menu_id: int, menu: schemes.MenuUpdate, db: AsyncSession, on_commit: Callable[[Row], Awaitable] | None = None
+    ):
+        """Update menu item, None if it is not found, False if the title is taken"""
+        menus = models.Menu.__table__
+        statement = update(menus).where(menus.c.id == menu_id).values(**menu.dict()).returning(menus)
+        return await update_row(statement, db, on_commit)
 
 
 class SubmenuCRUD:
@@ -68,45 +196,93 @@ class SubmenuCRUD:
         return (await db.execute(select(models.Submenu).where(models.Submenu.id == submenu_id))).scalar()
 
     @staticmethod
-    async def get_submenu_by_title(submenu_title: str, db: AsyncSession):
-        """Get submenu by title"""
-        return (await db.execute(select(models.Submenu).where(models.Submenu.title == submenu_title))).scalar()
-
-    @staticmethod
-    async def get_submenus(menu_id: int, db: AsyncSession):
+    async def get_submenus(menu_id: int, db: AsyncSession, page: Page = Page()):
         """Get submenus list"""
-        return (await db.execute(select(models.Submenu).where(models.Submenu.menu_id == menu_id))).scalars().all()
+        return await get_page(models.Submenu, page, db, models.Submenu.menu_id == menu_id)
 
     @staticmethod
     async def create_submenu(submenu: schemes.SubmenuBase, menu_id: int, db: AsyncSession):
-        """Create submenu item"""
-        db_submenu = models.Submenu(**submenu.dict())
-        db_submenu.menu_id = menu_id
-        db_submenu.dishes_count = 0
-        (await MenuCRUD.get_menu_by_id(db=db, menu_id=menu_id)).submenus_count += 1
-        db.add(db_submenu)
+        """Create submenu item, None if the title is taken in the menu"""
+        values = {**submenu.dict(), "menu_id": menu_id, "dishes_count": 0}
+        db_submenu = await insert_unique(models.Submenu.__table__, values, ["menu_id", "title"], db)
+        if db_submenu is None:
+            await db.rollback()
+            return None
+        await db.execute(change_counts(menu_id, submenus=1))
         await db.commit()
         return db_submenu
 
     @staticmethod
     async def delete_submenu(menu_id: int, submenu_id: int, db: AsyncSession):
         """Delete submenu item"""
-        db_submenu = await SubmenuCRUD.get_submenu_by_id(db=db, submenu_id=submenu_id)
-        if db_submenu is None:
+        await db.execute(
+            delete(models.Dish).where(models.Dish.menu_id == menu_id, models.Dish.submenu_id == submenu_id)
+        )
+        deleted = (
+            await db.execute(
+                delete(models.Submenu)
+                .where(models.Submenu.id == submenu_id, models.Submenu.menu_id == menu_id)
+                .returning(models.Submenu.dishes_count)
+            )
+        ).first()
+        if deleted is None:
+            await db.rollback()
             return None
-        else:
-            db_menu = await MenuCRUD.get_menu_by_id(db=db, menu_id=menu_id)
-            db_menu.submenus_count -= 1
-            db_menu.dishes_count -= db_submenu.dishes_count
-            await db.delete(db_submenu)
-            await db.commit()
-            return True
+        await db.execute(change_counts(menu_id, submenus=-1, dishes=-(deleted.dishes_count or 0)))
+        await db.commit()
+        return True
+
+    @staticmethod
+    async def update_submenu(
+        menu_id: int,
+        submenu_id: int,
+        submenu: schemes.SubmenuUpdate,
+        db: AsyncSession,
+        on_commit: Callable[[Row], Awaitable] | None = None,
+    ):
+        """Update submenu item of the menu, None if it is not found, False if the title is taken"""
+        submenus = models.Submenu.__table__
+        statement = (
+            update(submenus)
+            .where(submenus.c.id == submenu_id, submenus.c.menu_id == menu_id)
+            .values(**submenu.dict())
+            .returning(submenus)
+        )
+        return await update_row(statement, db, on_commit)
 
     @staticmethod
-    async def update_submenu(submenu_id: int, db: AsyncSession):
-        """Update submenu item"""
+    async def apply_batch(batch: schemes.SubmenuBatch, menu_id: int, db: AsyncSession):
+        """Deletes, updates and creates submenus of the menu in a single transaction.
+
+        Returns None if the menu or a submenu is not found, False if a title repeats or is taken in the menu.
+        """
+        submenus, dishes = models.Submenu.__table__, models.Dish.__table__
+        in_menu = submenus.c.menu_id == menu_id
+        if batch.create and await MenuCRUD.get_menu_by_id(menu_id, db) is None:
+            return None
+        delete_ids, update_ids = set(batch.delete), {submenu.id for submenu in batch.update}
+        deleted = []
+        for chunk in chunks(delete_ids):
+            await db.execute(delete(dishes).where(dishes.c.submenu_id.in_(chunk), dishes.c.menu_id == menu_id))
+            statement = delete(submenus).where(submenus.c.id.in_(chunk), in_menu)
+            deleted += (await db.execute(statement.returning(submenus.c.id, submenus.c.dishes_count))).all()
+        found = await count_rows(submenus, update_ids, in_menu, db)
+        if len(deleted) != len(delete_ids) or found != len(update_ids):
+            await db.rollback()
+            return None
+        try:
+            updated = await update_rows(submenus, batch.update, db)
+            created = await insert_rows(
+                submenus, [{**submenu.dict(), "menu_id": menu_id, "dishes_count": 0} for submenu in batch.create], db
+            )
+        except IntegrityError:
+            await db.rollback()
+            return False
+        if created or deleted:
+            dishes_count = sum(submenu.dishes_count or 0 for submenu in deleted)
+            await db.execute(change_counts(menu_id, submenus=len(created) - len(deleted), dishes=-dishes_count))
         await db.commit()
-        return await SubmenuCRUD.get_submenu_by_id(db=db, submenu_id=submenu_id)
+        return {"created": created, "updated": updated, "deleted": [submenu.id for submenu in deleted]}
 
 
 class DishCRUD:
@@ -116,115 +292,154 @@ class DishCRUD:
         return (await db.execute(select(models.Dish).where(models.Dish.id == dish_id))).scalar()
 
     @staticmethod
-    async def get_dish_by_title(dish_title: str, db: AsyncSession):
-        """Get dish by title"""
-        return (await db.execute(select(models.Dish).where(models.Dish.title == dish_title))).scalar()
-
-    @staticmethod
-    async def get_dishes(menu_id: int, submenu_id: int, db: AsyncSession):
+    async def get_dishes(menu_id: int, submenu_id: int, db: AsyncSession, page: Page = Page()):
         """Get dishes list"""
-        return (
-            (
-                await db.execute(
-                    select(models.Dish)
-                    .where(models.Dish.menu_id == menu_id)
-                    .where(models.Dish.submenu_id == submenu_id)
-                )
-            )
-            .scalars()
-            .all()
+        return await get_page(
+            models.Dish, page, db, models.Dish.menu_id == menu_id, models.Dish.submenu_id == submenu_id
         )
 
+    @staticmethod
+    def stream_dishes(menu_id: int, submenu_id: int, db: AsyncSession, page: Page = Page()) -> AsyncIterator[list]:
+        """Streams columns of dishes of the submenu ordered by id, without loading them as entities"""
+        dishes = models.Dish.__table__
+        columns = [dishes.c[name] for name in page.fields] if page.fields else [dishes]
+        query = select(*columns).where(dishes.c.menu_id == menu_id, dishes.c.submenu_id == submenu_id)
+        return stream_rows(paginate(query, dishes.c.id, page), db)
+
     @staticmethod
     async def create_dish(dish: schemes.DishBase, menu_id: int, submenu_id: int, db: AsyncSession):
-        """Create dish item"""
-        db_dish = models.Dish(**dish.dict())
-        db_dish.menu_id = menu_id
-        db_dish.submenu_id = submenu_id
-        (await MenuCRUD.get_menu_by_id(db=db, menu_id=menu_id)).dishes_count += 1
-        (await SubmenuCRUD.get_submenu_by_id(db=db, submenu_id=submenu_id)).dishes_count += 1
-        db.add(db_dish)
+        """Create dish item, None if the title is taken in the submenu"""
+        values = {**dish.dict(), "menu_id": menu_id, "submenu_id": submenu_id}
+        db_dish = await insert_unique(models.Dish.__table__, values, ["submenu_id", "title"], db)
+        if db_dish is None:
+            await db.rollback()
+            return None
+        await db.execute(change_counts(menu_id, submenu_id, dishes=1))
         await db.commit()
         return db_dish
 
     @staticmethod
     async def delete_dish(dish_id: int, menu_id: int, submenu_id: int, db: AsyncSession):
         """Delete dish item"""
-        db_dish = await DishCRUD.get_dish_by_id(db=db, dish_id=dish_id)
-        if db_dish is None:
+        deleted = (
+            await db.execute(
+                delete(models.Dish)
+                .where(models.Dish.id == dish_id, models.Dish.menu_id == menu_id, models.Dish.submenu_id == submenu_id)
+                .returning(models.Dish.id)
+            )
+        ).first()
+        if deleted is None:
             return None
-        else:
-            (await MenuCRUD.get_menu_by_id(db=db, menu_id=menu_id)).dishes_count -= 1
-            (await SubmenuCRUD.get_submenu_by_id(db=db, submenu_id=submenu_id)).dishes_count -= 1
-            await db.delete(db_dish)
-            await db.commit()
-            return True
+        await db.execute(change_counts(menu_id, submenu_id, dishes=-1))
+        await db.commit()
+        return True
+
+    @staticmethod
+    async def update_dish(
+        dish_id: int,
+        menu_id: int,
+        submenu_id: int,
+        dish: schemes.DishUpdate,
+        db: AsyncSession,
+        on_commit: Callable[[Row], Awaitable] | None = None,
+    ):
+        """Update dish item of the submenu, None if it is not found, False if the title is taken"""
+        dishes = models.Dish.__table__
+        statement = (
+            update(dishes)
+            .where(dishes.c.id == dish_id, dishes.c.menu_id == menu_id, dishes.c.submenu_id == submenu_id)
+            .values(**dish.dict())
+            .returning(dishes)
+        )
+        return await update_row(statement, db, on_commit)
 
     @staticmethod
-    async def update_dish(dish_id: int, db: AsyncSession):
-        """Update dish item"""
+    async def apply_batch(batch: schemes.DishBatch, menu_id: int, submenu_id: int, db: AsyncSession):
+        """Deletes, updates and creates dishes of the submenu in a single transaction.
+
+        Returns None if the submenu of the menu or a dish is not found, False if a title repeats
+        or is taken in the submenu.
+        """
+        submenus, dishes = models.Submenu.__table__, models.Dish.__table__
+        in_submenu = (dishes.c.menu_id == menu_id) & (dishes.c.submenu_id == submenu_id)
+        # Dishes of a submenu under another menu would be counted against the wrong menu
+        parent = select(submenus.c.id).where(submenus.c.id == submenu_id, submenus.c.menu_id == menu_id)
+        if batch.create and (await db.execute(parent)).first() is None:
+            return None
+        delete_ids, update_ids = set(batch.delete), {dish.id for dish in batch.update}
+        deleted = []
+        for chunk in chunks(delete_ids):
+            statement = delete(dishes).where(dishes.c.id.in_(chunk), in_submenu).returning(dishes.c.id)
+            deleted += (await db.execute(statement)).scalars().all()
+        found = await count_rows(dishes, update_ids, in_submenu, db)
+        if len(deleted) != len(delete_ids) or found != len(update_ids):
+            await db.rollback()
+            return None
+        try:
+            updated = await update_rows(dishes, batch.update, db)
+            created = await insert_rows(
+                dishes, [{**dish.dict(), "menu_id": menu_id, "submenu_id": submenu_id} for dish in batch.create], db
+            )
+        except IntegrityError:
+            await db.rollback()
+            return False
+        if created or deleted:
+            await db.execute(change_counts(menu_id, submenu_id, dishes=len(created) - len(deleted)))
         await db.commit()
-        return await DishCRUD.get_dish_by_id(db=db, dish_id=dish_id)
+        return {"created": created, "updated": updated, "deleted": deleted}
 
 
 class FillMenu:
     @staticmethod
     async def fill(db: AsyncSession):
         """Fills database with test data from menu.json"""
-        async with aiofiles.open("menuapp/menu.json") as f:
-            content = await f.read()
-        x = json.loads(content)
+        await import_catalog("menuapp/menu.json", db)
+        return True
 
-        for menu in x[0]:
-            db_menu = models.Menu(**menu)
-            db.add(db_menu)
 
-        for submenu in x[1]:
-            db_submenu = models.Submenu(**submenu)
-            db.add(db_submenu)
+class CreateXL:
+    # Statuses of tasks that are still going to write their excel file
+    IN_PROGRESS = ("PENDING", "RECEIVED", "STARTED", "RETRY")
 
-        for dish in x[2]:
-            db_dish = models.Dish(**dish)
-            db.add(db_dish)
-        await db.commit()
+    @staticmethod
+    async def create_xl(task_id: str, version: str):
+        """Sends catalog version to Celery to generate excel file, the worker fetches the rows itself"""
+        to_excel.apply_async((version, task_id), task_id=task_id)
+        await cache.client().set(export_marker(task_id), task_id, ex=config.EXPORT_MARKER_TTL)
+        return task_id
 
-        return True
+    @staticmethod
+    async def is_requested(task_id: str):
+        """Checks whether generation of excel file of the task has been requested recently"""
+        return bool(await cache.client().exists(export_marker(task_id)))
+
+    @staticmethod
+    async def is_queued(task_id: str):
+        """Checks whether the task is going to write its excel file.
 
+        A task that succeeded but whose file has been evicted, or that failed, has to be queued again.
+        """
+        return await CreateXL.is_requested(task_id) and get_status(task_id) in CreateXL.IN_PROGRESS
 
-class CreateXL:
     @staticmethod
-    async def create_xl(db: AsyncSession):
-        """Gets database data and sends it to Celery to generate excel file"""
-        res = (
-            await db.execute(
-                select(
-                    models.Menu.title,
-                    models.Menu.description,
-                    models.Menu.dishes_count,
-                    models.Submenu.title,
-                    models.Submenu.description,
-                    models.Submenu.dishes_count,
-                    models.Dish.title,
-                    models.Dish.description,
-                    models.Dish.price,
-                )
-                .join(models.Submenu, models.Dish.submenu_id == models.Submenu.id)
-                .join(models.Menu, models.Dish.menu_id == models.Menu.id)
-            )
-        ).all()
-        res = [tuple(row) for row in res]
-        task = to_excel.delay(res)
-        return task.id
+    def is_ready(task_id: str):
+        """Checks whether excel file of the task has already been generated"""
+        return os.path.exists(export_path(task_id))
 
     @staticmethod
     async def get_xl(task_id: str):
-        status = get_status(task_id)
-        if status == "SUCCESS":
+        if CreateXL.is_ready(task_id):
+            touch_export(task_id)
             headers = {"Content-Disposition": "attachment; filename=test_menu.xlsx"}
             return FileResponse(
-                "output/test_menu.xlsx",
+                export_path(task_id),
                 media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
                 headers=headers,
             )
-        else:
+        status = get_status(task_id)
+        if status == "SUCCESS":
+            return {"status": False, "message": "The file has expired, please request to generate excel file again"}
+        elif status in CreateXL.IN_PROGRESS:
             return {"status": f"{status}", "message": "Please wait"}
+        else:
+            return {"status": False, "message": "The file has failed to generate, please request to generate it again"}
@@ -1,9 +1,58 @@
+import time
+
+from sqlalchemy.engine import make_url
 from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 
 from . import config
 
-engine = create_async_engine(config.SQLALCHEMY_DATABASE_URL)
+
+class TimedQueuePool(AsyncAdaptedQueuePool):
+    """Queue pool that remembers how long connections were waited for"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.waits = 0
+        self.wait_time = 0.0
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            self.waits += 1
+            self.wait_time += time.perf_counter() - start
+
+    def recreate(self):
+        pool = super().recreate()
+        pool.waits, pool.wait_time = self.waits, self.wait_time
+        return pool
+
+
+def engine_options(url: str | None) -> dict:
+    """Returns pool and driver options from config, only PostgreSQL gets a queue pool and statement caches"""
+    if url is None or make_url(url).get_backend_name() != "postgresql":
+        return {}
+    options = {
+        "poolclass": TimedQueuePool,
+        "pool_size": config.DB_POOL_SIZE,
+        "max_overflow": config.DB_MAX_OVERFLOW,
+        "pool_timeout": config.DB_POOL_TIMEOUT,
+        "pool_recycle": config.DB_POOL_RECYCLE,
+        "pool_pre_ping": config.DB_POOL_PRE_PING,
+    }
+    if make_url(url).get_driver_name() == "asyncpg":
+        options["connect_args"] = {
+            # Statements asyncpg prepares on the server, 0 behind pgbouncer in transaction mode
+            "statement_cache_size": config.DB_STATEMENT_CACHE_SIZE,
+            # Prepared statements SQLAlchemy keeps per connection
+            "prepared_statement_cache_size": config.DB_PREPARED_STATEMENT_CACHE_SIZE,
+        }
+    return options
+
+
+engine = create_async_engine(config.SQLALCHEMY_DATABASE_URL, **engine_options(config.SQLALCHEMY_DATABASE_URL))
 Base = declarative_base()
 SessionLocal = sessionmaker(bind=engine, class_=AsyncSession, expire_on_commit=False)
@@ -0,0 +1,261 @@
+"""Bulk import of menus, submenus and dishes from JSON or CSV catalogs.
+
+Run from the project root: python -m menuapp.importer catalog.json|catalog.csv
+"""
+import asyncio
+import csv
+import json
+import re
+import sys
+from collections.abc import Iterable, Iterator
+from itertools import islice
+from typing import TextIO
+
+from sqlalchemy import func, insert, select, text, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from . import cache, config, models
+from .database import SessionLocal
+
+WHITESPACE = re.compile(r"\s*")
+# Parents go first, so that rows of a chunk are written after the rows they refer to
+TABLES = {table.name: table for table in (models.Menu.__table__, models.Submenu.__table__, models.Dish.__table__)}
+COLUMNS = {
+    "menus": ("id", "title", "description", "submenus_count", "dishes_count"),
+    "submenus": ("id", "title", "description", "menu_id", "dishes_count"),
+    "dishes": ("id", "title", "description", "price", "menu_id", "submenu_id"),
+}
+
+
+class JsonCatalogReader:
+    """Yields (table, entry) from [[menus], [submenus], [dishes]] reading the file in chunks.
+
+    Submenus and dishes refer to menus and submenus by their 1-based position in the file.
+    """
+
+    def __init__(self, f: TextIO, chunk_size: int = 2**16):
+        self.f = f
+        self.chunk_size = chunk_size
+        self.decoder = json.JSONDecoder()
+        self.buffer = ""
+        self.pos = 0
+
+    def _read(self) -> bool:
+        """Appends next chunk of the file to the buffer, dropping what has been parsed already"""
+        chunk = self.f.read(self.chunk_size)
+        consumed = self.pos
+        self.buffer = self.buffer[consumed:] + chunk
+        self.pos = 0
+        return bool(chunk)
+
+    def _skip_whitespace(self):
+        match = WHITESPACE.match(self.buffer, self.pos)
+        if match is not None:
+            self.pos = match.end()
+
+    def _peek(self) -> str:
+        """Returns next non-whitespace character without consuming it, empty string at the end of file"""
+        self._skip_whitespace()
+        while self.pos == len(self.buffer):
+            if not self._read():
+                return ""
+            self._skip_whitespace()
+        return self.buffer[self.pos]
+
+    def _expect(self, char: str):
+        if self._peek() != char:
+            raise ValueError(f"Expected {char!r} in the catalog")
+        self.pos += 1
+
+    def _object(self) -> dict:
+        while True:
+            try:
+                value, self.pos = self.decoder.raw_decode(self.buffer, self.pos)
+                return value
+            except json.JSONDecodeError:
+                # The object is cut by the end of the buffer, unless the file is over
+                if not self._read():
+                    raise
+
+    def __iter__(self) -> Iterator[tuple[str, dict]]:
+        self._expect("[")
+        for table in TABLES:
+            if self._peek() == "]":
+                break
+            self._expect("[")
+            while self._peek() != "]":
+                yield table, self._object()
+                if self._peek() == ",":
+                    self.pos += 1
+            self.pos += 1
+            if self._peek() == ",":
+                self.pos += 1
+        self._expect("]")
+
+
+def read_csv(f: TextIO) -> Iterator[tuple[str, dict]]:
+    """Yields (table, entry) from rows with menu_title, menu_description, submenu_title, submenu_description,
+    dish_title, dish_description and dish_price columns, menus and submenus are created on their first mention
+    """
+    menus: dict[str, int] = {}
+    submenus: dict[tuple[int, str], int] = {}
+    for row in csv.DictReader(f):
+        menu = menus.get(row["menu_title"])
+        if menu is None:
+            menu = menus[row["menu_title"]] = len(menus) + 1
+            yield "menus", {"title": row["menu_title"], "description": row.get("menu_description") or None}
+        submenu = submenus.get((menu, row["submenu_title"]))
+        if submenu is None:
+            submenu = submenus[menu, row["submenu_title"]] = len(submenus) + 1
+            description = row.get("submenu_description") or None
+            yield "submenus", {"title": row["submenu_title"], "description": description, "menu_id": menu}
+        if row.get("dish_title"):
+            yield "dishes", {
+                "title": row["dish_title"],
+                "description": row.get("dish_description") or None,
+                "price": row.get("dish_price") or None,
+                "menu_id": menu,
+                "submenu_id": submenu,
+            }
+
+
+class Ids:
+    """Gives ids to imported rows and remembers them for menus and submenus, which are referred to by position.
+
+    On PostgreSQL ids are taken from the sequences before the rows are copied, so that rows inserted
+    by the API during the import never collide with them and the sequences only move forward.
+    Elsewhere they follow the largest existing id.
+    """
+
+    def __init__(self, db: AsyncSession):
+        self.db = db
+        self.by_position: dict[str, list[int]] = {"menus": [], "submenus": []}
+        self.last: dict[str, int] = {}
+
+    async def take(self, table: str, count: int) -> list[int]:
+        if (await self.db.connection()).dialect.name == "postgresql":
+            sequence = f"pg_get_serial_sequence('{table}', 'id')"
+            statement = text(f"SELECT nextval({sequence}) FROM generate_series(1, :count)")
+            ids = list((await self.db.execute(statement, {"count": count})).scalars())
+        else:
+            if table not in self.last:
+                self.last[table] = (await self.db.execute(select(func.max(TABLES[table].c.id)))).scalar() or 0
+            ids = list(range(self.last[table] + 1, self.last[table] + count + 1))
+            self.last[table] += count
+        if table in self.by_position:
+            self.by_position[table] += ids
+        return ids
+
+    def parent(self, table: str, position: int) -> int:
+        """Returns id of the menu or submenu at 1-based position in the file"""
+        return self.by_position[table][position - 1]
+
+
+def to_record(table: str, entry: dict, row_id: int, ids: Ids) -> tuple:
+    """Builds a row in COLUMNS order, references to positions in the file are replaced with ids"""
+    if table == "menus":
+        return row_id, entry["title"], entry.get("description"), 0, 0
+    menu_id = ids.parent("menus", entry["menu_id"])
+    if table == "submenus":
+        return row_id, entry["title"], entry.get("description"), menu_id, 0
+    submenu_id = ids.parent("submenus", entry["submenu_id"])
+    return row_id, entry["title"], entry.get("description"), entry.get("price"), menu_id, submenu_id
+
+
+async def write_rows(table: str, rows: list[tuple], db: AsyncSession):
+    """Streams rows with COPY on PostgreSQL, falls back to executemany INSERT elsewhere"""
+    conn = await db.connection()
+    if conn.dialect.name == "postgresql":
+        raw = await conn.get_raw_connection()
+        await raw.driver_connection.copy_records_to_table(table, records=rows, columns=COLUMNS[table])
+    else:
+        await db.execute(insert(TABLES[table]), [dict(zip(COLUMNS[table], row)) for row in rows])
+
+
+async def recount(db: AsyncSession):
+    """Recomputes counters of all submenus and menus with one set-based UPDATE per table"""
+    menus, submenus, dishes = TABLES.values()
+    if (await db.connection()).dialect.name != "postgresql":
+        # Correlated subqueries work everywhere, but scan the children once per parent
+        await db.execute(
+            update(submenus).values(
+                dishes_count=select(func.count()).where(dishes.c.submenu_id == submenus.c.id).scalar_subquery()
+            )
+        )
+        await db.execute(
+            update(menus).values(
+                submenus_count=select(func.count()).where(submenus.c.menu_id == menus.c.id).scalar_subquery(),
+                dishes_count=select(func.count()).where(dishes.c.menu_id == menus.c.id).scalar_subquery(),
+            )
+        )
+        return
+    per_submenu = (
+        select(dishes.c.submenu_id, func.count().label("dishes_count")).group_by(dishes.c.submenu_id).subquery()
+    )
+    await db.execute(
+        update(submenus)
+        .where(submenus.c.id == per_submenu.c.submenu_id)
+        .values(dishes_count=per_submenu.c.dishes_count)
+    )
+    per_menu = (
+        select(
+            submenus.c.menu_id,
+            func.count().label("submenus_count"),
+            func.sum(submenus.c.dishes_count).label("dishes_count"),
+        )
+        .group_by(submenus.c.menu_id)
+        .subquery()
+    )
+    await db.execute(
+        update(menus)
+        .where(menus.c.id == per_menu.c.menu_id)
+        .values(submenus_count=per_menu.c.submenus_count, dishes_count=per_menu.c.dishes_count)
+    )
+
+
+def read_chunk(entries: Iterator[tuple[str, dict]], size: int) -> list[tuple[str, dict]]:
+    return list(islice(entries, size))
+
+
+async def import_catalog(path: str, db: AsyncSession, chunk_size: int = config.IMPORT_CHUNK_SIZE) -> dict[str, int]:
+    """Loads JSON or CSV catalog in a single transaction, returns number of imported rows per table.
+
+    The file is parsed incrementally in a thread, chunk_size entries at a time,
+    and every chunk is written with one COPY per table.
+    """
+    ids = Ids(db)
+    counts = dict.fromkeys(TABLES, 0)
+    with open(path, encoding="utf-8", newline="") as f:
+        catalog: Iterable[tuple[str, dict]]
+        if path.endswith(".csv"):
+            catalog = read_csv(f)
+        else:
+            catalog = JsonCatalogReader(f)
+        entries = iter(catalog)
+        while chunk := await asyncio.to_thread(read_chunk, entries, chunk_size):
+            by_table: dict[str, list[dict]] = {name: [] for name in TABLES}
+            for table, entry in chunk:
+                by_table[table].append(entry)
+            for table, table_entries in by_table.items():
+                if not table_entries:
+                    continue
+                counts[table] += len(table_entries)
+                row_ids = await ids.take(table, len(table_entries))
+                records = [to_record(table, entry, row_id, ids) for entry, row_id in zip(table_entries, row_ids)]
+                await write_rows(table, records, db)
+    await recount(db)
+    await db.commit()
+    return counts
+
+
+async def main(path: str):
+    async with SessionLocal() as db:
+        counts = await import_catalog(path, db)
+    # Imported menus are added to the cached lists, exports of the old catalog are not served anymore
+    await cache.delete_cache("/api/v1/menus/", "/api/v1/menus/tree")
+    await cache.stop()
+    print(", ".join(f"{count} {table}" for table, count in counts.items()))
+
+
+if __name__ == "__main__":
+    asyncio.run(main(sys.argv[1]))
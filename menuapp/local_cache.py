@@ -0,0 +1,51 @@
+import time
+from collections import OrderedDict
+from typing import Any
+
+MISSING = object()
+
+
+class LocalCache:
+    """Bounded in-process LRU cache whose entries expire after ttl seconds"""
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.data: OrderedDict[str, tuple[float, Any]] = OrderedDict()
+
+    def get(self, key: str):
+        """Returns cached value or MISSING"""
+        item = self.data.get(key)
+        if item is None:
+            return MISSING
+        if item[0] < time.monotonic():
+            del self.data[key]
+            return MISSING
+        self.data.move_to_end(key)
+        return item[1]
+
+    def set(self, key: str, value):
+        if self.maxsize <= 0:
+            return
+        self.data[key] = (time.monotonic() + self.ttl, value)
+        self.data.move_to_end(key)
+        while len(self.data) > self.maxsize:
+            self.data.popitem(last=False)
+
+    def discard(self, key: str):
+        self.data.pop(key, None)
+
+    def discard_pages(self, url: str):
+        """Removes url and the same url with any query string"""
+        prefix = url + "?"
+        for key in [key for key in self.data if key == url or key.startswith(prefix)]:
+            del self.data[key]
+
+    def discard_tree(self, url: str):
+        """Removes url and every url under it"""
+        prefix = url.rstrip("/") + "/"
+        for key in [key for key in self.data if key == url or key.startswith(prefix)]:
+            del self.data[key]
+
+    def clear(self):
+        self.data.clear()
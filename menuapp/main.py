@@ -1,4 +1,5 @@
-from fastapi import Depends, FastAPI, HTTPException
+from fastapi import Depends, FastAPI, HTTPException, Request, Response
+from fastapi.responses import StreamingResponse
 
 from services.cxl_service import CxlService
 from services.cxl_service import get_cxl_service as cs
@@ -9,16 +10,29 @@ from services.menu_service import get_menu_service as ms
 from services.submenu_service import SubmenuService
 from services.submenu_service import get_submenu_service as ss
 
-from . import cache, crud, models, schemes
+from . import cache, config, crud, metrics, migrations, profiler, schemes, warmup
 from .database import engine
+from .pagination import Page, page_params
+from .responses import NDJSON, json_response, ndjson_response, wants_ndjson
 
 app = FastAPI(title="Приложение для меню")
+app.add_middleware(metrics.MetricsMiddleware)
+app.add_middleware(profiler.ProfilerMiddleware)
 
 
 @app.on_event("startup")
 async def startup_event():
-    async with engine.begin() as conn:
-        await conn.run_sync(models.Base.metadata.create_all)
+    await cache.start()
+    await migrations.upgrade(engine)
+    await cache.start_listener()
+    warmup.start()
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    await warmup.stop()
+    await cache.stop_listener()
+    await cache.stop()
 
 
 @app.post(
@@ -45,6 +59,8 @@ async def create_menu(menu: schemes.MenuBase, menu_service: MenuService = Depend
 async def update_menu(menu_id: int, menu: schemes.MenuUpdate, menu_service: MenuService = Depends(ms)):
     """Update menu item"""
     res = await menu_service.update_menu(menu_id, menu)
+    if res is False:
+        raise HTTPException(status_code=400, detail="menu already exists")
     if not res:
         raise HTTPException(status_code=404, detail="menu not found")
     return res
@@ -56,9 +72,48 @@ async def update_menu(menu_id: int, menu: schemes.MenuUpdate, menu_service: Menu
     response_model=list[schemes.Menu],
     tags=["Меню"],
 )
-async def read_menus(menu_service: MenuService = Depends(ms)):
+async def read_menus(
+    request: Request, page: Page = Depends(page_params(schemes.Menu)), menu_service: MenuService = Depends(ms)
+):
     """Read menus list"""
-    return await menu_service.read_menus()
+    return json_response(await menu_service.read_menus(page), request)
+
+
+@app.get(
+    path="/api/v1/menus/tree",
+    summary="Просмотреть все меню с подменю и блюдами",
+    response_model=list[schemes.MenuTree],
+    tags=["Меню"],
+)
+async def read_menus_tree(request: Request, menu_service: MenuService = Depends(ms)):
+    """Read menus with their submenus and dishes"""
+    return json_response(await menu_service.read_menus_tree(), request)
+
+
+@app.get(
+    path="/api/v1/catalog",
+    summary="Выгрузить весь каталог построчно",
+    response_class=StreamingResponse,
+    responses={200: {"content": {NDJSON: {}}, "description": "Меню, затем подменю, затем блюда, по объекту в строке"}},
+    tags=["Меню"],
+)
+async def read_catalog(menu_service: MenuService = Depends(ms)):
+    """Stream all menus, submenus and dishes as NDJSON"""
+    return ndjson_response(menu_service.stream_catalog())
+
+
+@app.get(
+    path="/api/v1/menus/{menu_id}/tree",
+    summary="Просмотреть меню с подменю и блюдами",
+    response_model=schemes.MenuTree,
+    tags=["Меню"],
+)
+async def read_menu_tree(menu_id: int, request: Request, menu_service: MenuService = Depends(ms)):
+    """Read menu item with its submenus and dishes"""
+    res = await menu_service.read_menu_tree(menu_id)
+    if not res:
+        raise HTTPException(status_code=404, detail="menu not found")
+    return json_response(res, request)
 
 
 @app.get(
@@ -67,12 +122,12 @@ async def read_menus(menu_service: MenuService = Depends(ms)):
     response_model=schemes.Menu,
     tags=["Меню"],
 )
-async def read_menu(menu_id: int, menu_service: MenuService = Depends(ms)):
+async def read_menu(menu_id: int, request: Request, menu_service: MenuService = Depends(ms)):
     """Read menu item"""
     res = await menu_service.read_menu(menu_id)
     if not res:
         raise HTTPException(status_code=404, detail="menu not found")
-    return res
+    return json_response(res, request)
 
 
 @app.delete(
@@ -116,6 +171,8 @@ async def update_submenu(
 ):
     """Update submenu item"""
     res = await submenu_service.update_submenu(menu_id, submenu_id, submenu)
+    if res is False:
+        raise HTTPException(status_code=400, detail="submenu already exists")
     if not res:
         raise HTTPException(status_code=404, detail="submenu not found")
     return res
@@ -127,9 +184,14 @@ async def update_submenu(
     response_model=list[schemes.Submenu],
     tags=["Подменю"],
 )
-async def read_submenus(menu_id: int, submenu_service: SubmenuService = Depends(ss)):
+async def read_submenus(
+    menu_id: int,
+    request: Request,
+    page: Page = Depends(page_params(schemes.Submenu)),
+    submenu_service: SubmenuService = Depends(ss),
+):
     """Read submenus list"""
-    return await submenu_service.read_submenus(menu_id)
+    return json_response(await submenu_service.read_submenus(menu_id, page), request)
 
 
 @app.get(
@@ -138,12 +200,12 @@ async def read_submenus(menu_id: int, submenu_service: SubmenuService = Depends(
     response_model=schemes.Submenu,
     tags=["Подменю"],
 )
-async def read_submenu(menu_id: int, submenu_id: int, submenu_service: SubmenuService = Depends(ss)):
+async def read_submenu(menu_id: int, submenu_id: int, request: Request, submenu_service: SubmenuService = Depends(ss)):
     """Read submenu item"""
     res = await submenu_service.read_submenu(menu_id, submenu_id)
     if not res:
         raise HTTPException(status_code=404, detail="submenu not found")
-    return res
+    return json_response(res, request)
 
 
 @app.delete(
@@ -161,6 +223,22 @@ async def delete_submenu(menu_id: int, submenu_id: int, submenu_service: Submenu
     return res
 
 
+@app.post(
+    path="/api/v1/menus/{menu_id}/submenus:batch",
+    summary="Создать, обновить и удалить подменю пакетом",
+    response_model=schemes.SubmenuBatchResult,
+    tags=["Подменю"],
+)
+async def batch_submenus(menu_id: int, batch: schemes.SubmenuBatch, submenu_service: SubmenuService = Depends(ss)):
+    """Create, update and delete submenu items in a single transaction"""
+    res = await submenu_service.apply_batch(menu_id, batch)
+    if res is False:
+        raise HTTPException(status_code=400, detail="submenu already exists")
+    if res is None:
+        raise HTTPException(status_code=404, detail="submenu not found")
+    return res
+
+
 @app.post(
     path="/api/v1/menus/{menu_id}/submenus/{submenu_id}/dishes",
     summary="Создать блюдо",
@@ -196,6 +274,8 @@ async def update_dish(
 ):
     """Update dish item"""
     res = await dish_service.update_dish(menu_id, submenu_id, dish_id, dish)
+    if res is False:
+        raise HTTPException(status_code=400, detail="dish already exists")
     if not res:
         raise HTTPException(status_code=404, detail="dish not found")
     return res
@@ -205,15 +285,20 @@ async def update_dish(
     path="/api/v1/menus/{menu_id}/submenus/{submenu_id}/dishes",
     summary="Просмотреть список блюд",
     response_model=list[schemes.Dish],
+    responses={200: {"content": {NDJSON: {}}, "description": f"Блюда построчно, если Accept: {NDJSON}"}},
     tags=["Блюда"],
 )
 async def read_dishes(
     menu_id: int,
     submenu_id: int,
+    request: Request,
+    page: Page = Depends(page_params(schemes.Dish)),
     dish_service: DishService = Depends(ds),
 ):
-    """Read dishes list"""
-    return await dish_service.read_dishes(menu_id, submenu_id)
+    """Read dishes list, streamed from database as NDJSON if the client accepts it"""
+    if wants_ndjson(request):
+        return ndjson_response(dish_service.stream_dishes(menu_id, submenu_id, page))
+    return json_response(await dish_service.read_dishes(menu_id, submenu_id, page), request)
 
 
 @app.get(
@@ -226,13 +311,14 @@ async def read_dish(
     menu_id: int,
     submenu_id: int,
     dish_id: int,
+    request: Request,
     dish_service: DishService = Depends(ds),
 ):
     """Read dish item"""
     res = await dish_service.read_dish(menu_id, submenu_id, dish_id)
     if not res:
         raise HTTPException(status_code=404, detail="dish not found")
-    return res
+    return json_response(res, request)
 
 
 @app.delete(
@@ -255,6 +341,27 @@ async def delete_dish(
     return res
 
 
+@app.post(
+    path="/api/v1/menus/{menu_id}/submenus/{submenu_id}/dishes:batch",
+    summary="Создать, обновить и удалить блюда пакетом",
+    response_model=schemes.DishBatchResult,
+    tags=["Блюда"],
+)
+async def batch_dishes(
+    menu_id: int,
+    submenu_id: int,
+    batch: schemes.DishBatch,
+    dish_service: DishService = Depends(ds),
+):
+    """Create, update and delete dish items in a single transaction"""
+    res = await dish_service.apply_batch(menu_id, submenu_id, batch)
+    if res is False:
+        raise HTTPException(status_code=400, detail="dish already exists")
+    if res is None:
+        raise HTTPException(status_code=404, detail="dish not found")
+    return res
+
+
 @app.post(
     path="/api/v1/fill/",
     summary="1. Создание тестового меню",
@@ -286,7 +393,22 @@ async def create_excel_file(cxl_service: CxlService = Depends(cs)):
     tags=["Выгрузка тестового меню в excel-файл"],
 )
 async def download_xl(task_id: str):
-    if cache.get_cache(f"celery{task_id}"):
+    # A generated file is served even after the request for it has been forgotten
+    if crud.CreateXL.is_ready(task_id) or await crud.CreateXL.is_requested(task_id):
         return await crud.CreateXL.get_xl(task_id)
     else:
         return {"status": False, "message": "Please request to generate excel file first"}
+
+
+@app.get(path="/metrics", include_in_schema=False)
+async def read_metrics():
+    content, media_type = metrics.render()
+    return Response(content, media_type=media_type)
+
+
+@app.get(path="/debug/profiles", include_in_schema=False)
+async def read_profiles():
+    """Read SQL statements and Redis commands of recent requests of this worker"""
+    if not config.PROFILE_REQUESTS:
+        raise HTTPException(status_code=404, detail="profiler is disabled")
+    return [profile.dict() for profile in reversed(profiler.profiles)]
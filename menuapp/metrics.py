@@ -0,0 +1,135 @@
+import time
+from contextvars import ContextVar
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    Counter,
+    Histogram,
+    generate_latest,
+)
+from prometheus_client.core import GaugeMetricFamily, SummaryMetricFamily
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncEngine
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from .database import TimedQueuePool, engine
+
+# Statements per request are few, a histogram of their number shows N+1 patterns
+QUERY_BUCKETS = (0, 1, 2, 3, 4, 5, 8, 13, 21, 34, 55, 100)
+
+request_duration = Histogram(
+    "http_request_duration_seconds", "Time to respond, until the last byte is sent", ["method", "route", "status"]
+)
+request_queries = Histogram(
+    "http_request_db_queries", "SQL statements executed per request", ["route"], buckets=QUERY_BUCKETS
+)
+request_db_duration = Histogram("http_request_db_seconds", "Time spent in SQL statements per request", ["route"])
+query_duration = Histogram(
+    "db_query_duration_seconds", "Time SQL statements take, failed ones included", ["statement", "result"]
+)
+cache_requests = Counter("cache_requests_total", "Cache reads by where the value came from", ["operation", "result"])
+cache_duration = Histogram("cache_operation_duration_seconds", "Time cache operations take", ["operation"])
+render_duration = Histogram("render_duration_seconds", "Time spent rendering loaded rows with response schemes")
+
+
+class RequestStats:
+    """SQL statements executed while handling a request"""
+
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0.0
+
+
+# Set for each request, so that statements are added to the request that executed them
+request_stats: ContextVar[RequestStats | None] = ContextVar("request_stats", default=None)
+
+
+class PoolCollector:
+    """Reports the state of the database connection pool of this worker at scrape time"""
+
+    def __init__(self, engine: AsyncEngine):
+        self.engine = engine
+
+    def collect(self):
+        pool = self.engine.pool
+        if not isinstance(pool, TimedQueuePool):
+            return
+        yield GaugeMetricFamily("db_pool_size", "Connections the pool keeps open", value=pool.size())
+        yield GaugeMetricFamily("db_pool_checked_out", "Connections in use", value=pool.checkedout())
+        # The overflow counter starts below zero while the pool is not full yet
+        yield GaugeMetricFamily(
+            "db_pool_overflow", "Connections open over the pool size", value=max(pool.overflow(), 0)
+        )
+        yield SummaryMetricFamily(
+            "db_pool_wait_seconds", "Time spent getting a connection", count_value=pool.waits, sum_value=pool.wait_time
+        )
+
+
+def instrument_engine(engine: AsyncEngine):
+    """Times every statement executed by the engine and adds it to the stats of the current request"""
+
+    @event.listens_for(engine.sync_engine, "before_cursor_execute")
+    def before_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+    @event.listens_for(engine.sync_engine, "after_cursor_execute")
+    def after_execute(conn, cursor, statement, parameters, context, executemany):
+        observe(conn, statement, "ok")
+
+    # after_cursor_execute is not fired for a statement that fails
+    @event.listens_for(engine.sync_engine, "handle_error")
+    def handle_error(context):
+        conn = context.connection
+        if conn is not None and context.statement is not None and conn.info.get("query_start"):
+            observe(conn, context.statement, "error")
+
+
+def observe(conn, statement: str, result: str):
+    elapsed = time.perf_counter() - conn.info["query_start"].pop()
+    query_duration.labels(statement.split(None, 1)[0].upper(), result).observe(elapsed)
+    stats = request_stats.get()
+    if stats is not None:
+        stats.queries += 1
+        stats.db_time += elapsed
+
+
+class MetricsMiddleware:
+    """Observes latency and SQL statements of every request by the route template it matched"""
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        start = time.perf_counter()
+        stats = RequestStats()
+        token = request_stats.set(stats)
+        status = 500
+
+        async def send_status(message: Message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_status)
+        finally:
+            request_stats.reset(token)
+            # The router sets the route it matched, paths of unknown urls are not used to keep labels few
+            route = getattr(scope.get("route"), "path", "unmatched")
+            request_duration.labels(scope["method"], route, status).observe(time.perf_counter() - start)
+            request_queries.labels(route).observe(stats.queries)
+            request_db_duration.labels(route).observe(stats.db_time)
+
+
+REGISTRY.register(PoolCollector(engine))
+instrument_engine(engine)
+
+
+def render() -> tuple[bytes, str]:
+    """Returns metrics of this worker in Prometheus text format and its content type"""
+    return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
@@ -0,0 +1,36 @@
+import os
+
+from alembic import command
+from alembic.config import Config
+from sqlalchemy import inspect, text
+from sqlalchemy.engine import Connection
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Revision matching the schema create_all used to build, databases created that way start from it
+BASELINE = "0001"
+# Arbitrary key of the advisory lock that keeps workers started together from migrating at the same time
+LOCK_KEY = 6_402_011
+
+
+def alembic_config(connection: Connection | None = None) -> Config:
+    cfg = Config(os.path.join(ROOT, "alembic.ini"))
+    cfg.set_main_option("script_location", os.path.join(ROOT, "migrations"))
+    cfg.attributes["connection"] = connection
+    return cfg
+
+
+def run_upgrade(connection: Connection):
+    """Upgrades the schema to the latest revision"""
+    if connection.dialect.name == "postgresql":
+        connection.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": LOCK_KEY})
+    cfg = alembic_config(connection)
+    tables = inspect(connection).get_table_names()
+    if "menus" in tables and "alembic_version" not in tables:
+        command.stamp(cfg, BASELINE)
+    command.upgrade(cfg, "head")
+
+
+async def upgrade(engine: AsyncEngine):
+    async with engine.begin() as conn:
+        await conn.run_sync(run_upgrade)
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, ForeignKey, Integer, String
+from sqlalchemy import Column, ForeignKey, Index, Integer, String
 from sqlalchemy.orm import relationship
 
 from .database import Base
@@ -9,39 +9,47 @@ class Menu(Base):
 
     __tablename__ = "menus"
 
-    id = Column(Integer, primary_key=True, index=True)
-    title = Column(String, index=True)
-    description = Column(String, index=True)
-    submenus_count = Column(Integer, index=True)
-    dishes_count = Column(Integer, index=True)
+    id = Column(Integer, primary_key=True)
+    title = Column(String, index=True, unique=True)
+    description = Column(String)
+    submenus_count = Column(Integer)
+    dishes_count = Column(Integer)
 
-    submenus = relationship("Submenu", back_populates="menu", cascade="all, delete-orphan")
+    submenus = relationship("Submenu", back_populates="menu", cascade="all, delete-orphan", order_by="Submenu.id")
 
 
 class Submenu(Base):
     """Subenu data model for database queries"""
 
     __tablename__ = "submenus"
-
-    id = Column(Integer, primary_key=True, index=True)
-    title = Column(String, index=True)
-    description = Column(String, index=True)
+    __table_args__ = (
+        Index("ix_submenus_menu_id_id", "menu_id", "id"),
+        Index("ix_submenus_menu_id_title", "menu_id", "title", unique=True),
+    )
+
+    id = Column(Integer, primary_key=True)
+    title = Column(String)
+    description = Column(String)
     menu_id = Column(Integer, ForeignKey("menus.id"))
-    dishes_count = Column(Integer, index=True)
+    dishes_count = Column(Integer)
 
     menu = relationship("Menu", back_populates="submenus")
-    dishes = relationship("Dish", back_populates="submenu", cascade="all, delete-orphan")
+    dishes = relationship("Dish", back_populates="submenu", cascade="all, delete-orphan", order_by="Dish.id")
 
 
 class Dish(Base):
     """Dish data model for database queries"""
 
     __tablename__ = "dishes"
-
-    id = Column(Integer, primary_key=True, index=True)
-    title = Column(String, index=True)
-    description = Column(String, index=True)
-    price = Column(String, index=True)
+    __table_args__ = (
+        Index("ix_dishes_menu_id_submenu_id_id", "menu_id", "submenu_id", "id"),
+        Index("ix_dishes_submenu_id_title", "submenu_id", "title", unique=True),
+    )
+
+    id = Column(Integer, primary_key=True)
+    title = Column(String)
+    description = Column(String)
+    price = Column(String)
     menu_id = Column(Integer, ForeignKey("menus.id"))
     submenu_id = Column(Integer, ForeignKey("submenus.id"))
 
@@ -0,0 +1,59 @@
+from collections.abc import Callable, Hashable
+from functools import lru_cache
+from typing import NamedTuple, cast, get_type_hints
+from urllib.parse import urlencode
+
+from fastapi import HTTPException, Query
+from pydantic import BaseModel, create_model
+
+from . import config
+
+
+class Page(NamedTuple):
+    """Keyset pagination by id and field projection of a list endpoint"""
+
+    after: int | None = None
+    limit: int | None = None
+    fields: tuple[str, ...] | None = None
+
+    @property
+    def query(self) -> str:
+        """Returns query string the page is cached under, empty for the whole list"""
+        params = {"after": self.after, "limit": self.limit, "fields": ",".join(self.fields) if self.fields else None}
+        query = urlencode({name: value for name, value in params.items() if value is not None})
+        return f"?{query}" if query else ""
+
+    def scheme(self, scheme: type[BaseModel]) -> type[BaseModel]:
+        """Returns scheme items of the page are rendered with"""
+        # Model classes are hashable, the metaclass of pydantic is just not annotated as such
+        return projection(cast(Hashable, scheme), self.fields) if self.fields else scheme
+
+
+@lru_cache
+def projection(scheme: type[BaseModel], fields: tuple[str, ...]) -> type[BaseModel]:
+    """Returns scheme with only the given fields, cached by the scheme class and the fields"""
+    hints = get_type_hints(scheme)
+    definitions = {
+        name: (hints[name], ... if scheme.__fields__[name].required else scheme.__fields__[name].default)
+        for name in fields
+    }
+    return create_model(f"{scheme.__name__}Projection", __config__=scheme.__config__, **definitions)
+
+
+def page_params(scheme: type[BaseModel]) -> Callable[..., Page]:
+    """Returns dependency reading pagination and projection parameters of a list of scheme items"""
+
+    def params(
+        after: int | None = Query(None, description="Id of the last item of the previous page"),
+        limit: int | None = Query(None, ge=1, le=config.PAGE_MAX_SIZE, description="Page size, all items if empty"),
+        fields: str | None = Query(None, description="Comma separated fields to respond with, id is always included"),
+    ) -> Page:
+        if fields is None:
+            return Page(after, limit)
+        names = tuple(dict.fromkeys(["id"] + [name.strip() for name in fields.split(",") if name.strip()]))
+        unknown = [name for name in names if name not in scheme.__fields__]
+        if unknown:
+            raise HTTPException(status_code=422, detail=f"unknown fields: {', '.join(unknown)}")
+        return Page(after, limit, names)
+
+    return params
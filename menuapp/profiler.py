@@ -0,0 +1,194 @@
+"""Opt-in per-request profiler of SQL statements and Redis commands, for development and canary builds"""
+import logging
+import re
+import time
+from collections import Counter, deque
+from contextvars import ContextVar
+
+import redis.asyncio as redis
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncEngine
+from starlette.datastructures import MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from . import config
+from .database import engine
+
+# Bind parameters of any driver, literal numbers and strings
+PARAMETER = re.compile(r"\$\d+|%\(\w+\)s|%s|\?|:\w+|\b\d+\b|'(?:[^']|'')*'")
+# Expanded IN lists differ only in the number of parameters
+PARAMETERS = re.compile(r"\?(?:\s*,\s*\?)+")
+WHITESPACE = re.compile(r"\s+")
+
+logger = logging.getLogger(__name__)
+
+
+def shape(statement: str) -> str:
+    """Returns statement with parameters and literals replaced, statements of the same shape differ only in them"""
+    statement = PARAMETER.sub("?", WHITESPACE.sub(" ", statement.strip()))
+    return PARAMETERS.sub("?", statement)
+
+
+class Profile:
+    """SQL statements and Redis commands executed while handling a request, with their durations"""
+
+    def __init__(self, method: str = "", path: str = ""):
+        self.method = method
+        self.path = path
+        self.route = ""
+        self.status = 0
+        self.duration = 0.0
+        self.queries: list[tuple[str, float]] = []
+        self.commands: list[tuple[str, float]] = []
+        # Background tasks started by the request share the profile, their work is not part of the request
+        self.finished = False
+
+    @property
+    def db_time(self) -> float:
+        return sum(duration for _, duration in self.queries)
+
+    @property
+    def redis_time(self) -> float:
+        return sum(duration for _, duration in self.commands)
+
+    def repeated(self, threshold: int = config.PROFILE_N_PLUS_ONE) -> dict[str, int]:
+        """Returns shapes of SELECT statements executed at least threshold times, a sign of N+1 queries"""
+        counts = Counter(
+            shape(statement) for statement, _ in self.queries if statement.lstrip()[:6].upper() == "SELECT"
+        )
+        return {statement: count for statement, count in counts.items() if count >= threshold}
+
+    def server_timing(self) -> str:
+        """Returns Server-Timing header value with time spent in the database and in Redis"""
+        timings = [
+            f'db;dur={self.db_time * 1000:.1f};desc="{len(self.queries)} queries"',
+            f'redis;dur={self.redis_time * 1000:.1f};desc="{len(self.commands)} commands"',
+        ]
+        if repeated := self.repeated():
+            timings.append(f'n-plus-one;desc="{len(repeated)} repeated queries"')
+        return ", ".join(timings)
+
+    def dict(self) -> dict:
+        return {
+            "method": self.method,
+            "path": self.path,
+            "route": self.route,
+            "status": self.status,
+            "duration": self.duration,
+            "db_time": self.db_time,
+            "redis_time": self.redis_time,
+            "queries": [{"statement": statement, "duration": duration} for statement, duration in self.queries],
+            "commands": [{"command": command, "duration": duration} for command, duration in self.commands],
+            "repeated": self.repeated(),
+        }
+
+
+profile: ContextVar[Profile | None] = ContextVar("profile", default=None)
+# Profiles of finished requests are added to the list, set by tests to check query budgets
+recording: ContextVar[list[Profile] | None] = ContextVar("recording", default=None)
+# Recent profiles of this worker shown by the debug endpoint
+profiles: deque[Profile] = deque(maxlen=config.PROFILE_HISTORY)
+
+
+def current() -> Profile | None:
+    active = profile.get()
+    return None if active is None or active.finished else active
+
+
+def instrument_engine(engine: AsyncEngine):
+    """Adds statements executed by the engine to the profile of the current request"""
+
+    @event.listens_for(engine.sync_engine, "before_cursor_execute")
+    def before_execute(conn, cursor, statement, parameters, context, executemany):
+        if current() is not None:
+            conn.info["profile_start"] = time.perf_counter()
+
+    @event.listens_for(engine.sync_engine, "after_cursor_execute")
+    def after_execute(conn, cursor, statement, parameters, context, executemany):
+        record(conn, statement)
+
+    # A failed statement takes a round trip too, but after_cursor_execute is not fired for it
+    @event.listens_for(engine.sync_engine, "handle_error")
+    def handle_error(context):
+        if context.connection is not None and context.statement is not None:
+            record(context.connection, context.statement)
+
+
+def record(conn, statement: str):
+    active = current()
+    start = conn.info.pop("profile_start", None)
+    if active is not None and start is not None:
+        active.queries.append((statement, time.perf_counter() - start))
+
+
+class ProfiledPipeline(redis.client.Pipeline):
+    """Pipeline that adds itself to the profile as one command, as it takes one round trip"""
+
+    async def execute(self, raise_on_error: bool = True):
+        active = current()
+        if active is None:
+            return await super().execute(raise_on_error)
+        names = sorted({str(args[0]) for args, _ in self.command_stack})
+        start = time.perf_counter()
+        try:
+            return await super().execute(raise_on_error)
+        finally:
+            active.commands.append((f"PIPELINE {' '.join(names)}", time.perf_counter() - start))
+
+
+class ProfiledRedis(redis.Redis):
+    """Redis client that adds commands to the profile of the current request"""
+
+    async def execute_command(self, *args, **options):
+        active = current()
+        if active is None:
+            return await super().execute_command(*args, **options)
+        start = time.perf_counter()
+        try:
+            return await super().execute_command(*args, **options)
+        finally:
+            active.commands.append((str(args[0]), time.perf_counter() - start))
+
+    def pipeline(self, transaction: bool = True, shard_hint: str | None = None) -> ProfiledPipeline:
+        return ProfiledPipeline(self.connection_pool, self.response_callbacks, transaction, shard_hint)
+
+
+class ProfilerMiddleware:
+    """Profiles requests when PROFILE_REQUESTS is set or profiles are recorded, does nothing otherwise.
+
+    Adds Server-Timing header to responses, logs repeated queries and keeps recent profiles.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        recorded = recording.get()
+        if scope["type"] != "http" or not (config.PROFILE_REQUESTS or recorded is not None):
+            await self.app(scope, receive, send)
+            return
+        start = time.perf_counter()
+        active = Profile(scope["method"], scope["path"])
+        token = profile.set(active)
+
+        async def send_timing(message: Message):
+            if message["type"] == "http.response.start":
+                active.status = message["status"]
+                MutableHeaders(scope=message).append("Server-Timing", active.server_timing())
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_timing)
+        finally:
+            active.finished = True
+            profile.reset(token)
+            active.duration = time.perf_counter() - start
+            active.route = getattr(scope.get("route"), "path", "")
+            for statement, count in active.repeated().items():
+                logger.warning("%s %s executed %d times: %s", active.method, active.path, count, statement)
+            profiles.append(active)
+            if recorded is not None:
+                recorded.append(active)
+
+
+instrument_engine(engine)
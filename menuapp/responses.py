@@ -0,0 +1,47 @@
+import hashlib
+from collections.abc import AsyncIterator
+
+from fastapi import Request, Response
+from fastapi.responses import StreamingResponse
+
+from .codecs import get_codec
+
+NDJSON = "application/x-ndjson"
+
+json_codec = get_codec()
+
+
+def etag(payload: bytes) -> str:
+    return f'"{hashlib.blake2b(payload, digest_size=16).hexdigest()}"'
+
+
+def is_not_modified(request: Request, tag: str) -> bool:
+    """Checks whether If-None-Match of the request matches the entity tag, weakly as RFC 9110 requires"""
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    return any(candidate.strip().removeprefix("W/") == tag for candidate in header.split(","))
+
+
+def json_response(payload: bytes, request: Request) -> Response:
+    """Sends already encoded JSON as it is, bypassing response_model validation, or 304 if the client has it"""
+    headers = {"ETag": etag(payload)}
+    if is_not_modified(request, headers["ETag"]):
+        return Response(status_code=304, headers=headers)
+    return Response(payload, media_type="application/json", headers=headers)
+
+
+def wants_ndjson(request: Request) -> bool:
+    return NDJSON in request.headers.get("accept", "")
+
+
+def ndjson_response(chunks: AsyncIterator[list]) -> StreamingResponse:
+    """Streams items as newline delimited JSON, one write per chunk, without collecting them"""
+
+    async def lines():
+        async for items in chunks:
+            yield b"".join(json_codec.dumps(item) + b"\n" for item in items)
+
+    return StreamingResponse(lines(), media_type=NDJSON)
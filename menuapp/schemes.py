@@ -62,6 +62,37 @@ class DishDelete(BaseModel):
         schema_extra = {"example": {"status": "status", "message": "message"}}
 
 
+class DishBatchUpdate(DishUpdate):
+    """Scheme for input data for dish item update in a batch"""
+
+    id: int
+
+
+class DishBatch(BaseModel):
+    """Scheme for input data for dishes created, updated and deleted in a single transaction"""
+
+    create: list[DishBase] = []
+    update: list[DishBatchUpdate] = []
+    delete: list[int] = []
+
+    class Config:
+        schema_extra = {
+            "example": {
+                "create": [{"title": "dish title", "description": "dish description", "price": "0.00"}],
+                "update": [{"id": 1, "title": "updated dish title", "description": "updated dish description"}],
+                "delete": [2, 3],
+            }
+        }
+
+
+class DishBatchResult(BaseModel):
+    """Scheme for dishes batch response"""
+
+    created: list[Dish]
+    updated: list[Dish]
+    deleted: list[str]
+
+
 class SubmenuBase(BaseModel):
     """Scheme for input data for submenu item creation"""
 
@@ -120,6 +151,37 @@ class SubmenuDelete(BaseModel):
         schema_extra = {"example": {"status": "status", "message": "message"}}
 
 
+class SubmenuBatchUpdate(SubmenuUpdate):
+    """Scheme for input data for submenu item update in a batch"""
+
+    id: int
+
+
+class SubmenuBatch(BaseModel):
+    """Scheme for input data for submenus created, updated and deleted in a single transaction"""
+
+    create: list[SubmenuBase] = []
+    update: list[SubmenuBatchUpdate] = []
+    delete: list[int] = []
+
+    class Config:
+        schema_extra = {
+            "example": {
+                "create": [{"title": "submenu title", "description": "submenu description"}],
+                "update": [{"id": 1, "title": "updated submenu title", "description": "updated submenu description"}],
+                "delete": [2, 3],
+            }
+        }
+
+
+class SubmenuBatchResult(BaseModel):
+    """Scheme for submenus batch response"""
+
+    created: list[Submenu]
+    updated: list[Submenu]
+    deleted: list[str]
+
+
 class MenuBase(BaseModel):
     """Scheme for input data for menu item creation"""
 
@@ -170,6 +232,18 @@ class Menu(MenuBase):
         }
 
 
+class SubmenuTree(Submenu):
+    """Scheme for output submenu information with its dishes"""
+
+    dishes: list[Dish]
+
+
+class MenuTree(Menu):
+    """Scheme for output menu information with its submenus and their dishes"""
+
+    submenus: list[SubmenuTree]
+
+
 class MenuDelete(BaseModel):
     """Scheme for submenu removal response"""
 
@@ -0,0 +1,129 @@
+"""Preloads menus, submenus and dishes into the cache, so that first reads after a deploy or a change are hits"""
+import asyncio
+import logging
+import re
+import time
+
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from . import cache, config, crud, models, schemes
+from .database import SessionLocal
+
+MENUS_URL = "/api/v1/menus/"
+TREE_URL = "/api/v1/menus/tree"
+MENU_URL = re.compile(r"/api/v1/menus/(\d+)")
+
+logger = logging.getLogger(__name__)
+
+# Limits database sessions used by warm-ups at once, so that requests are not starved of connections
+sessions = asyncio.Semaphore(config.WARMUP_CONCURRENCY)
+tasks: set[asyncio.Task] = set()
+
+
+def start():
+    """Schedules warm-up of the whole catalog or its hottest menus on startup"""
+    if config.WARMUP_ON_STARTUP:
+        schedule()
+
+
+async def stop():
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+
+def invalidated(menu_id: int | None = None):
+    """Schedules warm-up of the menus list and the menu, or of the whole catalog, after their cache is invalidated"""
+    if config.WARMUP_ON_INVALIDATION:
+        schedule(menu_id)
+
+
+def schedule(menu_id: int | None = None):
+    task = asyncio.create_task(_run(menu_id))
+    # The event loop keeps only weak references to tasks
+    tasks.add(task)
+    task.add_done_callback(tasks.discard)
+
+
+async def _run(menu_id: int | None):
+    """Warms up after WARMUP_DELAY, changes made by any worker meanwhile are warmed up once"""
+    key = f"warmup:{'catalog' if menu_id is None else menu_id}"
+    try:
+        if not await cache.client().set(key, cache.INSTANCE_ID, nx=True, px=int(config.WARMUP_DELAY * 1000) or 1):
+            return
+        await asyncio.sleep(config.WARMUP_DELAY)
+        await warm(menu_id)
+    except Exception:
+        logger.exception("Cache warm-up of %s failed", key)
+
+
+async def catalog_size(db: AsyncSession) -> int:
+    """Counts menus, submenus and dishes by the counters of menus"""
+    counts = select(func.count(), func.coalesce(func.sum(models.Menu.submenus_count + models.Menu.dishes_count), 0))
+    menus, children = (await db.execute(counts)).one()
+    return menus + children
+
+
+async def warm(menu_id: int | None = None) -> bool:
+    """Caches the menus list and the given menu, or the hottest menus when none is given.
+
+    When no menu is given, catalogs of up to WARMUP_MAX_ROWS rows are cached whole, with the tree
+    of all menus. A change of one menu warms up only that menu, however small the catalog is.
+    Nothing is cached if the catalog changes meanwhile, as the change schedules a warm-up of its own.
+    Returns whether the values are cached.
+    """
+    version = await cache.catalog_version()
+    async with sessions, SessionLocal() as db:
+        start = time.perf_counter()
+        small = menu_id is None and await catalog_size(db) <= config.WARMUP_MAX_ROWS
+        menus = await crud.MenuCRUD.get_menus_tree(db=db) if small else await crud.MenuCRUD.get_menus(db=db)
+        delta = time.perf_counter() - start
+    values = {MENUS_URL: [schemes.Menu.from_orm(menu).dict() for menu in menus]}
+    if small:
+        values[TREE_URL] = [schemes.MenuTree.from_orm(menu).dict() for menu in menus]
+        for menu in menus:
+            values.update(menu_values(menu))
+    else:
+        values.update({f"/api/v1/menus/{menu['id']}": menu for menu in values[MENUS_URL]})
+        menu_ids = [menu_id] if menu_id is not None else await hottest_menus()
+        for menu in await asyncio.gather(*map(load_tree, menu_ids)):
+            if menu is not None:
+                values.update(menu_values(menu))
+    for batch in crud.chunks(values.items(), config.WARMUP_BATCH_SIZE):
+        if not await cache.set_many(dict(batch), delta=delta, version=version):
+            return False
+    return True
+
+
+async def hottest_menus() -> list[int]:
+    await cache.save_hits()
+    nodes = await cache.hottest(config.WARMUP_MENUS)
+    return [int(match.group(1)) for match in map(MENU_URL.fullmatch, nodes) if match]
+
+
+async def load_tree(menu_id: int) -> models.Menu | None:
+    async with sessions, SessionLocal() as db:
+        menus = await crud.MenuCRUD.get_menus_tree(db=db, menu_id=menu_id)
+    if not menus:
+        await cache.forget_hits(f"/api/v1/menus/{menu_id}")
+        return None
+    return menus[0]
+
+
+def menu_values(menu: models.Menu) -> dict:
+    """Renders everything cached under the menu from its eagerly loaded tree, lists are ordered by id"""
+    url = f"/api/v1/menus/{menu.id}"
+    submenus = sorted(menu.submenus, key=lambda submenu: submenu.id)
+    values = {
+        url: schemes.Menu.from_orm(menu).dict(),
+        f"{url}/tree": schemes.MenuTree.from_orm(menu).dict(),
+        f"{url}/submenus": [schemes.Submenu.from_orm(submenu).dict() for submenu in submenus],
+    }
+    for submenu in submenus:
+        submenu_url = f"{url}/submenus/{submenu.id}"
+        dishes = [schemes.Dish.from_orm(dish).dict() for dish in sorted(submenu.dishes, key=lambda dish: dish.id)]
+        values[submenu_url] = schemes.Submenu.from_orm(submenu).dict()
+        values[f"{submenu_url}/dishes"] = dishes
+        values.update({f"{submenu_url}/dishes/{dish['id']}": dish for dish in dishes})
+    return values
@@ -0,0 +1,53 @@
+"""Initial schema, as it was created by create_all
+
+Revision ID: 0001
+Revises:
+Create Date: 2023-02-20 12:00:00
+"""
+import sqlalchemy as sa
+from alembic import op
+
+revision = "0001"
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "menus",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("title", sa.String()),
+        sa.Column("description", sa.String()),
+        sa.Column("submenus_count", sa.Integer()),
+        sa.Column("dishes_count", sa.Integer()),
+    )
+    for column in ("id", "title", "description", "submenus_count", "dishes_count"):
+        op.create_index(f"ix_menus_{column}", "menus", [column])
+    op.create_table(
+        "submenus",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("title", sa.String()),
+        sa.Column("description", sa.String()),
+        sa.Column("menu_id", sa.Integer(), sa.ForeignKey("menus.id")),
+        sa.Column("dishes_count", sa.Integer()),
+    )
+    for column in ("id", "title", "description", "dishes_count"):
+        op.create_index(f"ix_submenus_{column}", "submenus", [column])
+    op.create_table(
+        "dishes",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("title", sa.String()),
+        sa.Column("description", sa.String()),
+        sa.Column("price", sa.String()),
+        sa.Column("menu_id", sa.Integer(), sa.ForeignKey("menus.id")),
+        sa.Column("submenu_id", sa.Integer(), sa.ForeignKey("submenus.id")),
+    )
+    for column in ("id", "title", "description", "price"):
+        op.create_index(f"ix_dishes_{column}", "dishes", [column])
+
+
+def downgrade():
+    op.drop_table("dishes")
+    op.drop_table("submenus")
+    op.drop_table("menus")
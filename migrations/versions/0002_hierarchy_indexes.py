@@ -0,0 +1,38 @@
+"""Index foreign keys used by list queries, drop indexes nothing filters on
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2023-02-20 12:30:00
+"""
+from alembic import op
+
+revision = "0002"
+down_revision = "0001"
+branch_labels = None
+depends_on = None
+
+# Primary keys are indexed already, descriptions, prices and counters are never filtered on
+DEAD_INDEXES = {
+    "menus": ("id", "description", "submenus_count", "dishes_count"),
+    "submenus": ("id", "description", "dishes_count"),
+    "dishes": ("id", "description", "price"),
+}
+
+
+def upgrade():
+    for table, columns in DEAD_INDEXES.items():
+        for column in columns:
+            op.drop_index(f"ix_{table}_{column}", table)
+    op.create_index("ix_submenus_menu_id", "submenus", ["menu_id"])
+    op.create_index("ix_dishes_menu_id_submenu_id", "dishes", ["menu_id", "submenu_id"])
+    # Lets deleting a submenu check its dishes without scanning the table
+    op.create_index("ix_dishes_submenu_id", "dishes", ["submenu_id"])
+
+
+def downgrade():
+    op.drop_index("ix_dishes_submenu_id", "dishes")
+    op.drop_index("ix_dishes_menu_id_submenu_id", "dishes")
+    op.drop_index("ix_submenus_menu_id", "submenus")
+    for table, columns in DEAD_INDEXES.items():
+        for column in columns:
+            op.create_index(f"ix_{table}_{column}", table, [column])
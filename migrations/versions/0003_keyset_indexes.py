@@ -0,0 +1,26 @@
+"""Extend list indexes with id, so that pages are read as index ranges in id order
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2023-02-27 12:00:00
+"""
+from alembic import op
+
+revision = "0003"
+down_revision = "0002"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index("ix_submenus_menu_id_id", "submenus", ["menu_id", "id"])
+    op.drop_index("ix_submenus_menu_id", "submenus")
+    op.create_index("ix_dishes_menu_id_submenu_id_id", "dishes", ["menu_id", "submenu_id", "id"])
+    op.drop_index("ix_dishes_menu_id_submenu_id", "dishes")
+
+
+def downgrade():
+    op.create_index("ix_dishes_menu_id_submenu_id", "dishes", ["menu_id", "submenu_id"])
+    op.drop_index("ix_dishes_menu_id_submenu_id_id", "dishes")
+    op.create_index("ix_submenus_menu_id", "submenus", ["menu_id"])
+    op.drop_index("ix_submenus_menu_id_id", "submenus")
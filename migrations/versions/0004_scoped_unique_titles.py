@@ -0,0 +1,51 @@
+"""Make titles unique within their parent, so that creates check them with ON CONFLICT instead of a lookup
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2023-03-06 12:00:00
+
+Titles used to be checked only when rows were created, updates could repeat them. Titles are
+user visible, so the upgrade does not rename them, it fails listing the repeated ones instead.
+They have to be renamed by an operator before the upgrade is run again.
+"""
+import sqlalchemy as sa
+from alembic import op
+
+revision = "0004"
+down_revision = "0003"
+branch_labels = None
+depends_on = None
+
+
+def duplicates(table: str, parent: str | None = None) -> list[str]:
+    """Describes groups of rows repeating a title within the parent"""
+    columns = f"{parent}, title" if parent else "title"
+    statement = f"SELECT {columns}, count(*) FROM {table} GROUP BY {columns} HAVING count(*) > 1 ORDER BY {columns}"
+    groups = op.get_bind().execute(sa.text(statement)).all()
+    if parent:
+        return [f"{table} {parent}={row[0]} title={row[1]!r}: {row[2]} rows" for row in groups]
+    return [f"{table} title={row[0]!r}: {row[1]} rows" for row in groups]
+
+
+def upgrade():
+    repeated = duplicates("menus") + duplicates("submenus", "menu_id") + duplicates("dishes", "submenu_id")
+    if repeated:
+        raise RuntimeError("Titles repeat within their parent, rename them and upgrade again:\n" + "\n".join(repeated))
+    op.drop_index("ix_menus_title", "menus")
+    op.create_index("ix_menus_title", "menus", ["title"], unique=True)
+    op.create_index("ix_submenus_menu_id_title", "submenus", ["menu_id", "title"], unique=True)
+    op.drop_index("ix_submenus_title", "submenus")
+    # Lookups by submenu use the leading column of the new index
+    op.create_index("ix_dishes_submenu_id_title", "dishes", ["submenu_id", "title"], unique=True)
+    op.drop_index("ix_dishes_title", "dishes")
+    op.drop_index("ix_dishes_submenu_id", "dishes")
+
+
+def downgrade():
+    op.create_index("ix_dishes_submenu_id", "dishes", ["submenu_id"])
+    op.create_index("ix_dishes_title", "dishes", ["title"])
+    op.drop_index("ix_dishes_submenu_id_title", "dishes")
+    op.create_index("ix_submenus_title", "submenus", ["title"])
+    op.drop_index("ix_submenus_menu_id_title", "submenus")
+    op.drop_index("ix_menus_title", "menus")
+    op.create_index("ix_menus_title", "menus", ["title"])
@@ -1,7 +1,7 @@
 from fastapi import Depends
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from menuapp import cache, config, crud, models, schemes
+from menuapp import cache, config, crud, models, schemes, warmup
 from menuapp.database import SessionLocal, engine
 
 
@@ -21,13 +21,18 @@ class CxlService:
                 await conn.run_sync(models.Base.metadata.drop_all)
                 await conn.run_sync(models.Base.metadata.create_all)
             await crud.FillMenu.fill(db=self.session)
+            # Ids start over, so everything cached under the old ones is dropped rather than kept stale
+            await cache.delete_tree("/api/v1/menus")
+            warmup.invalidated()
             return {"status": True, "message": "Success"}
         else:
             return None
 
     async def create_excel_file(self):
-        task_id = await crud.CreateXL.create_xl(db=self.session)
-        await cache.set_cache(f"celery{task_id}", task_id)
+        version = await cache.catalog_version()
+        task_id = f"menu-{version}"
+        if not crud.CreateXL.is_ready(task_id) and not await crud.CreateXL.is_queued(task_id):
+            await crud.CreateXL.create_xl(task_id=task_id, version=version)
         return {"task_id": task_id}
 
 
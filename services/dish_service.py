@@ -1,9 +1,9 @@
 from fastapi import Depends
-from fastapi.encoders import jsonable_encoder
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from menuapp import cache, crud, schemes
+from menuapp import cache, crud, schemes, warmup
 from menuapp.database import SessionLocal
+from menuapp.pagination import Page
 
 
 async def get_db():
@@ -17,50 +17,82 @@ class DishService:
         self.session = session
 
     async def create_dish(self, menu_id: int, submenu_id: int, dish: schemes.DishBase):
-        db_dish = await crud.DishCRUD.get_dish_by_title(db=self.session, dish_title=dish.title)
-        if db_dish:
+        db_dish = await crud.DishCRUD.create_dish(db=self.session, dish=dish, menu_id=menu_id, submenu_id=submenu_id)
+        if db_dish is None:
             return None
-        await cache.delete_cache(f"/api/v1/menus/{menu_id}")
-        return await crud.DishCRUD.create_dish(db=self.session, dish=dish, menu_id=menu_id, submenu_id=submenu_id)
+        await cache.delete_cache(
+            f"/api/v1/menus/{menu_id}/submenus/{submenu_id}",
+            f"/api/v1/menus/{menu_id}/submenus",
+            f"/api/v1/menus/{menu_id}/tree",
+            "/api/v1/menus/",
+            "/api/v1/menus/tree",
+            stale=[f"/api/v1/menus/{menu_id}"],
+        )
+        warmup.invalidated(menu_id)
+        return db_dish
 
     async def update_dish(self, menu_id: int, submenu_id: int, dish_id: int, dish: schemes.DishUpdate):
-        db_dish = await crud.DishCRUD.get_dish_by_id(db=self.session, dish_id=dish_id)
-        if db_dish:
-            db_dish.title = dish.title
-            db_dish.description = dish.description
-            db_dish.price = dish.price
+        async def updated(db_dish):
             await cache.set_cache(
                 f"/api/v1/menus/{menu_id}/submenus/{submenu_id}/dishes/{dish_id}",
-                jsonable_encoder(db_dish),
+                schemes.Dish.from_orm(db_dish).dict(),
             )
-            return await crud.DishCRUD.update_dish(db=self.session, dish_id=dish_id)
-        else:
-            return None
+            await cache.delete_cache(
+                f"/api/v1/menus/{menu_id}/submenus/{submenu_id}/dishes",
+                f"/api/v1/menus/{menu_id}/tree",
+                "/api/v1/menus/tree",
+            )
+            warmup.invalidated(menu_id)
+
+        return await crud.DishCRUD.update_dish(
+            db=self.session, dish_id=dish_id, menu_id=menu_id, submenu_id=submenu_id, dish=dish, on_commit=updated
+        )
+
+    async def read_dishes(self, menu_id: int, submenu_id: int, page: Page = Page()):
+        url = f"/api/v1/menus/{menu_id}/submenus/{submenu_id}/dishes"
+        return await cache.read_json(
+            f"{url}{page.query}",
+            lambda db: crud.DishCRUD.get_dishes(db=db, menu_id=menu_id, submenu_id=submenu_id, page=page),
+            self.session,
+            scheme=page.scheme(schemes.Dish),
+            related=None if page.fields else lambda dishes: {f"{url}/{dish['id']}": dish for dish in dishes},
+        )
 
-    async def read_dishes(self, menu_id: int, submenu_id: int):
-        dishes = await crud.DishCRUD.get_dishes(db=self.session, menu_id=menu_id, submenu_id=submenu_id)
-        if dishes:
-            for dish in dishes:
-                await cache.set_cache(
-                    f"/api/v1/menus/{menu_id}/submenus/\
-                    {submenu_id}/dishes/{dish.id}",
-                    jsonable_encoder(dish),
-                )
-        return dishes
+    async def stream_dishes(self, menu_id: int, submenu_id: int, page: Page = Page()):
+        scheme = page.scheme(schemes.Dish)
+        streamed = crud.DishCRUD.stream_dishes(db=self.session, menu_id=menu_id, submenu_id=submenu_id, page=page)
+        async for rows in streamed:
+            yield [scheme.from_orm(row).dict() for row in rows]
 
     async def read_dish(self, menu_id: int, submenu_id: int, dish_id: int):
-        cached = await cache.get_cache(f"/api/v1/menus/{menu_id}/submenus/{submenu_id}/dishes/{dish_id}")
-        if cached:
-            db_dish = cached
-        else:
-            db_dish = await crud.DishCRUD.get_dish_by_id(db=self.session, dish_id=dish_id)
-        if db_dish is None:
-            return None
-        await cache.set_cache(
+        return await cache.read_json(
             f"/api/v1/menus/{menu_id}/submenus/{submenu_id}/dishes/{dish_id}",
-            jsonable_encoder(db_dish),
+            lambda db: crud.DishCRUD.get_dish_by_id(db=db, dish_id=dish_id),
+            self.session,
+            scheme=schemes.Dish,
         )
-        return db_dish
+
+    async def apply_batch(self, menu_id: int, submenu_id: int, batch: schemes.DishBatch):
+        res = await crud.DishCRUD.apply_batch(db=self.session, batch=batch, menu_id=menu_id, submenu_id=submenu_id)
+        if not res:
+            return res
+        # The submenu is invalidated once, counters of the menu change only when dishes are added or removed
+        if res["created"] or res["deleted"]:
+            await cache.delete_cache(
+                f"/api/v1/menus/{menu_id}/submenus/{submenu_id}",
+                f"/api/v1/menus/{menu_id}/submenus",
+                f"/api/v1/menus/{menu_id}/tree",
+                "/api/v1/menus/",
+                "/api/v1/menus/tree",
+                stale=[f"/api/v1/menus/{menu_id}"],
+            )
+            warmup.invalidated(menu_id)
+        elif res["updated"]:
+            await cache.delete_cache(
+                f"/api/v1/menus/{menu_id}/submenus/{submenu_id}", f"/api/v1/menus/{menu_id}/tree", "/api/v1/menus/tree"
+            )
+            warmup.invalidated(menu_id)
+        return res
 
     async def delete_dish(self, menu_id: int, submenu_id: int, dish_id: int):
         db_dish = await crud.DishCRUD.delete_dish(
@@ -68,7 +100,15 @@ class DishService:
         )
         if db_dish is None:
             return None
-        await cache.delete_cache(f"/api/v1/menus/{menu_id}")
+        await cache.delete_cache(
+            f"/api/v1/menus/{menu_id}/submenus/{submenu_id}",
+            f"/api/v1/menus/{menu_id}/submenus",
+            f"/api/v1/menus/{menu_id}/tree",
+            "/api/v1/menus/",
+            "/api/v1/menus/tree",
+            stale=[f"/api/v1/menus/{menu_id}"],
+        )
+        warmup.invalidated(menu_id)
         return {"status": True, "message": "The dish has been deleted"}
 
 
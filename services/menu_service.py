@@ -1,9 +1,9 @@
 from fastapi import Depends
-from fastapi.encoders import jsonable_encoder
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from menuapp import cache, crud, schemes
+from menuapp import cache, crud, schemes, warmup
 from menuapp.database import SessionLocal
+from menuapp.pagination import Page
 
 
 async def get_db():
@@ -17,46 +17,75 @@ class MenuService:
         self.session = session
 
     async def create_menu(self, menu: schemes.MenuBase):
-        db_menu = await crud.MenuCRUD.get_menu_by_title(menu_title=menu.title, db=self.session)
-        if db_menu:
+        db_menu = await crud.MenuCRUD.create_menu(menu=menu, db=self.session)
+        if db_menu is None:
             return None
-        return await crud.MenuCRUD.create_menu(menu=menu, db=self.session)
+        await cache.delete_cache("/api/v1/menus/", "/api/v1/menus/tree")
+        warmup.invalidated(db_menu.id)
+        return db_menu
 
     async def update_menu(self, menu_id: int, menu: schemes.MenuUpdate):
-        db_menu = await crud.MenuCRUD.get_menu_by_id(menu_id=menu_id, db=self.session)
-        if db_menu:
-            db_menu.title = menu.title
-            db_menu.description = menu.description
-            await cache.set_cache(f"/api/v1/menus/{menu_id}", jsonable_encoder(db_menu))
-            return await crud.MenuCRUD.update_menu(menu_id=menu_id, db=self.session)
-        else:
-            return None
+        async def updated(db_menu):
+            await cache.set_cache(f"/api/v1/menus/{menu_id}", schemes.Menu.from_orm(db_menu).dict())
+            await cache.delete_cache("/api/v1/menus/", f"/api/v1/menus/{menu_id}/tree", "/api/v1/menus/tree")
+            warmup.invalidated(menu_id)
+
+        return await crud.MenuCRUD.update_menu(menu_id=menu_id, menu=menu, db=self.session, on_commit=updated)
 
-    async def read_menus(self):
-        menus = await crud.MenuCRUD.get_menus(db=self.session)
-        if menus:
-            for menu in menus:
-                await cache.set_cache(f"/api/v1/menus/{menu.id}", jsonable_encoder(menu))
-        return menus
+    async def read_menus(self, page: Page = Page()):
+        return await cache.read_json(
+            f"/api/v1/menus/{page.query}",
+            lambda db: crud.MenuCRUD.get_menus(db=db, page=page),
+            self.session,
+            scheme=page.scheme(schemes.Menu),
+            # Projected items lack fields, so only whole ones are cached as items
+            related=None if page.fields else lambda menus: {f"/api/v1/menus/{menu['id']}": menu for menu in menus},
+        )
 
     async def read_menu(self, menu_id: int):
-        cached = await cache.get_cache(f"/api/v1/menus/{menu_id}")
-        if cached:
-            db_menu = cached
-        else:
-            db_menu = await crud.MenuCRUD.get_menu_by_id(menu_id=menu_id, db=self.session)
-        if db_menu is None:
-            return None
-        await cache.set_cache(f"/api/v1/menus/{menu_id}", jsonable_encoder(db_menu))
-        return db_menu
+        return await cache.read_json(
+            f"/api/v1/menus/{menu_id}",
+            lambda db: crud.MenuCRUD.get_menu_by_id(menu_id=menu_id, db=db),
+            self.session,
+            scheme=schemes.Menu,
+        )
+
+    async def read_menus_tree(self):
+        return await cache.read_json(
+            "/api/v1/menus/tree", lambda db: crud.MenuCRUD.get_menus_tree(db=db), self.session, scheme=schemes.MenuTree
+        )
+
+    async def read_menu_tree(self, menu_id: int):
+        async def get_menu_tree(db: AsyncSession):
+            menus = await crud.MenuCRUD.get_menus_tree(db=db, menu_id=menu_id)
+            return menus[0] if menus else None
+
+        return await cache.read_json(
+            f"/api/v1/menus/{menu_id}/tree", get_menu_tree, self.session, scheme=schemes.MenuTree
+        )
+
+    async def stream_catalog(self):
+        """Yields chunks of menus, submenus and dishes with the type and parent ids of each"""
+        async for table, rows in crud.MenuCRUD.stream_catalog(db=self.session):
+            yield [catalog_line(table, row) for row in rows]
 
     async def delete_menu(self, menu_id: int):
         db_menu = await crud.MenuCRUD.delete_menu(menu_id=menu_id, db=self.session)
         if db_menu is None:
             return None
-        await cache.delete_cache(f"/api/v1/menus/{menu_id}")
+        await cache.delete_cache(f"/api/v1/menus/{menu_id}", "/api/v1/menus/", "/api/v1/menus/tree")
+        warmup.invalidated(menu_id)
         return {"status": True, "message": "The menu has been deleted"}
 
 
+def catalog_line(table: str, row) -> dict:
+    if table == "menus":
+        return {"type": "menu", **schemes.Menu.from_orm(row).dict()}
+    if table == "submenus":
+        return {"type": "submenu", "menu_id": str(row.menu_id), **schemes.Submenu.from_orm(row).dict()}
+    parents = {"menu_id": str(row.menu_id), "submenu_id": str(row.submenu_id)}
+    return {"type": "dish", **parents, **schemes.Dish.from_orm(row).dict()}
+
+
 def get_menu_service(session: AsyncSession = Depends(get_db)):
     return MenuService(session)
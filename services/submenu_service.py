@@ -1,9 +1,9 @@
 from fastapi import Depends
-from fastapi.encoders import jsonable_encoder
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from menuapp import cache, crud, schemes
+from menuapp import cache, crud, schemes, warmup
 from menuapp.database import SessionLocal
+from menuapp.pagination import Page
 
 
 async def get_db():
@@ -17,54 +17,78 @@ class SubmenuService:
         self.session = session
 
     async def create_submenu(self, menu_id: int, submenu: schemes.SubmenuBase):
-        db_submenu = await crud.SubmenuCRUD.get_submenu_by_title(submenu_title=submenu.title, db=self.session)
-        if db_submenu:
+        db_submenu = await crud.SubmenuCRUD.create_submenu(db=self.session, submenu=submenu, menu_id=menu_id)
+        if db_submenu is None:
             return None
-        await cache.delete_cache(f"/api/v1/menus/{menu_id}")
-        return await crud.SubmenuCRUD.create_submenu(db=self.session, submenu=submenu, menu_id=menu_id)
+        await cache.delete_cache(
+            f"/api/v1/menus/{menu_id}/submenus",
+            f"/api/v1/menus/{menu_id}/tree",
+            "/api/v1/menus/",
+            "/api/v1/menus/tree",
+            stale=[f"/api/v1/menus/{menu_id}"],
+        )
+        warmup.invalidated(menu_id)
+        return db_submenu
 
     async def update_submenu(self, menu_id: int, submenu_id: int, submenu: schemes.SubmenuUpdate):
-        db_submenu = await crud.SubmenuCRUD.get_submenu_by_id(db=self.session, submenu_id=submenu_id)
-        if db_submenu:
-            db_submenu.title = submenu.title
-            db_submenu.description = submenu.description
+        async def updated(db_submenu):
             await cache.set_cache(
                 f"/api/v1/menus/{menu_id}/submenus/{submenu_id}",
-                jsonable_encoder(db_submenu),
+                schemes.Submenu.from_orm(db_submenu).dict(),
             )
-            return await crud.SubmenuCRUD.update_submenu(db=self.session, submenu_id=submenu_id)
-        else:
-            return None
+            await cache.delete_cache(
+                f"/api/v1/menus/{menu_id}/submenus", f"/api/v1/menus/{menu_id}/tree", "/api/v1/menus/tree"
+            )
+            warmup.invalidated(menu_id)
+
+        return await crud.SubmenuCRUD.update_submenu(
+            db=self.session, menu_id=menu_id, submenu_id=submenu_id, submenu=submenu, on_commit=updated
+        )
 
-    async def read_submenus(self, menu_id: int):
-        submenus = await crud.SubmenuCRUD.get_submenus(db=self.session, menu_id=menu_id)
-        if submenus:
-            for submenu in submenus:
-                await cache.set_cache(
-                    f"/api/v1/menus/{menu_id}/submenus/{submenu.id}",
-                    jsonable_encoder(submenu),
-                )
-        return submenus
+    async def read_submenus(self, menu_id: int, page: Page = Page()):
+        url = f"/api/v1/menus/{menu_id}/submenus"
+        return await cache.read_json(
+            f"{url}{page.query}",
+            lambda db: crud.SubmenuCRUD.get_submenus(db=db, menu_id=menu_id, page=page),
+            self.session,
+            scheme=page.scheme(schemes.Submenu),
+            related=None if page.fields else lambda submenus: {f"{url}/{item['id']}": item for item in submenus},
+        )
 
     async def read_submenu(self, menu_id: int, submenu_id: int):
-        cached = await cache.get_cache(f"/api/v1/menus/{menu_id}/submenus/{submenu_id}")
-        if cached:
-            db_submenu = cached
-        else:
-            db_submenu = await crud.SubmenuCRUD.get_submenu_by_id(db=self.session, submenu_id=submenu_id)
-        if db_submenu is None:
-            return None
-        await cache.set_cache(
+        return await cache.read_json(
             f"/api/v1/menus/{menu_id}/submenus/{submenu_id}",
-            jsonable_encoder(db_submenu),
+            lambda db: crud.SubmenuCRUD.get_submenu_by_id(db=db, submenu_id=submenu_id),
+            self.session,
+            scheme=schemes.Submenu,
         )
-        return db_submenu
+
+    async def apply_batch(self, menu_id: int, batch: schemes.SubmenuBatch):
+        res = await crud.SubmenuCRUD.apply_batch(db=self.session, batch=batch, menu_id=menu_id)
+        if not res:
+            return res
+        # The whole subtree is invalidated once, the menus list changes only when submenus are added or removed
+        if res["created"] or res["deleted"]:
+            await cache.delete_cache(f"/api/v1/menus/{menu_id}", "/api/v1/menus/", "/api/v1/menus/tree")
+            warmup.invalidated(menu_id)
+        elif res["updated"]:
+            await cache.delete_cache(f"/api/v1/menus/{menu_id}", "/api/v1/menus/tree")
+            warmup.invalidated(menu_id)
+        return res
 
     async def delete_submenu(self, menu_id: int, submenu_id: int):
         db_submenu = await crud.SubmenuCRUD.delete_submenu(db=self.session, menu_id=menu_id, submenu_id=submenu_id)
         if db_submenu is None:
             return None
-        await cache.delete_cache(f"/api/v1/menus/{menu_id}")
+        await cache.delete_cache(
+            f"/api/v1/menus/{menu_id}/submenus/{submenu_id}",
+            f"/api/v1/menus/{menu_id}/submenus",
+            f"/api/v1/menus/{menu_id}/tree",
+            "/api/v1/menus/",
+            "/api/v1/menus/tree",
+            stale=[f"/api/v1/menus/{menu_id}"],
+        )
+        warmup.invalidated(menu_id)
         return {"status": True, "message": "The submenu has been deleted"}
 
 
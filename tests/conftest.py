@@ -2,6 +2,8 @@ import asyncio
 
 import pytest
 
+from menuapp import profiler
+
 
 @pytest.fixture(scope="session")
 def event_loop():
@@ -9,3 +11,32 @@ def event_loop():
     loop = asyncio.get_event_loop_policy().new_event_loop()
     yield loop
     loop.close()
+
+
+def pytest_configure(config):
+    config.addinivalue_line("markers", "query_budget(queries): fail when a request executes more SQL statements")
+
+
+@pytest.hookimpl(hookwrapper=True)
+def pytest_runtest_call(item):
+    """Records profiles of requests made by tests marked with query_budget and checks them"""
+    marker = item.get_closest_marker("query_budget")
+    if marker is None:
+        yield
+        return
+    budget = marker.args[0]
+    recorded: list[profiler.Profile] = []
+    token = profiler.recording.set(recorded)
+    try:
+        outcome = yield
+    finally:
+        profiler.recording.reset(token)
+    # A failed test is reported as it is, the budget is checked only once it passes
+    outcome.get_result()
+    over = [profile for profile in recorded if len(profile.queries) > budget]
+    if over:
+        lines = [f"Query budget of {budget} exceeded"]
+        for profile in over:
+            lines.append(f"{profile.method} {profile.path}: {len(profile.queries)} queries")
+            lines.extend(f"  {statement}" for statement, _ in profile.queries)
+        pytest.fail("\n".join(lines), pytrace=False)
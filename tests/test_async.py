@@ -1,3 +1,5 @@
+import asyncio
+import json
 import random
 from datetime import datetime
 
@@ -5,8 +7,11 @@ import httpx
 import pytest
 from asgi_lifespan import LifespanManager
 from fastapi import status
+from pydantic import create_model
 
+from menuapp import config, profiler
 from menuapp.main import app
+from menuapp.pagination import Page
 
 random.seed(datetime.now().timestamp())
 
@@ -57,6 +62,34 @@ class TestMenu:
             assert item["submenus_count"] >= 0
             assert item["dishes_count"] >= 0
 
+    async def test_menus_list_is_invalidated(self):
+        """Tests that cached menus list reflects menu creation and removal"""
+        async with LifespanManager(app):
+            async with httpx.AsyncClient(app=app, base_url="http://test") as client:
+                await client.get("/api/v1/menus/")
+                response = await client.post("/api/v1/menus/", json={"title": title + "list", "description": desc})
+                created = response.json()
+                listed = (await client.get("/api/v1/menus/")).json()
+                await client.delete(f"/api/v1/menus/{created['id']}")
+                relisted = (await client.get("/api/v1/menus/")).json()
+        assert created in listed
+        assert created not in relisted
+
+    async def test_menu_item_not_modified(self):
+        """Tests that menu item is sent with ETag and not sent again while it is unchanged"""
+        async with LifespanManager(app):
+            async with httpx.AsyncClient(app=app, base_url="http://test") as client:
+                response = await client.get(f"/api/v1/menus/{menu_id}")
+                etag = response.headers["etag"]
+                cached = await client.get(f"/api/v1/menus/{menu_id}", headers={"If-None-Match": etag})
+                changed = await client.get(f"/api/v1/menus/{menu_id}", headers={"If-None-Match": '"other"'})
+        assert response.status_code == status.HTTP_200_OK
+        assert cached.status_code == status.HTTP_304_NOT_MODIFIED
+        assert cached.headers["etag"] == etag
+        assert not cached.content
+        assert changed.status_code == status.HTTP_200_OK
+        assert changed.json() == response.json()
+
     @pytest.mark.asyncio
     async def test_get_menu_item(self):
         """Tests menu item getter"""
@@ -391,3 +424,357 @@ class TestDish:
         assert response_data
         assert response_data["detail"] == "dish not found"
         TestSubmenu.test_delete_submenu_item(TestSubmenu())
+
+
+@pytest.mark.asyncio
+async def test_counters_under_concurrent_writes():
+    """Tests that dish counters stay correct when dishes are created and deleted concurrently"""
+    async with LifespanManager(app):
+        async with httpx.AsyncClient(app=app, base_url="http://test") as client:
+            menu = (await client.post("/api/v1/menus/", json={"title": title + "counters", "description": desc})).json()
+            url = f"/api/v1/menus/{menu['id']}/submenus"
+            submenu = (await client.post(url, json={"title": title + "counters", "description": desc})).json()
+            url = f"{url}/{submenu['id']}/dishes"
+            responses = await asyncio.gather(
+                *(
+                    client.post(url, json={"title": f"{title} counters {i}", "description": desc, "price": "1.50"})
+                    for i in range(10)
+                )
+            )
+            await asyncio.gather(*(client.delete(f"{url}/{response.json()['id']}") for response in responses[:4]))
+            counted_menu = (await client.get(f"/api/v1/menus/{menu['id']}")).json()
+            counted_submenu = (await client.get(f"/api/v1/menus/{menu['id']}/submenus/{submenu['id']}")).json()
+            await client.delete(f"/api/v1/menus/{menu['id']}")
+    assert counted_menu["submenus_count"] == 1
+    assert counted_menu["dishes_count"] == 6
+    assert counted_submenu["dishes_count"] == 6
+
+
+@pytest.mark.asyncio
+async def test_dishes_batch():
+    """Tests that dishes are created, updated and deleted in a batch with counters and cache kept up to date"""
+    async with LifespanManager(app):
+        async with httpx.AsyncClient(app=app, base_url="http://test") as client:
+            menu = (await client.post("/api/v1/menus/", json={"title": title + "batch", "description": desc})).json()
+            menu_url = f"/api/v1/menus/{menu['id']}"
+            batch = {"create": [{"title": f"{title} batch submenu {i}", "description": desc} for i in range(3)]}
+            submenus = (await client.post(f"{menu_url}/submenus:batch", json=batch)).json()["created"]
+            url = f"{menu_url}/submenus/{submenus[0]['id']}/dishes"
+            batch = {
+                "create": [{"title": f"{title} batch {i}", "description": desc, "price": "1.00"} for i in range(3)]
+            }
+            created = (await client.post(f"{url}:batch", json=batch)).json()["created"]
+            await client.get(url)
+            batch = {
+                "create": [{"title": f"{title} batch 3", "description": desc, "price": "2.00"}],
+                "update": [{"id": created[0]["id"], "title": f"{title} batch 0", "description": "updated"}],
+                "delete": [created[1]["id"]],
+            }
+            response = await client.post(f"{url}:batch", json=batch)
+            listed = (await client.get(url)).json()
+            duplicate = await client.post(f"{url}:batch", json={"create": [{"title": f"{title} batch 2"}]})
+            missing = await client.post(f"{url}:batch", json={"delete": [created[1]["id"]]})
+            await client.post(f"{menu_url}/submenus:batch", json={"delete": [submenus[0]["id"], submenus[1]["id"]]})
+            counted_menu = (await client.get(menu_url)).json()
+            await client.delete(menu_url)
+    assert response.status_code == status.HTTP_200_OK
+    result = response.json()
+    assert result["deleted"] == [created[1]["id"]]
+    assert result["updated"][0]["description"] == "updated"
+    assert sorted(dish["id"] for dish in listed) == sorted(
+        [created[0]["id"], created[2]["id"], result["created"][0]["id"]]
+    )
+    assert duplicate.status_code == status.HTTP_400_BAD_REQUEST
+    assert missing.status_code == status.HTTP_404_NOT_FOUND
+    assert counted_menu["submenus_count"] == 1
+    assert counted_menu["dishes_count"] == 0
+
+
+@pytest.mark.asyncio
+async def test_batch_parent_not_found():
+    """Tests that batches are not created under a missing menu or a submenu of another menu"""
+    async with LifespanManager(app):
+        async with httpx.AsyncClient(app=app, base_url="http://test") as client:
+            menu = (await client.post("/api/v1/menus/", json={"title": title + "parent", "description": desc})).json()
+            other = (await client.post("/api/v1/menus/", json={"title": title + "other", "description": desc})).json()
+            submenu = (await client.post(f"/api/v1/menus/{menu['id']}/submenus", json={"title": title})).json()
+            batch = {"create": [{"title": f"{title} parent", "description": desc, "price": "1.00"}]}
+            no_menu = await client.post("/api/v1/menus/0/submenus:batch", json=batch)
+            no_submenu = await client.post(
+                f"/api/v1/menus/{other['id']}/submenus/{submenu['id']}/dishes:batch", json=batch
+            )
+            counted = (await client.get(f"/api/v1/menus/{other['id']}")).json()
+            await client.delete(f"/api/v1/menus/{menu['id']}")
+            await client.delete(f"/api/v1/menus/{other['id']}")
+    assert no_menu.status_code == status.HTTP_404_NOT_FOUND
+    assert no_submenu.status_code == status.HTTP_404_NOT_FOUND
+    assert counted["dishes_count"] == 0
+
+
+@pytest.mark.asyncio
+async def test_menu_tree():
+    """Tests that menu tree holds submenus with dishes and reflects their changes"""
+    async with LifespanManager(app):
+        async with httpx.AsyncClient(app=app, base_url="http://test") as client:
+            menu = (await client.post("/api/v1/menus/", json={"title": title + "tree", "description": desc})).json()
+            menu_url = f"/api/v1/menus/{menu['id']}"
+            submenu = (await client.post(f"{menu_url}/submenus", json={"title": title + "tree"})).json()
+            url = f"{menu_url}/submenus/{submenu['id']}/dishes"
+            dish = (await client.post(url, json={"title": title + "tree", "price": "1.00"})).json()
+            tree = (await client.get(f"{menu_url}/tree")).json()
+            catalog = (await client.get("/api/v1/menus/tree")).json()
+            await client.patch(f"{url}/{dish['id']}", json={"title": title + "tree", "price": "2.00"})
+            updated_tree = (await client.get(f"{menu_url}/tree")).json()
+            updated_catalog = (await client.get("/api/v1/menus/tree")).json()
+            await client.delete(menu_url)
+            missing = await client.get(f"{menu_url}/tree")
+    assert tree["dishes_count"] == 1
+    assert tree["submenus"] == [submenu | {"dishes_count": 1, "dishes": [dish]}]
+    assert tree in catalog
+    assert updated_tree["submenus"][0]["dishes"][0]["price"] == "2.00"
+    assert updated_tree in updated_catalog
+    assert missing.status_code == status.HTTP_404_NOT_FOUND
+
+
+@pytest.mark.asyncio
+async def test_menu_tree_order():
+    """Tests that menu tree lists submenus and dishes by id, also after the first ones are updated"""
+    async with LifespanManager(app):
+        async with httpx.AsyncClient(app=app, base_url="http://test") as client:
+            menu = (await client.post("/api/v1/menus/", json={"title": title + "order", "description": desc})).json()
+            menu_url = f"/api/v1/menus/{menu['id']}"
+            batch = {"create": [{"title": f"{title} order {i}"} for i in range(3)]}
+            submenus = (await client.post(f"{menu_url}/submenus:batch", json=batch)).json()["created"]
+            url = f"{menu_url}/submenus/{submenus[0]['id']}"
+            batch = {"create": [{"title": f"{title} order {i}", "price": f"{i}.00"} for i in range(3)]}
+            dishes = (await client.post(f"{url}/dishes:batch", json=batch)).json()["created"]
+            await client.patch(url, json={"title": f"{title} order 0", "description": "updated"})
+            await client.patch(f"{url}/dishes/{dishes[0]['id']}", json={"title": f"{title} order 0", "price": "9.00"})
+            first = await client.get(f"{menu_url}/tree")
+            second = await client.get(f"{menu_url}/tree")
+            await client.delete(menu_url)
+    tree = first.json()
+    assert [item["id"] for item in tree["submenus"]] == [item["id"] for item in submenus]
+    assert [item["id"] for item in tree["submenus"][0]["dishes"]] == [item["id"] for item in dishes]
+    assert first.headers["etag"] == second.headers["etag"]
+
+
+@pytest.mark.asyncio
+async def test_dishes_pages():
+    """Tests keyset pagination and projection of dishes list and that pages are invalidated with the list"""
+    async with LifespanManager(app):
+        async with httpx.AsyncClient(app=app, base_url="http://test") as client:
+            menu = (await client.post("/api/v1/menus/", json={"title": title + "pages", "description": desc})).json()
+            menu_url = f"/api/v1/menus/{menu['id']}"
+            submenu = (await client.post(f"{menu_url}/submenus", json={"title": title + "pages"})).json()
+            url = f"{menu_url}/submenus/{submenu['id']}/dishes"
+            batch = {"create": [{"title": f"{title} pages {i}", "price": f"{i}.00"} for i in range(5)]}
+            dishes = (await client.post(f"{url}:batch", json=batch)).json()["created"]
+            first = (await client.get(url, params={"limit": 2})).json()
+            second = (await client.get(url, params={"limit": 2, "after": first[-1]["id"]})).json()
+            projected = (await client.get(url, params={"limit": 2, "fields": "price"})).json()
+            unknown = await client.get(url, params={"fields": "price,secret"})
+            await client.patch(f"{url}/{dishes[0]['id']}", json={"title": f"{title} pages 0", "price": "9.00"})
+            updated = (await client.get(url, params={"limit": 2, "fields": "price"})).json()
+            await client.delete(menu_url)
+    assert first == dishes[:2]
+    assert second == dishes[2:4]
+    assert projected == [{"id": dish["id"], "price": dish["price"]} for dish in dishes[:2]]
+    assert unknown.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+    assert updated[0] == {"id": dishes[0]["id"], "price": "9.00"}
+
+
+def test_projection_of_schemes_with_same_name():
+    """Tests that projections are cached by scheme class, not by its name"""
+    menu = create_model("Item", id=(int, ...), title=(str, ...))
+    dish = create_model("Item", id=(int, ...), price=(str, ...))
+    assert Page(fields=("id",)).scheme(menu).__fields__["id"].type_ is int
+    assert Page(fields=("id",)).scheme(dish) is not Page(fields=("id",)).scheme(menu)
+    assert list(Page(fields=("id", "price")).scheme(dish).__fields__) == ["id", "price"]
+
+
+@pytest.mark.asyncio
+async def test_streamed_lists():
+    """Tests that dishes and the whole catalog are streamed as NDJSON"""
+    async with LifespanManager(app):
+        async with httpx.AsyncClient(app=app, base_url="http://test") as client:
+            menu = (await client.post("/api/v1/menus/", json={"title": title + "stream", "description": desc})).json()
+            menu_url = f"/api/v1/menus/{menu['id']}"
+            submenu = (await client.post(f"{menu_url}/submenus", json={"title": title + "stream"})).json()
+            url = f"{menu_url}/submenus/{submenu['id']}/dishes"
+            batch = {"create": [{"title": f"{title} stream {i}", "price": f"{i}.00"} for i in range(3)]}
+            dishes = (await client.post(f"{url}:batch", json=batch)).json()["created"]
+            streamed = await client.get(url, headers={"Accept": "application/x-ndjson"})
+            params = {"limit": 1, "after": dishes[0]["id"], "fields": "price"}
+            paged = await client.get(url, params=params, headers={"Accept": "application/x-ndjson"})
+            catalog = await client.get("/api/v1/catalog")
+            await client.delete(menu_url)
+    assert streamed.headers["content-type"] == "application/x-ndjson"
+    assert [json.loads(line) for line in streamed.text.splitlines()] == dishes
+    assert [json.loads(line) for line in paged.text.splitlines()] == [{"id": dishes[1]["id"], "price": "1.00"}]
+    lines = [json.loads(line) for line in catalog.text.splitlines()]
+    types = [line["type"] for line in lines]
+    assert types == sorted(types, key=["menu", "submenu", "dish"].index)
+    assert {"type": "submenu", "menu_id": menu["id"], **submenu, "dishes_count": 3} in lines
+    assert {"type": "dish", "menu_id": menu["id"], "submenu_id": submenu["id"], **dishes[0]} in lines
+
+
+@pytest.mark.asyncio
+async def test_titles_unique_within_parent():
+    """Tests that titles repeat only under different parents and that taken titles are rejected"""
+    async with LifespanManager(app):
+        async with httpx.AsyncClient(app=app, base_url="http://test") as client:
+            menu = (await client.post("/api/v1/menus/", json={"title": title + "unique", "description": desc})).json()
+            menu_url = f"/api/v1/menus/{menu['id']}"
+            urls = []
+            for i in range(2):
+                submenu = (await client.post(f"{menu_url}/submenus", json={"title": f"{title} unique {i}"})).json()
+                urls.append(f"{menu_url}/submenus/{submenu['id']}/dishes")
+            dishes = [(await client.post(url, json={"title": title, "price": "1.00"})).json() for url in urls]
+            other = (await client.post(urls[0], json={"title": title + "other", "price": "1.00"})).json()
+            duplicate = await client.post(urls[0], json={"title": title, "price": "2.00"})
+            renamed = await client.patch(f"{urls[0]}/{other['id']}", json={"title": title, "price": "1.00"})
+            submenu = await client.post(f"{menu_url}/submenus", json={"title": f"{title} unique 0"})
+            listed = (await client.get(urls[0])).json()
+            counted_menu = (await client.get(menu_url)).json()
+            await client.delete(menu_url)
+    assert dishes[0]["title"] == dishes[1]["title"] == title
+    assert duplicate.status_code == status.HTTP_400_BAD_REQUEST
+    assert duplicate.json()["detail"] == "dish already exists"
+    assert renamed.status_code == status.HTTP_400_BAD_REQUEST
+    assert submenu.status_code == status.HTTP_400_BAD_REQUEST
+    assert sorted(dish["title"] for dish in listed) == sorted([title, title + "other"])
+    assert counted_menu["submenus_count"] == 2
+    assert counted_menu["dishes_count"] == 3
+
+
+@pytest.mark.asyncio
+async def test_pool_metrics():
+    """Tests that connection pool state is exported"""
+    async with LifespanManager(app):
+        async with httpx.AsyncClient(app=app, base_url="http://test") as client:
+            await client.get("/api/v1/menus/tree")
+            response = await client.get("/metrics")
+    assert response.status_code == status.HTTP_200_OK
+    for name in ("db_pool_size", "db_pool_checked_out", "db_pool_overflow", "db_pool_wait_seconds_count"):
+        assert f"\n{name} " in response.text
+
+
+@pytest.mark.asyncio
+async def test_request_metrics():
+    """Tests that latency, SQL statements and cache reads are exported by route template"""
+    async with LifespanManager(app):
+        async with httpx.AsyncClient(app=app, base_url="http://test") as client:
+            await client.get("/api/v1/menus/0/tree")
+            response = await client.get("/metrics")
+    labels = 'method="GET",route="/api/v1/menus/{menu_id}/tree",status="404"'
+    assert f"http_request_duration_seconds_count{{{labels}}}" in response.text
+    assert 'http_request_db_queries_bucket{le="1.0",route="/api/v1/menus/{menu_id}/tree"}' in response.text
+    assert 'db_query_duration_seconds_count{result="ok",statement="SELECT"}' in response.text
+    assert 'cache_requests_total{operation="read",result=' in response.text
+
+
+@pytest.mark.asyncio
+async def test_failed_statement_metrics():
+    """Tests that statements failing in the database are timed with the error result"""
+    async with LifespanManager(app):
+        async with httpx.AsyncClient(app=app, base_url="http://test") as client:
+            menus = [
+                (await client.post("/api/v1/menus/", json={"title": f"{title} failed {i}", "description": desc})).json()
+                for i in range(2)
+            ]
+            renamed = await client.patch(f"/api/v1/menus/{menus[1]['id']}", json={"title": menus[0]["title"]})
+            response = await client.get("/metrics")
+            for menu in menus:
+                await client.delete(f"/api/v1/menus/{menu['id']}")
+    assert renamed.status_code == status.HTTP_400_BAD_REQUEST
+    assert 'db_query_duration_seconds_count{result="error",statement="UPDATE"}' in response.text
+
+
+@pytest.mark.asyncio
+@pytest.mark.query_budget(6)
+async def test_create_dish_query_budget():
+    """Tests that creating a dish and reading it back stay within the query budget"""
+    async with httpx.AsyncClient(app=app, base_url="http://test") as client:
+        menu = await client.post("/api/v1/menus/", json={"title": f"{title} budget", "description": desc})
+        url = f"/api/v1/menus/{menu.json()['id']}"
+        submenu = await client.post(f"{url}/submenus", json={"title": f"{title} budget", "description": desc})
+        dishes_url = f"{url}/submenus/{submenu.json()['id']}/dishes"
+        dish = await client.post(dishes_url, json={"title": f"{title} budget", "description": desc, "price": "1.5"})
+        response = await client.get(f"{dishes_url}/{dish.json()['id']}")
+        await client.delete(url)
+    assert response.status_code == status.HTTP_200_OK
+
+
+@pytest.mark.asyncio
+async def test_update_single_statement():
+    """Tests that an update is a single statement and that a rejected one leaves the cache as it was"""
+    async with httpx.AsyncClient(app=app, base_url="http://test") as client:
+        menu = await client.post("/api/v1/menus/", json={"title": f"{title} update", "description": desc})
+        url = f"/api/v1/menus/{menu.json()['id']}"
+        submenu = await client.post(f"{url}/submenus", json={"title": f"{title} update"})
+        dishes_url = f"{url}/submenus/{submenu.json()['id']}/dishes"
+        batch = {"create": [{"title": f"{title} update {i}", "price": "1.00"} for i in range(2)]}
+        dishes = (await client.post(f"{dishes_url}:batch", json=batch)).json()["created"]
+        dish_url = f"{dishes_url}/{dishes[0]['id']}"
+        recorded: list[profiler.Profile] = []
+        token = profiler.recording.set(recorded)
+        try:
+            updated = await client.patch(dish_url, json={"title": f"{title} updated", "price": "2.00"})
+            rejected = await client.patch(dish_url, json={"title": dishes[1]["title"], "price": "3.00"})
+            missing = await client.patch(f"{url}/submenus/0/dishes/{dishes[0]['id']}", json={"title": title})
+        finally:
+            profiler.recording.reset(token)
+        read = await client.get(dish_url)
+        await client.delete(url)
+    assert updated.status_code == status.HTTP_200_OK
+    assert rejected.status_code == status.HTTP_400_BAD_REQUEST
+    assert missing.status_code == status.HTTP_404_NOT_FOUND
+    assert [len(profile.queries) for profile in recorded] == [1, 1, 1]
+    assert read.json() == updated.json() == {**dishes[0], "title": f"{title} updated", "price": "2.00"}
+
+
+@pytest.mark.asyncio
+async def test_server_timing(monkeypatch):
+    """Tests that profiled responses report time spent in the database and Redis and repeated queries"""
+    monkeypatch.setattr(config, "PROFILE_REQUESTS", True)
+    async with httpx.AsyncClient(app=app, base_url="http://test") as client:
+        response = await client.get("/api/v1/menus/0/tree")
+        profiles = await client.get("/debug/profiles")
+    assert response.headers["Server-Timing"].startswith("db;dur=")
+    assert profiles.json()[0]["path"] == "/api/v1/menus/0/tree"
+    assert profiles.json()[0]["commands"]
+
+
+def test_repeated_query_shapes():
+    """Tests that statements differing only in parameters and IN lists are counted as one shape"""
+    repeated = profiler.Profile()
+    repeated.queries = [
+        ("SELECT dishes.id FROM dishes WHERE dishes.submenu_id = $1", 0.0),
+        ("SELECT dishes.id FROM dishes\n WHERE dishes.submenu_id = $2", 0.0),
+        ("SELECT dishes.id FROM dishes WHERE dishes.submenu_id = 3", 0.0),
+        ("SELECT menus.id FROM menus WHERE menus.id IN ($1, $2)", 0.0),
+        ("SELECT menus.id FROM menus WHERE menus.id IN ($1, $2, $3)", 0.0),
+        ("UPDATE menus SET dishes_count = $1", 0.0),
+    ]
+    assert repeated.repeated(threshold=2) == {
+        "SELECT dishes.id FROM dishes WHERE dishes.submenu_id = ?": 3,
+        "SELECT menus.id FROM menus WHERE menus.id IN (?)": 2,
+    }
+
+
+@pytest.mark.asyncio
+async def test_fill_drops_cached_menus():
+    """Tests that menus cached before the test menu is filled in are not served afterwards"""
+    async with LifespanManager(app):
+        async with httpx.AsyncClient(app=app, base_url="http://test") as client:
+            menu = (await client.post("/api/v1/menus/", json={"title": f"{title} fill", "description": desc})).json()
+            await client.get("/api/v1/menus/")
+            await client.get(f"/api/v1/menus/{menu['id']}")
+            filled = await client.post("/api/v1/fill/", json={"password": config.SPECIAL_PASSWORD})
+            listed = (await client.get("/api/v1/menus/")).json()
+            item = await client.get(f"/api/v1/menus/{menu['id']}")
+    assert filled.json()["status"] is True
+    assert listed
+    assert menu["title"] not in [listed_menu["title"] for listed_menu in listed]
+    assert item.status_code == status.HTTP_404_NOT_FOUND or item.json()["title"] != menu["title"]
@@ -0,0 +1,36 @@
+from benchmarks.catalog import generate
+from benchmarks.compare import regressions
+from benchmarks.driver import percentile, summarize
+
+
+def test_generate_catalog_size():
+    """Tests that generated catalog has menus × submenus × dishes rows with distinct titles"""
+    rows = list(generate(2, 3, 4, prefix="test"))
+    assert len(rows) == 24
+    assert len({row["dish_title"] for row in rows}) == 24
+    assert len({row["submenu_title"] for row in rows}) == 6
+    assert all(row["menu_title"].startswith("test menu ") for row in rows)
+    assert len(list(generate(2, 3, 0))) == 6
+
+
+def test_summarize_percentiles():
+    """Tests that latencies are summarized with nearest-rank percentiles in milliseconds"""
+    latencies = [i / 1000 for i in range(100, 0, -1)]
+    assert percentile([], 95) == 0.0
+    assert summarize(latencies, 2.0, errors=1) == {
+        "calls": 100,
+        "errors": 1,
+        "throughput": 50.0,
+        "mean_ms": 50.5,
+        "p50_ms": 50.0,
+        "p95_ms": 95.0,
+        "p99_ms": 99.0,
+        "max_ms": 100.0,
+    }
+
+
+def test_regressions():
+    """Tests that only results whose latency grew over the threshold are reported"""
+    old = {"results": {"get": {"1": {"p95_ms": 10.0}, "10": {"p95_ms": 10.0}}}}
+    new = {"results": {"get": {"1": {"p95_ms": 11.0}, "10": {"p95_ms": 13.0}}, "new": {"1": {"p95_ms": 1.0}}}}
+    assert regressions(old, new, "p95_ms", 0.2) == [("get", "10", 10.0, 13.0)]
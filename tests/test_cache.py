@@ -0,0 +1,296 @@
+import asyncio
+import json
+import time
+import uuid
+
+import pytest
+
+from menuapp import cache, codecs, config
+from menuapp.local_cache import MISSING, LocalCache
+
+prefix = f"/test/{uuid.uuid4().hex}/menus"
+
+
+@pytest.mark.asyncio
+async def test_stop_keeps_cached_values():
+    """Tests that closing connections on shutdown does not drop the cache"""
+    url = f"{prefix}/100"
+    await cache.set_cache(url, {"url": url})
+    await cache.stop()
+    assert cache.redis_client is None
+
+    cache.local_cache.clear()
+    assert await cache.get_cache(url) == {"url": url}
+    await cache.delete_cache(url)
+
+
+@pytest.mark.asyncio
+async def test_delete_cache_drops_subtree_only():
+    """Tests that invalidating a menu drops keys cached under it and nothing else"""
+    under_menu = [f"{prefix}/1", f"{prefix}/1/submenus/2", f"{prefix}/1/submenus/2/dishes/3"]
+    other_menu = f"{prefix}/10/submenus/20"
+    for url in [*under_menu, other_menu]:
+        await cache.set_cache(url, {"url": url})
+    version = await cache.catalog_version()
+
+    await cache.delete_cache(f"{prefix}/1")
+
+    for url in under_menu:
+        assert await cache.get_cache(url) is None
+    assert await cache.get_cache(other_menu) == {"url": other_menu}
+    assert not await cache.client().exists(f"tag:{prefix}/1", f"tag:{prefix}/1/submenus/2")
+    assert await cache.catalog_version() != version
+    await cache.delete_cache(f"{prefix}/10")
+
+
+@pytest.mark.asyncio
+async def test_delete_cache_nested_node():
+    """Tests that invalidating a submenu keeps its menu cached"""
+    await cache.set_cache(f"{prefix}/5", {"id": 5})
+    await cache.set_cache(f"{prefix}/5/submenus/6/dishes/7", {"id": 7})
+
+    await cache.delete_cache(f"{prefix}/5/submenus/6")
+
+    assert await cache.get_cache(f"{prefix}/5/submenus/6/dishes/7") is None
+    assert await cache.get_cache(f"{prefix}/5") == {"id": 5}
+    await cache.delete_cache(f"{prefix}/5")
+
+
+@pytest.mark.asyncio
+async def test_delete_tree(monkeypatch):
+    """Tests that deleting a collection drops everything cached under it without scanning the keyspace"""
+    other = f"/test/{uuid.uuid4().hex}/menus/1"
+    urls = [f"{prefix}/", f"{prefix}/?limit=2", f"{prefix}/tree", f"{prefix}/30", f"{prefix}/30/submenus/31/dishes"]
+    for url in [*urls, other]:
+        await cache.set_cache(url, {"url": url})
+    await cache.delete_cache(f"{prefix}/30")
+    monkeypatch.setattr(cache.client(), "scan_iter", None)
+
+    await cache.delete_tree(prefix)
+
+    for url in urls:
+        assert await cache.get_cache(url) is None
+        assert not await cache.client().exists(url, f"stale:{url}")
+    assert not await cache.client().exists(f"tag:{prefix}", f"tag:{prefix}/30", f"tree:{prefix}")
+    assert await cache.get_cache(other) == {"url": other}
+    await cache.delete_tree(other.rsplit("/", 1)[0])
+
+
+@pytest.mark.asyncio
+async def test_set_many():
+    """Tests that a batch of values is cached with TTL and registered under its nodes"""
+    values = {f"{prefix}/8/submenus": [{"id": 9}], f"{prefix}/8/submenus/9": {"id": 9}}
+    await cache.set_many(values, ttl=60)
+
+    for url, value in values.items():
+        assert await cache.get_cache(url) == value
+        assert 60 < await cache.client().ttl(url) <= 60 + config.CACHE_STALE_TTL
+    await cache.delete_cache(f"{prefix}/8")
+    assert await cache.get_cache(f"{prefix}/8/submenus") is None
+
+
+def test_local_cache_lru_and_ttl(monkeypatch):
+    """Tests that local cache keeps the most recently used entries until they expire"""
+    local = LocalCache(maxsize=2, ttl=10)
+    local.set("a", 1)
+    local.set("b", 2)
+    local.get("a")
+    local.set("c", 3)
+    assert local.get("b") is MISSING
+    assert local.get("a") == 1
+    now = time.monotonic()
+    monkeypatch.setattr(time, "monotonic", lambda: now + 11)
+    assert local.get("a") is MISSING
+
+
+@pytest.mark.asyncio
+async def test_local_cache_invalidated_by_other_worker():
+    """Tests that invalidation published by another worker drops the local copies"""
+    url = f"{prefix}/11/submenus/12"
+    message = {"source": "other worker", "keys": [], "nodes": [f"{prefix}/11"]}
+    await cache.start_listener()
+    try:
+        await asyncio.sleep(0.1)
+        cache.local_cache.set(url, b'{"id":12}')
+        cache.local_cache.set(f"{prefix}/110", b'{"id":110}')
+        await cache.client().publish(cache.INVALIDATION_CHANNEL, json.dumps(message))
+        await asyncio.sleep(0.1)
+    finally:
+        await cache.stop_listener()
+    assert cache.local_cache.get(url) is MISSING
+    assert cache.local_cache.get(f"{prefix}/110") == b'{"id":110}'
+
+
+@pytest.mark.asyncio
+async def test_read_through_single_flight():
+    """Tests that concurrent misses for the same url query the database once"""
+    url = f"{prefix}/13"
+    calls = []
+
+    async def loader(db):
+        calls.append(db)
+        await asyncio.sleep(0.05)
+        return {"id": 13}
+
+    results = await asyncio.gather(*(cache.read_through(url, loader, None) for _ in range(5)))
+    assert results == [{"id": 13}] * 5
+    assert len(calls) == 1
+    assert await cache.read_through(url, loader, None) == {"id": 13}
+    assert len(calls) == 1
+    await cache.delete_cache(url)
+
+
+@pytest.mark.asyncio
+async def test_stale_value_served_while_refreshing():
+    """Tests that a value the change does not touch is served stale while a single background task reloads it"""
+    url = f"{prefix}/14/submenus/1"
+    calls = []
+
+    async def loader(db):
+        calls.append(db)
+        return {"id": 1, "version": len(calls)}
+
+    await cache.read_through(url, loader, None)
+    await cache.delete_cache(stale=[f"{prefix}/14"])
+    assert await cache.get_cache(url) is None
+
+    lock = cache.client().lock(f"lock:{url}", timeout=5)
+    await lock.acquire()
+    assert await cache.read_through(url, loader, None) == {"id": 1, "version": 1}
+    await asyncio.gather(*cache.refreshes)
+    assert len(calls) == 1
+    await lock.release()
+    results = await asyncio.gather(*(cache.read_through(url, loader, None) for _ in range(5)))
+    assert results == [{"id": 1, "version": 1}] * 5
+    await asyncio.gather(*cache.refreshes)
+    assert len(calls) == 2
+    assert await cache.read_through(url, loader, None) == {"id": 1, "version": 2}
+    assert not await cache.client().exists(f"stale:{url}")
+    await cache.delete_cache(f"{prefix}/14")
+
+
+@pytest.mark.asyncio
+async def test_deleted_value_is_not_served_stale():
+    """Tests that a deleted value is not kept stale, even when its menu is"""
+    url = f"{prefix}/15/submenus/1"
+    await cache.set_cache(url, {"id": 1})
+    await cache.delete_cache(url, stale=[f"{prefix}/15"])
+    assert not await cache.client().exists(url, f"stale:{url}")
+
+    async def loader(db):
+        return None
+
+    assert await cache.read_through(url, loader, None) is None
+
+
+@pytest.mark.asyncio
+async def test_value_loaded_before_change_is_not_cached():
+    """Tests that a value loaded while the catalog changes is returned, but not cached over the invalidation"""
+    url = f"{prefix}/18"
+
+    async def loader(db):
+        await cache.delete_cache(url)
+        return {"id": 18}
+
+    assert await cache.read_through(url, loader, None) == {"id": 18}
+    assert await cache.get_cache(url) is None
+
+
+@pytest.mark.asyncio
+async def test_early_refresh_in_background(monkeypatch):
+    """Tests that a value about to expire is returned and refreshed in the background"""
+    url = f"{prefix}/16"
+    calls = []
+
+    async def loader(db):
+        calls.append(db)
+        return {"id": 16, "version": len(calls)}
+
+    await cache.read_through(url, loader, None, ttl=60)
+    cache.local_cache.discard(url)
+    monkeypatch.setattr(cache, "_should_refresh_early", lambda entry: True)
+    assert await cache.read_through(url, loader, None, ttl=60) == {"id": 16, "version": 1}
+    await asyncio.gather(*cache.refreshes)
+    assert len(calls) == 2
+    cache.local_cache.discard(url)
+    assert await cache.get_cache(url) == {"id": 16, "version": 2}
+    await cache.delete_cache(url)
+
+
+@pytest.mark.parametrize("name", codecs.CODECS)
+def test_codecs_round_trip(name):
+    """Tests that every available codec restores cached values"""
+    codec = codecs.get_codec(name)
+    value = [{"id": "1", "title": "Меню", "description": None, "submenus_count": 2, "dishes_count": 6}]
+    assert codec.loads(codec.dumps(value)) == value
+
+
+def test_incomplete_codec_is_not_created():
+    """Tests that a codec without loads fails when it is created and not on the first cache write"""
+
+    class DumpsOnly(codecs.Codec):
+        def dumps(self, value):
+            return b""
+
+    with pytest.raises(TypeError):
+        DumpsOnly()
+
+
+@pytest.mark.asyncio
+async def test_entry_of_other_codec_is_missing(monkeypatch):
+    """Tests that values written with another codec are not decoded"""
+    url = f"{prefix}/17"
+    await cache.set_cache(url, {"id": 17})
+    cache.local_cache.discard(url)
+    monkeypatch.setattr(cache, "codec", codecs.MsgpackCodec() if cache.codec.is_json else codecs.JsonCodec())
+    assert await cache.get_cache(url) is None
+    monkeypatch.undo()
+    assert await cache.get_cache(url) == {"id": 17}
+    await cache.delete_cache(url)
+
+
+@pytest.mark.asyncio
+async def test_stale_entry_is_not_served_fresh(monkeypatch):
+    """Tests that a stale value is not taken for a fresh one when the fresh entry was written with another codec"""
+    url = f"{prefix}/19/submenus/1"
+    await cache.set_cache(url, {"id": 19})
+    await cache.delete_cache(stale=[f"{prefix}/19"])
+    other = codecs.MsgpackCodec() if cache.codec.is_json else codecs.JsonCodec()
+    await cache.client().set(url, cache.ENTRY_HEADER.pack(other.tag, 0.0, 0.0) + other.dumps({"id": 19}))
+    lock = cache.client().lock(f"lock:{url}", timeout=5)
+    await lock.acquire()
+
+    async def loader(db):
+        return {"id": 19, "version": 2}
+
+    assert await cache.read_through(url, loader, None) == {"id": 19}
+    assert cache.local_cache.get(url) is MISSING
+    await lock.release()
+    await cache.delete_cache(f"{prefix}/19")
+
+
+@pytest.mark.asyncio
+async def test_hits_are_counted_for_found_values(monkeypatch):
+    """Tests that only reads of found values are counted, the counter is bounded and saved periodically"""
+    monkeypatch.setattr(cache, "hits", cache.Counter())
+    monkeypatch.setattr(config, "HITS_MAX_NODES", 1)
+    monkeypatch.setattr(config, "HITS_SAVE_INTERVAL", 3600)
+
+    async def missing(db):
+        return None
+
+    async def found(db):
+        return {"id": 20}
+
+    assert await cache.read_through(f"{prefix}/0", missing, None) is None
+    assert not cache.hits
+    for node in (20, 21, 21, 22):
+        await cache.read_through(f"{prefix}/{node}", found, None)
+    assert cache.hits == {f"{prefix}/21": 2}
+    monkeypatch.setattr(config, "HITS_SAVE_INTERVAL", 0)
+    await cache.read_through(f"{prefix}/21", found, None)
+    await asyncio.gather(*cache.refreshes)
+    assert not cache.hits
+    assert await cache.client().zscore(cache.HITS_KEY, f"{prefix}/21") == 3
+    await cache.forget_hits(f"{prefix}/21")
+    await cache.delete_cache(*(f"{prefix}/{node}" for node in (20, 21, 22)))
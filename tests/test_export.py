@@ -0,0 +1,131 @@
+import os
+import time
+import uuid
+
+import httpx
+import pytest
+from asgi_lifespan import LifespanManager
+from openpyxl import Workbook, load_workbook
+
+from menuapp import cache, crud, models
+from menuapp.database import SessionLocal
+from menuapp.main import app
+from transport import tasks
+from transport.menu_to_excel import convert_menu
+from transport.storage import evict_exports, export_marker, export_path, save_export
+
+rows = [
+    (1, "menu 1", "menu 1 desc", 3, 1, "submenu 1", "submenu 1 desc", 2, "dish 1", "dish 1 desc", "1.00"),
+    (1, "menu 1", "menu 1 desc", 3, 1, "submenu 1", "submenu 1 desc", 2, "dish 2", "dish 2 desc", "2.00"),
+    (1, "menu 1", "menu 1 desc", 3, 2, "submenu 2", "submenu 2 desc", 1, "dish 3", "dish 3 desc", "3.00"),
+    (2, "menu 2", "menu 2 desc", 1, 3, "submenu 3", "submenu 3 desc", 1, "dish 4", "dish 4 desc", "4.00"),
+    # Siblings with the same fields are still separate groups
+    (2, "menu 2", "menu 2 desc", 1, 4, "submenu 3", "submenu 3 desc", 1, "dish 4", "dish 4 desc", "4.00"),
+    (3, "menu 2", "menu 2 desc", 1, 5, "submenu 3", "submenu 3 desc", 1, "dish 4", "dish 4 desc", "4.00"),
+]
+
+
+def test_convert_menu(tmp_path):
+    """Tests that menus, submenus and dishes are grouped and numbered in a single pass"""
+    path = tmp_path / "menu.xlsx"
+    convert_menu(iter(rows), str(path))
+    sheet = load_workbook(path).active
+    assert [list(row) for row in sheet.iter_rows(values_only=True)] == [
+        [1, "menu 1", "menu 1 desc", None, None, None],
+        [None, 1, "submenu 1", "submenu 1 desc", None, None],
+        [None, None, 1, "dish 1", "dish 1 desc", "1.00"],
+        [None, None, 2, "dish 2", "dish 2 desc", "2.00"],
+        [None, 2, "submenu 2", "submenu 2 desc", None, None],
+        [None, None, 1, "dish 3", "dish 3 desc", "3.00"],
+        [2, "menu 2", "menu 2 desc", None, None, None],
+        [None, 1, "submenu 3", "submenu 3 desc", None, None],
+        [None, None, 1, "dish 4", "dish 4 desc", "4.00"],
+        [None, 2, "submenu 3", "submenu 3 desc", None, None],
+        [None, None, 1, "dish 4", "dish 4 desc", "4.00"],
+        [3, "menu 2", "menu 2 desc", None, None, None],
+        [None, 1, "submenu 3", "submenu 3 desc", None, None],
+        [None, None, 1, "dish 4", "dish 4 desc", "4.00"],
+    ]
+
+
+@pytest.mark.asyncio
+async def test_export_of_changed_catalog_is_discarded(tmp_path, monkeypatch):
+    """Tests that the file is saved only if the catalog is of the requested version before and after it is read"""
+    monkeypatch.setattr("transport.config.EXPORT_DIR", str(tmp_path))
+    title = uuid.uuid4().hex
+    async with SessionLocal() as db:
+        menu = models.Menu(title=title, description="", submenus_count=1, dishes_count=1)
+        submenu = models.Submenu(title=title, description="", menu=menu, dishes_count=1)
+        db.add_all([menu, submenu])
+        await db.flush()
+        db.add(models.Dish(title=title, price="1.00", menu_id=menu.id, submenu_id=submenu.id))
+        await db.commit()
+        version = await cache.catalog_version()
+        try:
+            saved = await tasks.export_menu(version, "menu-saved")
+            monkeypatch.setattr(tasks, "menu_rows", changing_rows)
+            changed = await tasks.export_menu(version, "menu-changed")
+        finally:
+            await db.delete(menu)
+            await db.commit()
+    assert saved is True
+    assert title in [row[1] for row in load_workbook(export_path("menu-saved")).active.iter_rows(values_only=True)]
+    assert changed is False
+    assert not os.path.exists(export_path("menu-changed"))
+
+
+async def changing_rows():
+    """Yields rows, the catalog changes while they are read"""
+    yield rows[0]
+    await cache.bump_catalog_version()
+    yield rows[1]
+
+
+@pytest.mark.asyncio
+async def test_existing_export_is_reused():
+    """Tests that an excel file of the current catalog version is served without queuing a task"""
+    async with LifespanManager(app):
+        task_id = f"menu-{await cache.catalog_version()}"
+        save_export(Workbook(), task_id)
+        try:
+            async with httpx.AsyncClient(app=app, base_url="http://test") as client:
+                response = await client.post("/api/v1/xl/create/")
+                assert response.json() == {"task_id": task_id}
+                response = await client.get("/api/v1/xl/get/", params={"task_id": task_id})
+            assert response.status_code == 200
+            assert response.headers["content-type"].startswith("application/vnd.openxmlformats")
+        finally:
+            os.remove(export_path(task_id))
+
+
+@pytest.mark.asyncio
+async def test_evicted_export_is_regenerated(tmp_path, monkeypatch):
+    """Tests that an export is queued again once its file is evicted, but not while the file is there"""
+    monkeypatch.setattr("transport.config.EXPORT_DIR", str(tmp_path))
+    monkeypatch.setattr(crud, "get_status", lambda task_id: "SUCCESS")
+    queued = []
+    monkeypatch.setattr(crud.to_excel, "apply_async", lambda args, task_id: queued.append(task_id))
+    async with LifespanManager(app):
+        task_id = f"menu-{await cache.catalog_version()}"
+        async with httpx.AsyncClient(app=app, base_url="http://test") as client:
+            await client.post("/api/v1/xl/create/")
+            save_export(Workbook(), task_id)
+            await client.post("/api/v1/xl/create/")
+            evicted = evict_exports(max_files=0)
+            expired = (await client.get("/api/v1/xl/get/", params={"task_id": task_id})).json()
+            await client.post("/api/v1/xl/create/")
+        await cache.client().delete(export_marker(task_id))
+    assert evicted == [task_id]
+    assert expired["status"] is False
+    assert queued == [task_id, task_id]
+
+
+def test_evict_exports(tmp_path, monkeypatch):
+    """Tests that least recently used and expired excel files are removed"""
+    monkeypatch.setattr("transport.config.EXPORT_DIR", str(tmp_path))
+    now = time.time()
+    for i, age in enumerate([0, 10, 20, 1000]):
+        save_export(Workbook(), f"menu-{i}")
+        os.utime(export_path(f"menu-{i}"), (now - age, now - age))
+    assert sorted(evict_exports(max_files=2, max_age=500)) == ["menu-2", "menu-3"]
+    assert sorted(os.listdir(tmp_path)) == ["menu-0.xlsx", "menu-1.xlsx"]
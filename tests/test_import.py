@@ -0,0 +1,92 @@
+import json
+
+import pytest
+from sqlalchemy import select, text
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+
+from menuapp import crud, models, schemes
+from menuapp.database import SessionLocal
+from menuapp.importer import JsonCatalogReader, import_catalog
+
+CSV = """menu_title,menu_description,submenu_title,submenu_description,dish_title,dish_description,dish_price
+import menu 1,desc,import submenu 1,desc,import dish 1,desc,1.00
+import menu 1,desc,import submenu 1,desc,import dish 2,desc,2.00
+import menu 1,desc,import submenu 2,desc,import dish 3,desc,3.00
+import menu 2,desc,import submenu 3,desc,,,
+"""
+
+
+def test_json_reader_in_small_chunks():
+    """Tests that catalog entries are parsed the same when objects are cut by chunk boundaries"""
+    with open("menuapp/menu.json", encoding="utf-8") as f:
+        catalog = json.load(f)
+    with open("menuapp/menu.json", encoding="utf-8") as f:
+        entries = list(JsonCatalogReader(f, chunk_size=7))
+    tables = ("menus", "submenus", "dishes")
+    assert entries == [(table, entry) for table, section in zip(tables, catalog) for entry in section]
+
+
+async def check_imported(db: AsyncSession, counts: dict):
+    assert counts == {"menus": 2, "submenus": 3, "dishes": 3}
+    menus = (await db.execute(select(models.Menu).where(models.Menu.title.like("import menu%")))).scalars().all()
+    assert sorted((menu.title, menu.submenus_count, menu.dishes_count) for menu in menus) == [
+        ("import menu 1", 2, 3),
+        ("import menu 2", 1, 0),
+    ]
+    submenu = (await db.execute(select(models.Submenu).where(models.Submenu.title == "import submenu 1"))).scalar()
+    assert submenu.menu_id == min(menu.id for menu in menus)
+    assert submenu.dishes_count == 2
+
+
+@pytest.mark.asyncio
+async def test_import_csv_with_copy(tmp_path):
+    """Tests that CSV catalog is appended to existing rows with COPY and counters are recomputed"""
+    path = tmp_path / "catalog.csv"
+    path.write_text(CSV, encoding="utf-8")
+    async with SessionLocal() as db:
+        counts = await import_catalog(str(path), db, chunk_size=2)
+        menus = (await db.execute(select(models.Menu).where(models.Menu.title.like("import menu%")))).scalars().all()
+        try:
+            await check_imported(db, counts)
+            # New rows get ids after the imported ones
+            menu = await crud.MenuCRUD.create_menu(schemes.MenuBase(title="import menu 3"), db)
+            menus.append(menu)
+            assert menu.id > max(imported.id for imported in menus[:-1])
+        finally:
+            for menu in menus:
+                await crud.MenuCRUD.delete_menu(menu.id, db)
+
+
+@pytest.mark.asyncio
+async def test_import_takes_ids_from_sequences(tmp_path):
+    """Tests that imported rows get ids from the sequences, which are never moved back"""
+    path = tmp_path / "catalog.csv"
+    path.write_text(CSV, encoding="utf-8")
+    async with SessionLocal() as db:
+        # Ids taken by transactions that were rolled back are past the largest id
+        taken = (await db.execute(text("SELECT setval('menus_id_seq', nextval('menus_id_seq') + 10)"))).scalar()
+        await db.commit()
+        await import_catalog(str(path), db)
+        menus = (await db.execute(select(models.Menu).where(models.Menu.title.like("import menu%")))).scalars().all()
+        try:
+            menu = await crud.MenuCRUD.create_menu(schemes.MenuBase(title="import menu 3"), db)
+            menus.append(menu)
+            assert min(imported.id for imported in menus[:-1]) > taken
+            assert menu.id > max(imported.id for imported in menus[:-1])
+        finally:
+            for menu in menus:
+                await crud.MenuCRUD.delete_menu(menu.id, db)
+
+
+@pytest.mark.asyncio
+async def test_import_csv_into_sqlite(tmp_path):
+    """Tests the fallback for databases without COPY"""
+    pytest.importorskip("aiosqlite")
+    path = tmp_path / "catalog.csv"
+    path.write_text(CSV, encoding="utf-8")
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'menu.db'}")
+    async with engine.begin() as conn:
+        await conn.run_sync(models.Base.metadata.create_all)
+    async with AsyncSession(engine) as db:
+        await check_imported(db, await import_catalog(str(path), db))
+    await engine.dispose()
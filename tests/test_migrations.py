@@ -0,0 +1,95 @@
+import json
+
+import pytest
+from alembic import command
+from alembic.autogenerate import compare_metadata
+from alembic.migration import MigrationContext
+from sqlalchemy import event, text
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from menuapp import crud, migrations, models
+from menuapp.database import SessionLocal, engine
+from menuapp.pagination import Page
+
+
+def schema_diff(connection):
+    return compare_metadata(MigrationContext.configure(connection), models.Base.metadata)
+
+
+@pytest.mark.asyncio
+async def test_models_match_migrations():
+    """Tests that the migrated schema is the one the models describe"""
+    await migrations.upgrade(engine)
+    async with engine.connect() as conn:
+        assert await conn.run_sync(schema_diff) == []
+
+
+@pytest.mark.asyncio
+async def test_upgrade_from_scratch(tmp_path):
+    """Tests that migrations build the schema in an empty database"""
+    pytest.importorskip("aiosqlite")
+    sqlite = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'menu.db'}")
+    await migrations.upgrade(sqlite)
+    async with sqlite.connect() as conn:
+        assert await conn.run_sync(schema_diff) == []
+    await sqlite.dispose()
+
+
+@pytest.mark.asyncio
+async def test_repeated_titles_fail_upgrade(tmp_path):
+    """Tests that titles repeated before they were made unique fail the upgrade listing them, none are renamed"""
+    pytest.importorskip("aiosqlite")
+    sqlite = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'menu.db'}")
+    async with sqlite.begin() as conn:
+        await conn.run_sync(lambda connection: command.upgrade(migrations.alembic_config(connection), "0003"))
+        await conn.execute(text("INSERT INTO menus (id, title) VALUES (1, 'menu'), (2, 'menu'), (3, 'other')"))
+        rows = "(1, 'submenu', 1), (2, 'submenu', 1), (3, 'submenu', 2)"
+        await conn.execute(text(f"INSERT INTO submenus (id, title, menu_id) VALUES {rows}"))
+    with pytest.raises(RuntimeError) as error:
+        await migrations.upgrade(sqlite)
+    async with sqlite.connect() as conn:
+        menus = (await conn.execute(text("SELECT title FROM menus ORDER BY id"))).scalars().all()
+    await sqlite.dispose()
+    assert str(error.value).splitlines()[1:] == [
+        "menus title='menu': 2 rows",
+        "submenus menu_id=1 title='submenu': 2 rows",
+    ]
+    assert menus == ["menu", "menu", "other"]
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    "query, index",
+    [
+        (lambda db: crud.SubmenuCRUD.get_submenus(menu_id=1, db=db), "ix_submenus_menu_id_id"),
+        (lambda db: crud.DishCRUD.get_dishes(menu_id=1, submenu_id=1, db=db), "ix_dishes_menu_id_submenu_id_id"),
+        (
+            lambda db: crud.DishCRUD.get_dishes(menu_id=1, submenu_id=1, db=db, page=Page(after=10, limit=10)),
+            "ix_dishes_menu_id_submenu_id_id",
+        ),
+    ],
+)
+async def test_list_queries_use_indexes(query, index):
+    """Tests that list queries can be answered with an index scan"""
+    statements = []
+
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        statements.append((statement, parameters))
+
+    async with SessionLocal() as db:
+        event.listen(engine.sync_engine, "before_cursor_execute", capture)
+        try:
+            await query(db)
+        finally:
+            event.remove(engine.sync_engine, "before_cursor_execute", capture)
+        # Tables of a test database are tiny, so the planner would rather read them whole or sort a bitmap scan
+        await db.execute(text("SET LOCAL enable_seqscan = off"))
+        await db.execute(text("SET LOCAL enable_bitmapscan = off"))
+        statement, parameters = statements[-1]
+        conn = await db.connection()
+        plan = (await conn.exec_driver_sql(f"EXPLAIN (FORMAT JSON) {statement}", parameters)).scalar()
+    plan = json.dumps(plan)
+    assert "Seq Scan" not in plan
+    # Rows come out of the index in id order
+    assert '"Sort"' not in plan
+    assert index in plan
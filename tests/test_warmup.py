@@ -0,0 +1,123 @@
+import json
+import uuid
+
+import pytest
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from menuapp import cache, config, crud, schemes, warmup
+from menuapp.database import SessionLocal
+from services.dish_service import DishService
+from services.menu_service import MenuService
+from services.submenu_service import SubmenuService
+
+
+async def create_menu(db: AsyncSession) -> tuple[int, int, int]:
+    title = f"warmup {uuid.uuid4().hex}"
+    menu = await crud.MenuCRUD.create_menu(schemes.MenuBase(title=title), db)
+    submenu = await crud.SubmenuCRUD.create_submenu(schemes.SubmenuBase(title=title), menu.id, db)
+    dish = await crud.DishCRUD.create_dish(schemes.DishBase(title=title, price="1.50"), menu.id, submenu.id, db)
+    return menu.id, submenu.id, dish.id
+
+
+async def read_all(db: AsyncSession, menu_id: int, submenu_id: int, dish_id: int) -> list:
+    """Reads the menu and everything under it through the services"""
+    menus, submenus, dishes = MenuService(db), SubmenuService(db), DishService(db)
+    payloads = [
+        await menus.read_menu(menu_id),
+        await menus.read_menu_tree(menu_id),
+        await submenus.read_submenus(menu_id),
+        await submenus.read_submenu(menu_id, submenu_id),
+        await dishes.read_dishes(menu_id, submenu_id),
+        await dishes.read_dish(menu_id, submenu_id, dish_id),
+    ]
+    return [json.loads(payload) for payload in payloads]
+
+
+@pytest.mark.asyncio
+async def test_warm_menu_matches_reads(monkeypatch):
+    """Tests that a warmed up menu is served from the cache exactly as it is loaded from the database"""
+    monkeypatch.setattr(config, "WARMUP_MAX_ROWS", 0)
+    async with SessionLocal() as db:
+        ids = await create_menu(db)
+        url = f"/api/v1/menus/{ids[0]}"
+        try:
+            loaded = await read_all(db, *ids)
+            await cache.delete_cache(url)
+            cache.local_cache.clear()
+
+            assert await warmup.warm(ids[0])
+            assert await cache.get_cache(f"{url}/submenus/{ids[1]}/dishes/{ids[2]}") == loaded[-1]
+
+            # Reads without a database session fail unless they are hits
+            assert await read_all(None, *ids) == loaded
+        finally:
+            await crud.MenuCRUD.delete_menu(ids[0], db)
+            await cache.delete_cache(url)
+
+
+@pytest.mark.asyncio
+async def test_warm_hottest_menus(monkeypatch):
+    """Tests that menus read the most are warmed up when the catalog is too big to be cached whole"""
+    monkeypatch.setattr(config, "WARMUP_MAX_ROWS", 0)
+    async with SessionLocal() as db:
+        ids = await create_menu(db)
+        url = f"/api/v1/menus/{ids[0]}"
+        try:
+            for _ in range(10_000):
+                cache._count_hit(f"{url}/submenus")
+            await cache.delete_cache(url)
+
+            assert await warmup.warm()
+            assert url in await cache.hottest(config.WARMUP_MENUS)
+            assert await cache.get_cache(f"{url}/submenus/{ids[1]}") is not None
+        finally:
+            await crud.MenuCRUD.delete_menu(ids[0], db)
+            await cache.delete_cache(url)
+            await cache.forget_hits(url)
+
+
+@pytest.mark.asyncio
+async def test_warm_skipped_after_change(monkeypatch):
+    """Tests that values loaded before the catalog changes are not cached"""
+    monkeypatch.setattr(config, "WARMUP_MAX_ROWS", 0)
+
+    async def outdated():
+        return "outdated"
+
+    async with SessionLocal() as db:
+        ids = await create_menu(db)
+        url = f"/api/v1/menus/{ids[0]}"
+        try:
+            await cache.delete_cache(url)
+            monkeypatch.setattr(cache, "catalog_version", outdated)
+
+            assert not await warmup.warm(ids[0])
+            assert await cache.get_cache(url) is None
+        finally:
+            await crud.MenuCRUD.delete_menu(ids[0], db)
+
+
+@pytest.mark.asyncio
+async def test_warm_changed_menu_of_small_catalog(monkeypatch):
+    """Tests that a change of one menu warms up that menu and not the whole catalog, however small it is"""
+    monkeypatch.setattr(config, "WARMUP_MAX_ROWS", 1_000_000_000)
+    loaded = []
+    get_menus_tree = crud.MenuCRUD.get_menus_tree
+
+    async def tree(db, menu_id=None):
+        loaded.append(menu_id)
+        return await get_menus_tree(db=db, menu_id=menu_id)
+
+    async with SessionLocal() as db:
+        ids = await create_menu(db)
+        url = f"/api/v1/menus/{ids[0]}"
+        try:
+            await cache.delete_cache(url)
+            monkeypatch.setattr(crud.MenuCRUD, "get_menus_tree", tree)
+
+            assert await warmup.warm(ids[0])
+            assert loaded == [ids[0]]
+            assert await cache.get_cache(f"{url}/submenus/{ids[1]}") is not None
+        finally:
+            await crud.MenuCRUD.delete_menu(ids[0], db)
+            await cache.delete_cache(url)
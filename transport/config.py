@@ -11,3 +11,9 @@ REDIS_PORT = cast(int, os.getenv("REDIS_PORT"))
 SPECIAL_PASSWORD = os.getenv("SPECIAL_PASSWORD")
 RABBIT_BROKER = os.getenv("RABBIT_BROKER")
 RABBIT_BACKEND = os.getenv("RABBIT_BACKEND")
+EXPORT_CHUNK_SIZE = int(os.getenv("EXPORT_CHUNK_SIZE", 1000))
+EXPORT_DIR = os.getenv("EXPORT_DIR", "output")
+EXPORT_MAX_FILES = int(os.getenv("EXPORT_MAX_FILES", 10))
+EXPORT_MAX_AGE = int(os.getenv("EXPORT_MAX_AGE", 24 * 60 * 60))
+# Port the worker serves export metrics on in Prometheus format, 0 to disable
+METRICS_PORT = int(os.getenv("METRICS_PORT", 9808))
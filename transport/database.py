@@ -0,0 +1,49 @@
+from collections.abc import AsyncIterator
+
+from sqlalchemy import select
+from sqlalchemy.engine import Row
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.pool import NullPool
+
+from menuapp import models
+
+from . import config
+
+
+def menu_rows_query():
+    """Joined menu rows ordered by menu and submenu"""
+    return (
+        select(
+            models.Menu.id,
+            models.Menu.title,
+            models.Menu.description,
+            models.Menu.dishes_count,
+            models.Submenu.id,
+            models.Submenu.title,
+            models.Submenu.description,
+            models.Submenu.dishes_count,
+            models.Dish.title,
+            models.Dish.description,
+            models.Dish.price,
+        )
+        .join(models.Submenu, models.Dish.submenu_id == models.Submenu.id)
+        .join(models.Menu, models.Dish.menu_id == models.Menu.id)
+        .order_by(models.Menu.id, models.Submenu.id, models.Dish.id)
+    )
+
+
+async def menu_rows() -> AsyncIterator[Row]:
+    """Streams menu rows from a server-side cursor in chunks of EXPORT_CHUNK_SIZE.
+
+    A single statement reads them, so they are consistent even if the catalog changes meanwhile.
+    """
+    # Every task runs in its own event loop, so connections must not outlive it
+    engine = create_async_engine(config.SQLALCHEMY_DATABASE_URL, poolclass=NullPool)
+    try:
+        async with engine.connect() as conn:
+            result = await conn.stream(menu_rows_query().execution_options(yield_per=config.EXPORT_CHUNK_SIZE))
+            async for rows in result.partitions():
+                for row in rows:
+                    yield row
+    finally:
+        await engine.dispose()
@@ -1,4 +1,6 @@
 from celery import Celery
+from celery.signals import worker_init
+from prometheus_client import start_http_server
 
 from . import config
 
@@ -7,5 +9,13 @@ from . import config
 
 app = Celery("transport", broker=config.RABBIT_BROKER, backend=config.RABBIT_BACKEND, include=["transport.tasks"])
 
+
+@worker_init.connect
+def start_metrics_server(**kwargs):
+    """Serves export metrics, tasks run in the worker process itself with the solo pool"""
+    if config.METRICS_PORT:
+        start_http_server(config.METRICS_PORT)
+
+
 if __name__ == "__main__":
     app.start()
@@ -0,0 +1,10 @@
+from prometheus_client import Counter, Histogram
+
+# Exports of big catalogs take minutes and produce files of megabytes
+DURATION_BUCKETS = (0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+SIZE_BUCKETS = tuple(2**power for power in range(12, 30, 2))
+
+export_duration = Histogram("export_duration_seconds", "Time to export the menu to excel", buckets=DURATION_BUCKETS)
+export_size = Histogram("export_size_bytes", "Size of exported excel files", buckets=SIZE_BUCKETS)
+export_rows = Counter("export_rows_total", "Menu rows written to excel files")
+export_failures = Counter("export_failures_total", "Exports that failed")
@@ -1,49 +1,55 @@
+from collections.abc import Iterable, Sequence
+
 from openpyxl import Workbook
 
 
-def convert_to_excel(res: list):
-    wb = Workbook()
-    ws = wb.active
-
-    menu_rows = []
-    submenu_rows = []
-
-    for i, r in enumerate(res[0]):
-        row = i * (r["dishes_count"] + 3) + 1
-        ws.cell(row=row, column=1, value=i + 1)
-        ws.cell(row=row, column=2, value=r["title"])
-        ws.cell(row=row, column=3, value=r["description"])
-        menu_rows.append(row)
-
-    d = 0
-    num = 0
-
-    for i, r in enumerate(res[1]):
-        row = i * (r["dishes_count"] + 1) + 2 + d
-        if row in menu_rows:
-            row += 1
-            num = 0
-        ws.cell(row=row, column=2, value=num + 1)
-        ws.cell(row=row, column=3, value=r["title"])
-        ws.cell(row=row, column=4, value=r["description"])
-        d = row - i * (r["dishes_count"] + 1) - 2
-        num += 1
-        submenu_rows.append(row)
-
-    d = 0
-    num = 0
-
-    for i, r in enumerate(res[2]):
-        row = i + 3 + d
-        row = row + 1 if row in menu_rows else row
-        if row in submenu_rows:
-            row = row + 1
-            num = 0
-        ws.cell(row=row, column=3, value=num + 1)
-        ws.cell(row=row, column=4, value=r["title"])
-        ws.cell(row=row, column=5, value=r["description"])
-        ws.cell(row=row, column=6, value=r["price"])
-        num += 1
-        d = row - i - 3
-
-    wb.save("output/test_menu.xlsx")
+class MenuSheetWriter:
+    """Streams menu rows into a write-only workbook.
+
+    Rows must be ordered by menu and submenu, each row being
+    (menu id, menu title, menu description, menu dishes count,
+     submenu id, submenu title, submenu description, submenu dishes count,
+     dish title, dish description, dish price).
+    A menu or submenu line is written whenever its id changes, so a single pass
+    is enough and only the current groups are kept in memory. Groups are told apart
+    by id, so that siblings with the same titles are not merged.
+    """
+
+    def __init__(self):
+        self.wb = Workbook(write_only=True)
+        self.ws = self.wb.create_sheet()
+        self.menu_id = None
+        self.submenu_id = None
+        self.menu_num = 0
+        self.submenu_num = 0
+        self.dish_num = 0
+
+    def append(self, row: Sequence):
+        menu, submenu, dish = row[0:4], row[4:8], row[8:11]
+        if menu[0] != self.menu_id:
+            self.menu_id, self.submenu_id = menu[0], None
+            self.menu_num += 1
+            self.submenu_num = 0
+            self.ws.append([self.menu_num, menu[1], menu[2]])
+        if submenu[0] != self.submenu_id:
+            self.submenu_id = submenu[0]
+            self.submenu_num += 1
+            self.dish_num = 0
+            self.ws.append([None, self.submenu_num, submenu[1], submenu[2]])
+        self.dish_num += 1
+        self.ws.append([None, None, self.dish_num, dish[0], dish[1], dish[2]])
+
+    def save(self, path: str):
+        self.wb.save(path)
+
+    def discard(self):
+        """Closes the sheet without saving it and removes the temporary file its rows are buffered in"""
+        self.ws.close()
+        self.ws._writer.cleanup()
+
+
+def convert_to_excel(rows: Iterable[Sequence], path: str = "output/test_menu.xlsx"):
+    writer = MenuSheetWriter()
+    for row in rows:
+        writer.append(row)
+    writer.save(path)
@@ -0,0 +1,82 @@
+import os
+import tempfile
+import time
+
+import redis
+from openpyxl import Workbook
+
+from . import config
+
+# Key the application keeps the catalog version under, exports are generated for a version
+CATALOG_VERSION_KEY = "catalog_version"
+
+redis_client: redis.Redis | None = None
+
+
+def client() -> redis.Redis:
+    global redis_client
+    if redis_client is None:
+        redis_client = redis.Redis(host=config.REDIS_HOST, port=config.REDIS_PORT)
+    return redis_client
+
+
+def catalog_version() -> str | None:
+    """Returns current version of the catalog, None if it has not been set yet"""
+    version = client().get(CATALOG_VERSION_KEY)
+    return None if version is None else version.decode()
+
+
+def export_marker(task_id: str) -> str:
+    """Returns Redis key marking that the excel file of the task has been requested"""
+    return f"export:{task_id}"
+
+
+def forget_exports(*task_ids: str):
+    """Drops markers of the tasks, so that their excel files are generated again when requested"""
+    if task_ids:
+        client().delete(*map(export_marker, task_ids))
+
+
+def export_path(task_id: str) -> str:
+    """Returns path of excel file generated by the task"""
+    return os.path.join(config.EXPORT_DIR, f"{os.path.basename(task_id)}.xlsx")
+
+
+def save_export(wb: Workbook, task_id: str):
+    """Saves workbook under a temporary name and then renames it, so a half-written file is never served"""
+    fd, tmp = tempfile.mkstemp(dir=config.EXPORT_DIR, suffix=".tmp")
+    os.close(fd)
+    try:
+        wb.save(tmp)
+        os.replace(tmp, export_path(task_id))
+    except BaseException:
+        os.remove(tmp)
+        raise
+
+
+def touch_export(task_id: str):
+    """Marks excel file as recently used"""
+    os.utime(export_path(task_id))
+
+
+def evict_exports(max_files: int = config.EXPORT_MAX_FILES, max_age: int = config.EXPORT_MAX_AGE) -> list[str]:
+    """Removes least recently used excel files over the limit and files not used for max_age seconds.
+
+    Returns ids of the tasks whose files were removed.
+    """
+    with os.scandir(config.EXPORT_DIR) as entries:
+        files = sorted(
+            (entry for entry in entries if entry.name.endswith(".xlsx")),
+            key=lambda entry: entry.stat().st_mtime,
+            reverse=True,
+        )
+    expired = time.time() - max_age
+    evicted = []
+    for i, entry in enumerate(files):
+        if i >= max_files or entry.stat().st_mtime < expired:
+            try:
+                os.remove(entry.path)
+            except FileNotFoundError:
+                continue
+            evicted.append(entry.name.removesuffix(".xlsx"))
+    return evicted
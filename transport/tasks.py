@@ -1,12 +1,56 @@
+import asyncio
+import os
+
 from celery.result import AsyncResult
 
+from . import metrics
+from .database import menu_rows
 from .main import app
-from .menu_to_excel import convert_menu
+from .save_as_excel import MenuSheetWriter
+from .storage import (
+    catalog_version,
+    evict_exports,
+    export_path,
+    forget_exports,
+    save_export,
+)
+
+
+async def export_menu(version: str, task_id: str) -> bool:
+    """Streams menu rows from database to excel file of the task, returns whether it is saved.
+
+    Nothing is saved unless the catalog is of the version both before and after the rows are read,
+    as the file is served for that version.
+    """
+    if catalog_version() != version:
+        return False
+    writer = MenuSheetWriter()
+    rows = 0
+    with metrics.export_failures.count_exceptions(), metrics.export_duration.time():
+        async for row in menu_rows():
+            writer.append(row)
+            rows += 1
+        if catalog_version() != version:
+            writer.discard()
+            return False
+        save_export(writer.wb, task_id)
+    metrics.export_rows.inc(rows)
+    metrics.export_size.observe(os.path.getsize(export_path(task_id)))
+    return True
 
 
 @app.task
-def to_excel(res):
-    convert_menu(res)
+def to_excel(version: str, task_id: str) -> bool:
+    try:
+        saved = asyncio.run(export_menu(version, task_id))
+    except Exception:
+        forget_exports(task_id)
+        raise
+    if not saved:
+        # The catalog has changed, a new version is exported when it is requested
+        forget_exports(task_id)
+    forget_exports(*evict_exports())
+    return saved
 
 
 @app.task